@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Reading metadata from many ebooks at once, possibly across several processes.
+
+Metadata is read in worker processes and shipped back to the caller in compact
+form (see `MetadataDict.to_compact`), which is much cheaper to pickle than the
+full records. Alternatively, workers may write their results to rings in
+shared memory (see `channel`), to be unpacked by the caller only as needed.
+Results are returned in the same order as the input paths,
+regardless of which worker finished first, and a failure to read one file is
+reported in its result rather than stopping the whole run.
+
+The number of files in flight at any time is bounded, so huge libraries can be
+streamed through without the backlog of results growing without limit.
+
+If profiling is on (see `instrument`), the figures collected in the workers are
+sent back with their results and merged into the caller's profiler.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple, deque
+from itertools import islice
+import os
+import signal
+
+from biblio.sniffmetadata.handles import HandlePool
+from biblio.sniffmetadata.instrument import get_profiler, set_profiler, Profiler
+from biblio.sniffmetadata.metadata import MetadataDict
+from biblio.sniffmetadata.readers.registry import default_registry
+
+
+### CONSTANTS & DEFINES
+
+# how many paths are sent to a worker at once
+DEFAULT_CHUNKSIZE = 8
+
+# how many chunks per worker may be queued or waiting to be collected
+CHUNKS_IN_FLIGHT = 2
+
+
+### IMPLEMENTATION ###
+
+# through which books are opened, so they are closed promptly & can be counted
+handle_pool = HandlePool()
+
+
+class ScanResult (namedtuple ('ScanResult', ['path', 'record', 'error'])):
+	"""
+	The outcome of reading a single ebook.
+
+	:Parameters:
+		path
+			The path of the ebook as passed in.
+		record
+			The compact metadata record, or `None` if there was none or it could
+			not be read.
+		error
+			A description of the error if reading failed, otherwise `None`.
+
+	"""
+	__slots__ = ()
+
+	def metadata (self):
+		"""
+		Return the full metadata record, or `None` if there is none.
+		"""
+		if self.record is None:
+			return None
+		return MetadataDict.from_compact (self.record)
+
+
+def reader_for_path (path):
+	"""
+	Return the reader class to be used for a given ebook file.
+
+	:Returns:
+		A reader class, as chosen by the default registry.
+
+	An error is raised if the format is not recognised.
+	"""
+	rdr = default_registry.reader_for_path (path)
+	if rdr is None:
+		raise ValueError ("unrecognised format")
+	return rdr
+
+
+def sniff_path (path):
+	"""
+	Read the metadata from a single ebook, trapping any errors.
+
+	:Returns:
+		A `ScanResult`.
+
+	"""
+	try:
+		with handle_pool.reader (reader_for_path (path), path) as rdr:
+			md = rdr.read_metadata_as_dublincore()
+		if md is not None:
+			md = md.to_compact()
+		return ScanResult (path, md, None)
+	except Exception, err:
+		return ScanResult (path, None, "%s: %s" % (err.__class__.__name__, err))
+
+
+def sniff_buffer (buf, name=None):
+	"""
+	Read the metadata from an ebook held in memory, trapping any errors.
+
+	:Parameters:
+		buf
+			The contents of the ebook, as a string, bytearray, memoryview or
+			mmap. This is read in place.
+		name
+			A name for the ebook (e.g. its original filename), which is used as
+			the path of the result and its extension as a hint to the format.
+
+	:Returns:
+		A `ScanResult`.
+
+	"""
+	try:
+		ext = name and os.path.splitext (name)[1][1:]
+		rdr_cls = default_registry.reader_for_buffer (buf, ext)
+		if rdr_cls is None:
+			raise ValueError ("unrecognised format")
+		with handle_pool.reader (rdr_cls, buf) as rdr:
+			md = rdr.read_metadata_as_dublincore()
+		if md is not None:
+			md = md.to_compact()
+		return ScanResult (name, md, None)
+	except Exception, err:
+		return ScanResult (name, None, "%s: %s" % (err.__class__.__name__, err))
+
+
+def sniff_paths (paths):
+	"""
+	Read the metadata from a series of ebooks, as per `sniff_path`.
+	"""
+	return [sniff_path (p) for p in paths]
+
+
+# the index and ring of this worker, if it has one
+_worker_ring = None
+
+
+def _init_worker (profiling=False, rings=None, claimed=None):
+	# leave interrupts to the parent, which will tear down the pool
+	global _worker_ring
+	signal.signal (signal.SIGINT, signal.SIG_IGN)
+	set_profiler (profiling and Profiler() or None)
+	_worker_ring = None
+	if rings:
+		# each ring has a single writer, so a worker started to replace another
+		# has none and pickles its results
+		with claimed.get_lock():
+			i = claimed.value
+			claimed.value += 1
+		if i < len (rings):
+			_worker_ring = (i, rings[i])
+
+
+def _sniff_chunk (paths):
+	# read books in a worker, returning the results & any profiling figures
+	results = sniff_paths (paths)
+	if _worker_ring is not None:
+		from biblio.sniffmetadata.channel import write_results
+		i, ring = _worker_ring
+		span = write_results (ring, results)
+		if span is not None:
+			# a tuple, where pickled results are a list
+			results = (i,) + span
+	prof = get_profiler()
+	if not prof.enabled:
+		return results, None
+	stats = prof.to_dict()
+	prof.reset()
+	return results, stats
+
+
+def _chunks (iterable, size):
+	it = iter (iterable)
+	while True:
+		chunk = list (islice (it, size))
+		if not chunk:
+			return
+		yield chunk
+
+
+def _lookup (cache, path):
+	# return a result from the cache or None if there is no current entry
+	if cache is not None:
+		hit, record = cache.get (path)
+		if hit:
+			get_profiler().count ('cache.hits')
+			return ScanResult (path, record, None)
+		get_profiler().count ('cache.misses')
+	return None
+
+
+def _store (cache, res):
+	# save a freshly read result to the cache, if it was read sucessfully
+	if (cache is not None) and (res.error is None):
+		cache.put (res.path, res.record)
+
+
+def scan_paths (paths, jobs=1, chunksize=DEFAULT_CHUNKSIZE, cache=None,
+		shared=False):
+	"""
+	Read the metadata from many ebooks, in order.
+
+	:Parameters:
+		paths
+			An iterable of ebook paths. This is consumed lazily.
+		jobs
+			The number of worker processes to use. If 1 or less, all reading
+			is done in this process.
+		chunksize
+			The number of paths handed to a worker at once.
+		cache
+			An optional `MetadataCache`. Books with a current entry are not
+			re-read and freshly read books are added to it.
+		shared
+			Return results from workers through shared memory, rather than
+			pickling them. This is not yet any faster (see
+			`benchmark.run_channel_benchmark`), so is off by default.
+
+	:Returns:
+		An iterator of `ScanResult`, in the same order as `paths`.
+
+	"""
+	if jobs <= 1:
+		for p in paths:
+			res = _lookup (cache, p)
+			if res is None:
+				res = sniff_path (p)
+				_store (cache, res)
+			yield res
+	else:
+		for res in scan_in_pool (paths, jobs, chunksize, cache, shared):
+			yield res
+
+
+def scan_in_pool (paths, jobs, chunksize=DEFAULT_CHUNKSIZE, cache=None,
+		shared=False):
+	"""
+	Read the metadata from many ebooks in a pool of worker processes.
+
+	As for `scan_paths`, except that a pool is used however few the workers.
+	"""
+	from multiprocessing import Pool
+	prof = get_profiler()
+	rings = claimed = None
+	if shared:
+		from multiprocessing import Value
+		from biblio.sniffmetadata.channel import ResultRing, read_results
+		rings = [ResultRing() for i in range (jobs)]
+		claimed = Value ('i', 0)
+	pool = Pool (jobs, _init_worker, (prof.enabled, rings, claimed))
+
+	def collect (entry):
+		# merge cached & freshly read results back into their original order
+		known, misses, job = entry
+		fresh = []
+		if job:
+			fresh, stats = job.get()
+			if stats:
+				prof.merge (stats)
+			if isinstance (fresh, tuple):
+				i, start, end = fresh
+				fresh = read_results (rings[i], start, end, misses)
+		fresh = iter (fresh)
+		for res in known:
+			if res is None:
+				res = fresh.next()
+				_store (cache, res)
+			yield res
+
+	try:
+		pending = deque()
+		max_pending = jobs * CHUNKS_IN_FLIGHT
+		for chunk in _chunks (paths, chunksize):
+			known = [_lookup (cache, p) for p in chunk]
+			misses = [p for p, res in zip (chunk, known) if res is None]
+			job = None
+			if misses:
+				job = pool.apply_async (_sniff_chunk, (misses,))
+			pending.append ((known, misses, job))
+			if max_pending <= len (pending):
+				for res in collect (pending.popleft()):
+					yield res
+		while pending:
+			for res in collect (pending.popleft()):
+				yield res
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+
+### END #######################################################################
@@ -0,0 +1,826 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Benchmarking the readers and renaming against a synthetic corpus of ebooks.
+
+A corpus of epubs and PDFs is generated locally, covering a range of awkward
+cases (huge OPFs, OPFs in non-standard places, many creators, large binary
+payloads). Each case is then read in a fresh process, timing the phases of
+reading a book:
+
+* open: opening the file and reading its directory or trailer
+* locate: finding the metadata within the file
+* parse: reading the raw metadata
+* munge: converting it to Dublin Core
+* render: building a new filename from it
+
+Results are returned as a dict (and so can be saved as JSON) and two sets of
+results can be compared to spot regressions.
+
+The XMP parser is also benchmarked against pyPdf's XMP accessors, on the same
+packet, and results returned from worker processes through shared memory
+against those pickled, on a library of small epubs. There is also a benchmark
+of the memory needed to hold many records at once, and one of the time taken
+to import the package and start the scripts. As most
+runs are short (e.g. a single book from a shell loop), start-up matters: each
+module is imported in a fresh interpreter and any heavy dependencies that get
+loaded along the way are reported.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import platform
+import sys
+import time
+import zipfile
+
+from biblio.sniffmetadata.batch import reader_for_path
+from biblio.sniffmetadata.metadata import MetadataDict
+from biblio.sniffmetadata.utils import build_file_name
+
+
+### CONSTANTS & DEFINES
+
+PHASES = ['open', 'locate', 'parse', 'munge', 'render']
+
+# name, format, number of files and arguments to the generator
+DEFAULT_CASES = [
+	('epub-small', 'epub', 200, {}),
+	('epub-huge-opf', 'epub', 20, {'manifest_items': 50000}),
+	('epub-nonstandard-opf', 'epub', 200, {'opf_path': 'content.opf',
+		'with_container': False}),
+	('epub-many-creators', 'epub', 100, {'creators': 500}),
+	('epub-large-payload', 'epub', 10, {'payload_bytes': 20 << 20}),
+	('pdf-small', 'pdf', 200, {}),
+	('pdf-xref-stream', 'pdf', 200, {'xref_stream': True}),
+	('pdf-xmp', 'pdf', 200, {'xmp': True}),
+	('pdf-large-payload', 'pdf', 10, {'payload_bytes': 50 << 20}),
+]
+
+# what to time the import of, either a module or the path of a script
+IMPORT_TARGETS = [
+	'biblio.sniffmetadata.readers.registry',
+	'biblio.sniffmetadata.batch',
+	'biblio.sniffmetadata.readers.epubmetadatareader',
+	'biblio.sniffmetadata.readers.pdfmetadatareader',
+	os.path.join (os.path.dirname (__file__), 'scripts', 'sniff_metadata.py'),
+]
+
+# modules that should only be imported when a format or command needs them
+HEAVY_MODULES = [
+	'Cheetah',
+	'biblio.bibrecord',
+	'multiprocessing',
+	# pulled in by the setuptools namespace package, unless installed
+	'pkg_resources',
+	'pyPdf',
+	'sqlite3',
+	'xml.dom.minidom',
+]
+
+# run in a fresh interpreter to time an import
+IMPORT_TIMER = """
+import sys, time
+before = set (sys.modules)
+start = time.time()
+%s
+secs = time.time() - start
+loaded = [m for m in set (sys.modules) - before if sys.modules[m] is not None]
+import json
+sys.stdout.write (json.dumps ({'secs': secs, 'loaded': loaded}))
+"""
+
+XMP_TMPL = """<?xpacket begin="\xef\xbb\xbf" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+	<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+		<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+				xmp:CreateDate="2001-02-03T04:05:06Z"
+				xmp:ModifyDate="2001-02-03T04:05:06Z"
+				xmp:MetadataDate="2001-02-03T04:05:06Z"
+				xmp:CreatorTool="Synthetic Writer"/>
+		<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+			<dc:format>application/pdf</dc:format>
+			<dc:title><rdf:Alt>
+				<rdf:li xml:lang="x-default">%(title)s</rdf:li>
+				<rdf:li xml:lang="fr">Un Titre</rdf:li>
+			</rdf:Alt></dc:title>
+			<dc:creator><rdf:Seq>
+%(creators)s
+			</rdf:Seq></dc:creator>
+			<dc:subject><rdf:Bag>
+				<rdf:li>Fiction</rdf:li>
+				<rdf:li>Synthetic</rdf:li>
+			</rdf:Bag></dc:subject>
+			<dc:publisher><rdf:Bag><rdf:li>Synthetic Press</rdf:li></rdf:Bag></dc:publisher>
+			<dc:language><rdf:Bag><rdf:li>en</rdf:li></rdf:Bag></dc:language>
+		</rdf:Description>
+		<rdf:Description rdf:about="" xmlns:prism="http://prismstandard.org/namespaces/basic/2.0/">
+			<prism:isbn>%(isbn)s</prism:isbn>
+		</rdf:Description>
+	</rdf:RDF>
+</x:xmpmeta>
+%(padding)s
+<?xpacket end="w"?>"""
+
+CONTAINER_TMPL = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+	<rootfiles>
+		<rootfile full-path="%s" media-type="application/oebps-package+xml"/>
+	</rootfiles>
+</container>
+"""
+
+OPF_TMPL = """<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+	<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+		<dc:title>%(title)s</dc:title>
+%(creators)s
+		<dc:identifier id="id" opf:scheme="ISBN">%(isbn)s</dc:identifier>
+		<dc:date opf:event="publication">%(date)s</dc:date>
+		<dc:language>en</dc:language>
+		<dc:publisher>Synthetic Press</dc:publisher>
+	</metadata>
+	<manifest>
+%(manifest)s
+	</manifest>
+	<spine toc="ncx">
+%(spine)s
+	</spine>
+</package>
+"""
+
+
+### IMPLEMENTATION ###
+
+## Corpus generation
+
+def make_epub (path, title='A Title: With Subtitle', creators=1,
+		manifest_items=10, payload_bytes=0, opf_path='OEBPS/content.opf',
+		with_container=True, isbn='978-0-306-40615-7', date='2001-02-03'):
+	"""
+	Write a synthetic epub.
+
+	:Parameters:
+		creators
+			The number of creators to list.
+		manifest_items
+			The number of items in the manifest and spine.
+		payload_bytes
+			The size of an incompressible image stored in the book.
+		opf_path
+			Where the OPF is stored.
+		with_container
+			Whether to include a container file pointing at the OPF.
+
+	"""
+	creator_str = '\n'.join (['\t\t<dc:creator opf:role="aut" '
+		'opf:file-as="Author%d, Some">Some Author%d</dc:creator>' % (i, i)
+		for i in range (creators)])
+	manifest_str = '\n'.join (['\t\t<item id="i%d" href="c%d.html" '
+		'media-type="application/xhtml+xml"/>' % (i, i)
+		for i in range (manifest_items)])
+	spine_str = '\n'.join (['\t\t<itemref idref="i%d"/>' % i
+		for i in range (manifest_items)])
+	z = zipfile.ZipFile (path, 'w', zipfile.ZIP_DEFLATED)
+	try:
+		z.writestr (zipfile.ZipInfo ('mimetype'), 'application/epub+zip')
+		if with_container:
+			z.writestr ('META-INF/container.xml', CONTAINER_TMPL % opf_path)
+		z.writestr (opf_path, OPF_TMPL % {
+			'title': title,
+			'creators': creator_str,
+			'isbn': isbn,
+			'date': date,
+			'manifest': manifest_str,
+			'spine': spine_str,
+		})
+		z.writestr ('OEBPS/c0.html', '<html><body><p>Text</p></body></html>')
+		if payload_bytes:
+			info = zipfile.ZipInfo ('OEBPS/images/payload.jpg')
+			info.compress_type = zipfile.ZIP_STORED
+			z.writestr (info, os.urandom (payload_bytes))
+	finally:
+		z.close()
+
+
+def _pdf_objects_to_classic (objs, header):
+	out = [header]
+	size = len (header)
+	offsets = []
+	for i, o in enumerate (objs):
+		offsets.append (size)
+		chunk = '%d 0 obj\n%s\nendobj\n' % (i + 1, o)
+		out.append (chunk)
+		size += len (chunk)
+	xref = ['xref\n0 %d\n0000000000 65535 f \n' % (len (objs) + 1)]
+	xref.extend (['%010d 00000 n \n' % o for o in offsets])
+	out.append (''.join (xref))
+	out.append ('trailer\n<< /Size %d /Root 1 0 R /Info 3 0 R >>\n'
+		'startxref\n%d\n%%%%EOF\n' % (len (objs) + 1, size))
+	return ''.join (out)
+
+
+def _pdf_objects_to_xref_stream (objs, header):
+	out = [header]
+	size = len (header)
+	offsets = []
+	for i, o in enumerate (objs):
+		offsets.append (size)
+		chunk = '%d 0 obj\n%s\nendobj\n' % (i + 1, o)
+		out.append (chunk)
+		size += len (chunk)
+	# the xref stream itself is the last object
+	offsets.append (size)
+	rows = ['\x00\x00\x00\x00\x00\xff\xff']
+	rows.extend (['\x01' + ('%08x' % o).decode ('hex') + '\x00\x00' for o in offsets])
+	import zlib
+	data = zlib.compress (''.join (rows))
+	out.append ('%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R '
+		'/Info 3 0 R /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream\n'
+		'endobj\nstartxref\n%d\n%%%%EOF\n' % (len (objs) + 1, len (objs) + 2,
+		len (data), data, size))
+	return ''.join (out)
+
+
+def make_xmp (title='A Title: With Subtitle', creators=1,
+		isbn='978-0-306-40615-7'):
+	"""
+	Return a synthetic XMP packet, padded as editors leave them.
+	"""
+	return XMP_TMPL % {
+		'title': title,
+		'creators': '\n'.join (['\t\t\t\t<rdf:li>Some Author%s</rdf:li>' % i
+			for i in range (creators)]),
+		'isbn': isbn,
+		'padding': '\n'.join ([' ' * 99] * 20),
+	}
+
+
+def make_pdf (path, title='A Title: With Subtitle', author='Some Author',
+		payload_bytes=0, xref_stream=False, xmp=False):
+	"""
+	Write a synthetic PDF.
+
+	:Parameters:
+		payload_bytes
+			The size of an incompressible stream stored in the document.
+		xref_stream
+			Use a (PDF 1.5) cross-reference stream rather than a table.
+		xmp
+			Include an XMP metadata packet.
+
+	"""
+	payload = os.urandom (payload_bytes)
+	root = '<< /Type /Catalog /Pages 2 0 R >>'
+	if xmp:
+		root = '<< /Type /Catalog /Pages 2 0 R /Metadata 5 0 R >>'
+	objs = [
+		root,
+		'<< /Type /Pages /Kids [] /Count 0 >>',
+		'<< /Title (%s) /Author (%s) /CreationDate (D:20010203040506Z) >>' % \
+			(title, author),
+		'<< /Length %d >>\nstream\n%s\nendstream' % (len (payload), payload),
+	]
+	if xmp:
+		packet = make_xmp (title, 3)
+		objs.append ('<< /Type /Metadata /Subtype /XML /Length %d >>\nstream\n'
+			'%s\nendstream' % (len (packet), packet))
+	header = '%PDF-1.5\n%\xe2\xe3\xcf\xd3\n'
+	if xref_stream:
+		contents = _pdf_objects_to_xref_stream (objs, header)
+	else:
+		contents = _pdf_objects_to_classic (objs, header)
+	hndl = open (path, 'wb')
+	try:
+		hndl.write (contents)
+	finally:
+		hndl.close()
+
+
+def generate_corpus (dir_path, cases=DEFAULT_CASES, scale=1.0):
+	"""
+	Write a synthetic corpus of ebooks.
+
+	:Parameters:
+		dir_path
+			Where to write the corpus. Each case is written to a subdirectory.
+		cases
+			A list of (name, format, number of files, generator arguments).
+		scale
+			A multiplier for the number of files in each case.
+
+	:Returns:
+		A list of (case name, list of paths).
+
+	Existing files are reused, so a corpus need only be generated once.
+	"""
+	corpus = []
+	for name, fmt, count, kwargs in cases:
+		case_dir = os.path.join (dir_path, name)
+		if not os.path.isdir (case_dir):
+			os.makedirs (case_dir)
+		paths = []
+		for i in range (max (1, int (count * scale))):
+			p = os.path.join (case_dir, 'book%06d.%s' % (i, fmt))
+			if not os.path.exists (p):
+				if fmt == 'epub':
+					make_epub (p, **kwargs)
+				else:
+					make_pdf (p, **kwargs)
+			paths.append (p)
+		corpus.append ((name, paths))
+	return corpus
+
+
+## Measurement
+
+def peak_rss_kb():
+	"""
+	Return the peak resident memory of this process in kilobytes.
+	"""
+	import resource
+	peak = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+	# Mac reports bytes, everyone else kilobytes
+	if sys.platform == 'darwin':
+		peak //= 1024
+	return peak
+
+
+def _percentile (sorted_vals, frac):
+	if not sorted_vals:
+		return 0.0
+	return sorted_vals[min (len (sorted_vals) - 1, int (len (sorted_vals) * frac))]
+
+
+def summarise_timings (secs):
+	"""
+	Reduce a list of timings (in seconds) to summary statistics in msecs.
+	"""
+	secs = sorted (secs)
+	total = sum (secs)
+	return {
+		'total_s': total,
+		'mean_ms': secs and (1000.0 * total / len (secs)) or 0.0,
+		'p50_ms': 1000.0 * _percentile (secs, 0.5),
+		'p95_ms': 1000.0 * _percentile (secs, 0.95),
+		'max_ms': secs and (1000.0 * secs[-1]) or 0.0,
+	}
+
+
+def time_book (path):
+	"""
+	Read a book, timing each phase.
+
+	:Returns:
+		A dict of phase names to the seconds taken.
+
+	"""
+	timings = {}
+	clock = time.time
+	t0 = clock()
+	with reader_for_path (path) (path) as rdr:
+		t1 = clock()
+		if hasattr (rdr, 'find_contents_file'):
+			rdr.find_contents_file()
+		t2 = clock()
+		raw = rdr.read_metadata()
+		t3 = clock()
+		md = rdr.munge_metadata_to_dublincore (raw)
+		t4 = clock()
+	if md is not None:
+		build_file_name (md, os.path.splitext (path)[1][1:])
+	t5 = clock()
+	timings['open'] = t1 - t0
+	timings['locate'] = t2 - t1
+	timings['parse'] = t3 - t2
+	timings['munge'] = t4 - t3
+	timings['render'] = t5 - t4
+	return timings
+
+
+def run_case (paths, repeat=1):
+	"""
+	Time reading a series of books.
+
+	:Returns:
+		A dict of results for the case.
+
+	"""
+	phase_secs = dict ([(p, []) for p in PHASES])
+	errors = 0
+	start = time.time()
+	for i in range (repeat):
+		for p in paths:
+			try:
+				for k, v in time_book (p).iteritems():
+					phase_secs[k].append (v)
+			except Exception:
+				errors += 1
+	elapsed = time.time() - start
+	n = len (paths) * repeat
+	return {
+		'files': n,
+		'errors': errors,
+		'elapsed_s': elapsed,
+		'files_per_sec': elapsed and (n / elapsed) or 0.0,
+		'peak_rss_kb': peak_rss_kb(),
+		'phases': dict ([(k, summarise_timings (v)) for k, v in
+			phase_secs.iteritems()]),
+	}
+
+
+def _run_case_in_child (paths, repeat, queue):
+	queue.put (run_case (paths, repeat))
+
+
+def run_isolated (func, *args):
+	"""
+	Run a benchmark function in a fresh process and return its result.
+
+	This keeps the memory use of each case from polluting the others.
+	"""
+	from multiprocessing import Process, Queue
+	queue = Queue()
+	proc = Process (target=func, args=args + (queue,))
+	proc.start()
+	res = queue.get()
+	proc.join()
+	return res
+
+
+def run_benchmarks (corpus, repeat=1, isolate=True):
+	"""
+	Time reading each case in a corpus.
+
+	:Parameters:
+		corpus
+			As returned by `generate_corpus`.
+		repeat
+			How many times to read each book.
+		isolate
+			Run each case in its own process, so peak memory use is per case.
+
+	:Returns:
+		A dict of results, suitable for saving as JSON.
+
+	"""
+	results = {
+		'meta': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'timestamp': time.strftime ('%Y-%m-%dT%H:%M:%S'),
+		},
+		'cases': {},
+	}
+	for name, paths in corpus:
+		if isolate:
+			results['cases'][name] = run_isolated (_run_case_in_child, paths, repeat)
+		else:
+			results['cases'][name] = run_case (paths, repeat)
+	return results
+
+
+def compare_results (old, new):
+	"""
+	Compare two sets of benchmark results.
+
+	:Returns:
+		A list of (case, old files/sec, new files/sec, ratio) for cases found
+		in both. A ratio above 1 means the new results are faster.
+
+	"""
+	cmp_rows = []
+	for name in sorted (new['cases']):
+		if name in old['cases']:
+			old_rate = old['cases'][name]['files_per_sec']
+			new_rate = new['cases'][name]['files_per_sec']
+			ratio = old_rate and (new_rate / old_rate) or 0.0
+			cmp_rows.append ((name, old_rate, new_rate, ratio))
+	return cmp_rows
+
+
+## Start-up
+
+def _import_statement (target):
+	if target.endswith ('.py'):
+		# a script, which can be loaded without running its main
+		return "import imp; imp.load_source ('_bench_script', %r)" % target
+	return "__import__ (%r)" % target
+
+
+def time_import (target, repeat=5):
+	"""
+	Time importing a module or script, each time in a fresh interpreter.
+
+	:Parameters:
+		target
+			A module name or the path of a script.
+		repeat
+			How many times to import it.
+
+	:Returns:
+		A dict of the median milliseconds taken by the import alone
+		('import_ms') and by the whole process ('process_ms'), the number of
+		modules loaded and which of the `HEAVY_MODULES` were among them.
+
+	"""
+	import json
+	import subprocess
+	env = dict (os.environ)
+	env['PYTHONPATH'] = os.pathsep.join ([p for p in sys.path if p])
+	cmd = [sys.executable, '-c', IMPORT_TIMER % _import_statement (target)]
+	import_secs = []
+	process_secs = []
+	for i in range (repeat):
+		start = time.time()
+		proc = subprocess.Popen (cmd, env=env, stdout=subprocess.PIPE,
+			stderr=subprocess.PIPE)
+		out, err = proc.communicate()
+		process_secs.append (time.time() - start)
+		if proc.returncode:
+			raise RuntimeError ("importing '%s' failed: %s" % (target,
+				err.strip().splitlines()[-1:]))
+		res = json.loads (out)
+		import_secs.append (res['secs'])
+	loaded = res['loaded']
+	heavy = sorted ([m for m in HEAVY_MODULES if m in loaded])
+	return {
+		'import_ms': 1000.0 * _percentile (sorted (import_secs), 0.5),
+		'process_ms': 1000.0 * _percentile (sorted (process_secs), 0.5),
+		'modules': len (loaded),
+		'heavy': heavy,
+	}
+
+
+def run_import_benchmark (targets=IMPORT_TARGETS, repeat=5):
+	"""
+	Time importing each of several modules or scripts.
+
+	:Returns:
+		A dict of target names (modules relative to the package, scripts by
+		their filename) to the results of `time_import`, plus the time taken
+		to start an interpreter that imports nothing, as 'python'.
+
+	"""
+	results = {'python': time_import ('sys', repeat)}
+	for t in targets:
+		name = os.path.basename (t)
+		if name == t:
+			name = t.replace ('biblio.sniffmetadata.', '')
+		results[name] = time_import (t, repeat)
+	return results
+
+
+def compare_import_results (old, new):
+	"""
+	Compare two sets of import timings.
+
+	:Returns:
+		A list of (target, old ms, new ms, ratio) for targets found in both,
+		comparing the time for the whole process, as that is what a user waits
+		for. A ratio above 1 means the new imports are slower.
+
+	"""
+	cmp_rows = []
+	for name in sorted (new):
+		if name in old:
+			old_ms = old[name]['process_ms']
+			new_ms = new[name]['process_ms']
+			ratio = old_ms and (new_ms / old_ms) or 0.0
+			cmp_rows.append ((name, old_ms, new_ms, ratio))
+	return cmp_rows
+
+
+def format_import_results (results):
+	"""
+	Return a human-readable table of import timings.
+	"""
+	lines = ['%-32s %10s %10s %8s  %s' % ('module', 'import ms', 'process ms',
+		'modules', 'heavy')]
+	for name in sorted (results):
+		res = results[name]
+		lines.append ('%-32s %10.1f %10.1f %8d  %s' % (name, res['import_ms'],
+			res['process_ms'], res['modules'], ', '.join (res['heavy']) or '-'))
+	return '\n'.join (lines)
+
+
+## XMP
+
+class _PacketStream (object):
+	# the little of a pyPdf stream that its XMP accessors use
+	def __init__ (self, data):
+		self._data = data
+
+	def getData (self):
+		return self._data
+
+
+def _read_xmp_with_pypdf (packet):
+	from pyPdf.xmp import XmpInformation
+	info = XmpInformation (_PacketStream (packet))
+	return (info.dc_title, info.dc_creator, info.dc_subject, info.dc_publisher,
+		info.dc_language, info.dc_date, info.xmp_createDate)
+
+
+def run_xmp_benchmark (n=2000, creators=3):
+	"""
+	Compare the time taken to read an XMP packet by `parse_xmp` and by pyPdf.
+
+	:Returns:
+		A dict of the packets read per second by each ('xmp_per_sec' and
+		'pypdf_per_sec', the latter `None` if pyPdf is not installed) and the
+		'speedup'.
+
+	"""
+	from biblio.sniffmetadata.readers.xmp import parse_xmp
+	packet = make_xmp (creators=creators)
+	start = time.time()
+	for i in xrange (n):
+		parse_xmp (packet)
+	xmp_rate = n / max (time.time() - start, 1e-9)
+	results = {'packets': n, 'xmp_per_sec': xmp_rate, 'pypdf_per_sec': None,
+		'speedup': None}
+	try:
+		_read_xmp_with_pypdf (packet)
+	except ImportError:
+		return results
+	start = time.time()
+	for i in xrange (n):
+		_read_xmp_with_pypdf (packet)
+	pypdf_rate = n / max (time.time() - start, 1e-9)
+	results['pypdf_per_sec'] = pypdf_rate
+	results['speedup'] = xmp_rate / pypdf_rate
+	return results
+
+
+## Returning results from workers
+
+def _time_scan (paths, jobs, shared):
+	# the wall-clock & parent CPU time to scan books & build their metadata
+	from biblio.sniffmetadata.batch import scan_in_pool
+	wall, cpu = time.time(), time.clock()
+	errors = 0
+	for res in scan_in_pool (paths, jobs, shared=shared):
+		if res.error or (res.metadata() is None):
+			errors += 1
+	return time.time() - wall, time.clock() - cpu, errors
+
+
+def run_channel_benchmark (dir_path, n=2000, workers=(1, 4, 16), repeat=3):
+	"""
+	Compare returning results from workers pickled and through shared memory.
+
+	:Parameters:
+		dir_path
+			Where to generate (or find) a library of small epubs.
+		n
+			The number of books in it.
+		workers
+			The sizes of pool to try.
+		repeat
+			How many times to scan the library in each way, the best being kept.
+
+	:Returns:
+		A dict of the sizes of pool to a dict giving, for 'pickled' and
+		'shared' results, the 'files_per_sec' and the CPU time used by the
+		parent in 'parent_ms_per_file', along with the 'speedup'.
+
+	"""
+	corpus = generate_corpus (dir_path, [('epub-small', 'epub', n, {})])
+	paths = corpus[0][1]
+	results = {}
+	for jobs in workers:
+		res = {}
+		for name, shared in [('pickled', False), ('shared', True)]:
+			best = min ([_time_scan (paths, jobs, shared) for i in
+				range (repeat)])
+			res[name] = {
+				'files_per_sec': len (paths) / max (best[0], 1e-9),
+				'parent_ms_per_file': 1000.0 * best[1] / len (paths),
+				'errors': best[2],
+			}
+		res['speedup'] = res['shared']['files_per_sec'] / \
+			res['pickled']['files_per_sec']
+		results[str (jobs)] = res
+	return results
+
+
+def format_channel_results (results):
+	"""
+	Return a human-readable table of the results of `run_channel_benchmark`.
+	"""
+	lines = ['%8s %12s %12s %14s %14s %8s' % ('workers', 'pickled/s',
+		'shared/s', 'pickled cpu ms', 'shared cpu ms', 'speedup')]
+	for jobs in sorted (results, key=int):
+		res = results[jobs]
+		lines.append ('%8s %12.1f %12.1f %14.3f %14.3f %8.2f' % (jobs,
+			res['pickled']['files_per_sec'], res['shared']['files_per_sec'],
+			res['pickled']['parent_ms_per_file'],
+			res['shared']['parent_ms_per_file'], res['speedup']))
+	return '\n'.join (lines)
+
+
+## Memory use
+
+class _PlainMetaValue (object):
+	# a value as they used to be, with its own instance & attribute dicts
+	def __init__ (self, value, attribs=None):
+		self.value = value
+		self.attribs = dict (attribs or {})
+
+
+class _PlainMetadataDict (dict):
+	pass
+
+
+def synthetic_record (i):
+	"""
+	Return a compact metadata record, typical of an epub.
+	"""
+	return {
+		u'title': [(u'Title number %d: A Subtitle' % i, {})],
+		u'creator': [(u'Some Author%d' % i, {u'role': u'aut',
+			u'file-as': u'Author%d, Some' % i})],
+		u'identifier': [(u'978%010d' % i, {u'scheme': u'ISBN'}),
+			(u'urn:uuid:%032x' % i, {u'id': u'BookId'})],
+		u'date': [(u'20%02d-01-01' % (i % 100), {u'event': u'publication'})],
+		u'language': [(u'en', {})],
+		u'publisher': [(u'Synthetic Press', {})],
+	}
+
+
+def deep_sizeof (obj, seen=None):
+	"""
+	Return the memory used by an object and everything it refers to.
+
+	Objects referred to more than once are only counted once.
+	"""
+	if seen is None:
+		seen = set()
+	total = 0
+	stack = [obj]
+	while stack:
+		o = stack.pop()
+		if id (o) in seen:
+			continue
+		seen.add (id (o))
+		total += sys.getsizeof (o)
+		if isinstance (o, dict):
+			stack.extend (o.keys())
+			stack.extend (o.values())
+		elif isinstance (o, (list, tuple, set)):
+			stack.extend (o)
+		if hasattr (o, '__dict__'):
+			stack.append (o.__dict__)
+		for slot in getattr (type (o), '__slots__', ()):
+			if hasattr (o, slot):
+				stack.append (getattr (o, slot))
+	return total
+
+
+def run_memory_benchmark (n=100000):
+	"""
+	Compare the memory needed to hold many records, old style and new.
+
+	:Returns:
+		A dict of the bytes per record for plain objects (with instance and
+		attribute dicts for every value) and the compact `MetadataDict`.
+
+	"""
+	compacts = [synthetic_record (i) for i in xrange (n)]
+	# count strings as shared, as they are in both representations
+	seen = set()
+	deep_sizeof (compacts, seen)
+	plain = [_PlainMetadataDict ([(str (k), [_PlainMetaValue (v, a) for v, a in
+		vals]) for k, vals in c.iteritems()]) for c in compacts]
+	plain_size = deep_sizeof (plain, set (seen))
+	del plain
+	compact = [MetadataDict.from_compact (c) for c in compacts]
+	compact_size = deep_sizeof (compact, set (seen))
+	return {
+		'records': n,
+		'plain_bytes_per_record': float (plain_size) / n,
+		'compact_bytes_per_record': float (compact_size) / n,
+		'saving': 1.0 - (float (compact_size) / plain_size),
+	}
+
+
+def format_results (results):
+	"""
+	Return a human-readable table of benchmark results.
+	"""
+	lines = ['%-24s %10s %10s %8s  %s' % ('case', 'files/s', 'rss (kb)',
+		'errors', ' '.join (['%8s' % ('%s ms' % p) for p in PHASES]))]
+	for name in sorted (results['cases']):
+		res = results['cases'][name]
+		lines.append ('%-24s %10.1f %10d %8d  %s' % (name, res['files_per_sec'],
+			res['peak_rss_kb'], res['errors'],
+			' '.join (['%8.3f' % res['phases'][p]['mean_ms'] for p in PHASES])))
+	return '\n'.join (lines)
+
+
+### END #######################################################################
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+A persistent cache of ebook metadata, so unchanged books need not be re-read.
+
+Records are stored in a local SQLite file, keyed by the path of the book and
+validated against its size, modification time and (optionally) a hash of its
+contents. If any of these differ from what was recorded, the entry is treated
+as stale and ignored. The number of entries is bounded, with the least recently
+used being evicted first.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import hashlib
+import json
+import os
+import time
+
+from biblio.sniffmetadata.defaults import DEFAULT_MAX_ENTRIES
+
+
+### CONSTANTS & DEFINES
+
+# how many updates to make before committing them to disk
+COMMIT_INTERVAL = 500
+
+HASH_BLOCKSIZE = 1 << 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+	path TEXT PRIMARY KEY,
+	size INTEGER NOT NULL,
+	mtime REAL NOT NULL,
+	digest TEXT,
+	record TEXT,
+	last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used);
+"""
+
+
+### IMPLEMENTATION ###
+
+def file_digest (path):
+	"""
+	Return a hash of the contents of a file.
+	"""
+	h = hashlib.sha1()
+	hndl = open (path, 'rb')
+	try:
+		while True:
+			buf = hndl.read (HASH_BLOCKSIZE)
+			if not buf:
+				break
+			h.update (buf)
+	finally:
+		hndl.close()
+	return h.hexdigest()
+
+
+def file_identity (path, use_hash=False):
+	"""
+	Return the details used to tell if a file has changed.
+
+	:Returns:
+		A tuple of size, modification time and content hash. The hash is `None`
+		unless `use_hash` is set.
+
+	"""
+	st = os.stat (path)
+	digest = None
+	if use_hash:
+		digest = file_digest (path)
+	return st.st_size, st.st_mtime, digest
+
+
+class MetadataCache (object):
+	"""
+	A size-bounded, on-disk store of compact metadata records.
+	"""
+	def __init__ (self, db_path, max_entries=DEFAULT_MAX_ENTRIES, use_hash=False):
+		"""
+		C'tor.
+
+		:Parameters:
+			db_path
+				Where the cache is stored. It is created if need be.
+			max_entries
+				The most records to keep. Least recently used records beyond
+				this are dropped when the cache is closed.
+			use_hash
+				Validate entries by content as well as size and modification
+				time. Safer but requires reading every file.
+
+		"""
+		self.max_entries = max_entries
+		self.use_hash = use_hash
+		self.hits = self.misses = 0
+		self._uncommitted = 0
+		# sqlite is slow to import, so only do so when needed
+		import sqlite3
+		self._conn = sqlite3.connect (db_path)
+		self._conn.executescript (SCHEMA)
+
+	def _updated (self):
+		self._uncommitted += 1
+		if COMMIT_INTERVAL <= self._uncommitted:
+			self.commit()
+
+	def get (self, path):
+		"""
+		Look up the record for a file, if it is present and current.
+
+		:Returns:
+			A pair of a boolean for whether a current entry was found and the
+			compact record stored for it. Note that the record itself may be
+			`None`, if the book was found to have no metadata.
+
+		"""
+		path = os.path.abspath (path)
+		row = self._conn.execute (
+			"SELECT size, mtime, digest, record FROM metadata WHERE path = ?",
+			(path,)).fetchone()
+		if row is not None:
+			size, mtime, digest, record = row
+			try:
+				st = os.stat (path)
+				current = (st.st_size, st.st_mtime) == (size, mtime)
+				# only bother hashing if the cheap checks pass
+				if current and self.use_hash:
+					current = (digest is not None) and (file_digest (path) == digest)
+			except (OSError, IOError):
+				current = False
+			if current:
+				self._conn.execute (
+					"UPDATE metadata SET last_used = ? WHERE path = ?",
+					(time.time(), path))
+				self._updated()
+				self.hits += 1
+				return True, json.loads (record)
+			self.invalidate (path)
+		self.misses += 1
+		return False, None
+
+	def put (self, path, record):
+		"""
+		Store the compact metadata record for a file.
+		"""
+		path = os.path.abspath (path)
+		size, mtime, digest = file_identity (path, self.use_hash)
+		self._conn.execute (
+			"INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+			(path, size, mtime, digest, json.dumps (record), time.time()))
+		self._updated()
+
+	def invalidate (self, path):
+		"""
+		Remove any entry for a file.
+		"""
+		self._conn.execute ("DELETE FROM metadata WHERE path = ?",
+			(os.path.abspath (path),))
+		self._updated()
+
+	def __len__ (self):
+		return self._conn.execute ("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+	def evict (self):
+		"""
+		Drop the least recently used entries beyond the size limit.
+
+		:Returns:
+			The number of entries removed.
+
+		"""
+		excess = len (self) - self.max_entries
+		if excess <= 0:
+			return 0
+		self._conn.execute ("""DELETE FROM metadata WHERE path IN
+			(SELECT path FROM metadata ORDER BY last_used LIMIT ?)""", (excess,))
+		self.commit()
+		return excess
+
+	def commit (self):
+		self._conn.commit()
+		self._uncommitted = 0
+
+	def close (self):
+		"""
+		Trim, save and close the cache.
+		"""
+		if self._conn is not None:
+			self.evict()
+			self.commit()
+			self._conn.close()
+			self._conn = None
+
+
+### END #######################################################################
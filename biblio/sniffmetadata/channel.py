@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Passing scan results from worker processes back through shared memory.
+
+Rather than pickling each result back to the parent, a worker packs the
+results of a chunk of books into records of a fixed layout and writes them to
+a ring buffer in shared memory, one ring per worker. Only the position of the
+records in the ring goes back through the pool. The parent copies the records
+out (freeing the space for the worker) but only unpacks a record when its
+metadata is asked for, so books that are merely counted, or found to have
+failed, are never unpacked at all.
+
+Each record is length-prefixed::
+
+	record:    length (uint32, including this header), status (uint8), body
+	body:      the error message (for STATUS_ERROR), or a series of values
+	value:     field (uint8), flags (uint8), length (uint32),
+	           length of attributes (uint16), [name], text, attributes
+	attribute: key (uint8), flags (uint8), length (uint32), [name], text
+
+where fields and keys are numbered from a table of the usual names, any other
+name following as a uint32 length and UTF-8. Text is UTF-8 if flagged as
+unicode, and otherwise the bytes of the original string, so that values come
+back as the same types they went in as. As the same few sets of attributes
+turn up again and again, they are packed and unpacked only once.
+
+A chunk whose records do not fit in the free space of the ring is returned
+pickled as usual, so a slow parent or a huge record never blocks a worker.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import ctypes
+import struct
+
+from biblio.sniffmetadata.batch import ScanResult
+from biblio.sniffmetadata.metadata import MetadataDict, MetaValue, \
+	intern_key, intern_attribs
+
+
+### CONSTANTS & DEFINES
+
+# the size of each worker's ring
+DEFAULT_RING_BYTES = 1 << 20
+
+# the most sets of attributes to remember packed & unpacked
+MAX_CACHED_ATTRIBS = 4096
+
+# the outcome of reading a book
+STATUS_NONE = 0
+STATUS_RECORD = 1
+STATUS_ERROR = 2
+
+# the names given numbers in records, anything else being given in full
+FIELD_NAMES = ['contributor', 'coverage', 'creator', 'date', 'description',
+	'format', 'identifier', 'language', 'publisher', 'relation', 'rights',
+	'source', 'subject', 'title', 'type']
+ATTRIB_NAMES = ['role', 'file-as', 'scheme', 'event', 'id', 'lang']
+
+# the code for a name given in full
+OTHER_NAME = 0xFF
+
+# flags for text
+TEXT_UNICODE = 0x01
+
+HEADER = struct.Struct ('<IB')
+VALUE = struct.Struct ('<BBIH')
+ATTRIB = struct.Struct ('<BBI')
+LENGTH = struct.Struct ('<I')
+
+
+### IMPLEMENTATION ###
+
+_field_codes = dict ([(n, i) for i, n in enumerate (FIELD_NAMES)])
+_attrib_codes = dict ([(n, i) for i, n in enumerate (ATTRIB_NAMES)])
+_field_names = [intern_key (n) for n in FIELD_NAMES]
+_attrib_names = [intern_key (n) for n in ATTRIB_NAMES]
+
+_packed_attribs = {}
+_unpacked_attribs = {}
+
+
+def _utf8 (s):
+	if isinstance (s, unicode):
+		return s.encode ('utf8')
+	return str (s)
+
+
+def _pack_text (s):
+	# return the flags & bytes for a string
+	if isinstance (s, unicode):
+		return TEXT_UNICODE, s.encode ('utf8')
+	return 0, str (s)
+
+
+def _unpack_text (flags, data):
+	if flags & TEXT_UNICODE:
+		return data.decode ('utf8')
+	return data
+
+
+def _pack_attribs (attribs):
+	# pack a set of attributes, remembering the result as they often recur
+	if not attribs:
+		return ''
+	key = frozenset (attribs.iteritems())
+	block = _packed_attribs.get (key)
+	if block is None:
+		block = []
+		for k, v in attribs.iteritems():
+			key_code = _attrib_codes.get (k, OTHER_NAME)
+			flags, v = _pack_text (v)
+			block.append (ATTRIB.pack (key_code, flags, len (v)))
+			if key_code == OTHER_NAME:
+				k = _utf8 (k)
+				block.extend ([LENGTH.pack (len (k)), k])
+			block.append (v)
+		block = ''.join (block)
+		if MAX_CACHED_ATTRIBS <= len (_packed_attribs):
+			_packed_attribs.clear()
+		_packed_attribs[key] = block
+	return block
+
+
+def _unpack_attribs (block):
+	# return the shared attributes for a packed set
+	attribs = _unpacked_attribs.get (block)
+	if attribs is not None:
+		return attribs
+	attribs = {}
+	pos = 0
+	while pos < len (block):
+		key_code, flags, size = ATTRIB.unpack_from (block, pos)
+		pos += ATTRIB.size
+		if key_code == OTHER_NAME:
+			name_size = LENGTH.unpack_from (block, pos)[0]
+			pos += LENGTH.size
+			key = block[pos:pos + name_size].decode ('utf8')
+			pos += name_size
+		else:
+			key = _attrib_names[key_code]
+		attribs[key] = _unpack_text (flags, block[pos:pos + size])
+		pos += size
+	attribs = intern_attribs (attribs)
+	if MAX_CACHED_ATTRIBS <= len (_unpacked_attribs):
+		_unpacked_attribs.clear()
+	_unpacked_attribs[block] = attribs
+	return attribs
+
+
+def pack_result (res):
+	"""
+	Pack the record or error of a `ScanResult` into a single record.
+
+	The path is not packed, as the parent already knows it.
+	"""
+	if res.error is not None:
+		body = [_utf8 (res.error)]
+		status = STATUS_ERROR
+	elif res.record is None:
+		body = []
+		status = STATUS_NONE
+	else:
+		body = []
+		status = STATUS_RECORD
+		for field, vals in res.record.iteritems():
+			code = _field_codes.get (field, OTHER_NAME)
+			name = (code == OTHER_NAME) and _utf8 (field)
+			for val, attribs in vals:
+				flags, text = _pack_text (val)
+				block = attribs and _pack_attribs (attribs) or ''
+				body.append (VALUE.pack (code, flags, len (text), len (block)))
+				if name:
+					body.extend ([LENGTH.pack (len (name)), name])
+				body.extend ([text, block])
+	body = ''.join (body)
+	return HEADER.pack (HEADER.size + len (body), status) + body
+
+
+def _unpack (packed, make_value):
+	# unpack a record into a dict of fields to lists of make_value (text, attribs)
+	fields = {}
+	pos = HEADER.size
+	end = len (packed)
+	while pos < end:
+		code, flags, size, attribs_size = VALUE.unpack_from (packed, pos)
+		pos += VALUE.size
+		if code == OTHER_NAME:
+			name_size = LENGTH.unpack_from (packed, pos)[0]
+			pos += LENGTH.size
+			field = intern_key (packed[pos:pos + name_size].decode ('utf8'))
+			pos += name_size
+		else:
+			field = _field_names[code]
+		text = _unpack_text (flags, packed[pos:pos + size])
+		pos += size
+		attribs = _unpack_attribs (packed[pos:pos + attribs_size])
+		pos += attribs_size
+		vals = fields.get (field)
+		if vals is None:
+			vals = fields[field] = []
+		vals.append (make_value (text, attribs))
+	return fields
+
+
+def unpack_record (packed):
+	"""
+	Unpack a record into the compact form of `MetadataDict.to_compact`.
+	"""
+	return _unpack (packed, lambda text, attribs: (text, dict (attribs)))
+
+
+def unpack_metadata (packed):
+	"""
+	Unpack a record straight into a `MetadataDict`.
+	"""
+	return MetadataDict (_unpack (packed, MetaValue))
+
+
+class PackedScanResult (ScanResult):
+	"""
+	A `ScanResult` whose record is still packed, as read from a ring.
+
+	The record is unpacked each time it is asked for, so callers that need it
+	more than once should keep it.
+	"""
+	__slots__ = ()
+
+	@property
+	def record (self):
+		packed = self[1]
+		if packed is None:
+			return None
+		return unpack_record (packed)
+
+	def metadata (self):
+		packed = self[1]
+		if packed is None:
+			return None
+		return unpack_metadata (packed)
+
+
+class ResultRing (object):
+	"""
+	A ring buffer in shared memory, written by one worker and read by the
+	parent.
+
+	Positions only ever increase, being taken modulo the size of the ring when
+	used. The writer keeps its own position, while how far the parent has read
+	is shared (and locked, which also orders the copying out of records before
+	the space is reused).
+	"""
+	def __init__ (self, size=None):
+		# so that this need not be imported unless a ring is used
+		from multiprocessing.sharedctypes import RawArray, Value
+		self.size = size or DEFAULT_RING_BYTES
+		self._buf = RawArray ('c', self.size)
+		self._read_pos = Value (ctypes.c_ulonglong, 0)
+		self._write_pos = 0
+
+	def _copy_in (self, pos, data):
+		base = ctypes.addressof (self._buf)
+		ctypes.memmove (base + pos, data, len (data))
+
+	def write (self, data):
+		"""
+		Write data to the ring, if there is space for it.
+
+		:Returns:
+			The (start, end) positions of the data, or `None` if it did not
+			fit, in which case nothing is written.
+
+		"""
+		start = self._write_pos
+		if self.size < (start + len (data) - self._read_pos.value):
+			return None
+		pos = start % self.size
+		first = min (len (data), self.size - pos)
+		self._copy_in (pos, data[:first])
+		if first < len (data):
+			self._copy_in (0, data[first:])
+		self._write_pos = start + len (data)
+		return start, self._write_pos
+
+	def read (self, start, end):
+		"""
+		Copy data out of the ring, freeing its space for the writer.
+		"""
+		base = ctypes.addressof (self._buf)
+		pos = start % self.size
+		first = min (end - start, self.size - pos)
+		data = ctypes.string_at (base + pos, first)
+		if first < (end - start):
+			data += ctypes.string_at (base, end - start - first)
+		self._read_pos.value = end
+		return data
+
+
+def write_results (ring, results):
+	"""
+	Pack a list of `ScanResult` into a ring.
+
+	:Returns:
+		The (start, end) positions of the records, or `None` if they did not
+		fit (or could not be packed, having attributes too large).
+
+	"""
+	try:
+		data = ''.join ([pack_result (r) for r in results])
+	except struct.error:
+		return None
+	return ring.write (data)
+
+
+def read_results (ring, start, end, paths):
+	"""
+	Read back the results written by `write_results`.
+
+	:Parameters:
+		ring
+			The `ResultRing` they were written to.
+		start, end
+			Their positions, as returned by `write_results`.
+		paths
+			The paths of the books, in the same order as the results.
+
+	:Returns:
+		A list of `PackedScanResult`.
+
+	"""
+	data = ring.read (start, end)
+	results = []
+	pos = 0
+	for p in paths:
+		size, status = HEADER.unpack_from (data, pos)
+		if status == STATUS_RECORD:
+			results.append (PackedScanResult (p, data[pos:pos + size], None))
+		elif status == STATUS_ERROR:
+			results.append (PackedScanResult (p, None,
+				data[pos + HEADER.size:pos + size]))
+		else:
+			results.append (PackedScanResult (p, None, None))
+		pos += size
+	return results
+
+
+### END #######################################################################
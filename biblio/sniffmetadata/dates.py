@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Parsing and comparing the dates found in ebook metadata.
+
+Two forms are handled, both with as much or as little precision as given:
+
+* PDF dates, ``D:YYYYMMDDHHmmSSOHH'mm'``, where O is the relationship to UT
+  (``+``, ``-`` or ``Z``) and everything after the year is optional.
+* ISO 8601 (or rather W3C-DTF) dates as used in OPF and XMP, ``YYYY[-MM[-DD]]``
+  optionally followed by ``THH:MM[:SS][TZD]``.
+
+Dates are parsed by hand rather than with `strptime`, which is slow and cannot
+cope with partial dates. The same date strings turn up again and again across
+a library (every book from a publisher may carry the same one), so results are
+remembered by string. Each date also has a sort key, an integer of the form
+YYYYMMDDHHMMSS (in UT, where the time zone is known), so that the earliest of
+several dates can be found with `min` rather than a comparison function.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple
+import calendar
+import time
+
+
+### CONSTANTS & DEFINES
+
+# the most date strings to remember
+MAX_CACHE_SIZE = 4096
+
+# the widths of each field in a PDF date, and their ranges
+PDF_FIELDS = [(4, 0, 9999), (2, 1, 12), (2, 1, 31), (2, 0, 23), (2, 0, 59),
+	(2, 0, 60)]
+
+
+### IMPLEMENTATION ###
+
+class ParsedDate (namedtuple ('ParsedDate', ['year', 'month', 'day', 'hour',
+		'minute', 'second', 'tz'])):
+	"""
+	A date, as precise as it was given.
+
+	Missing fields are `None`. The time zone is the offset from UT in minutes.
+	"""
+	__slots__ = ()
+
+	def isoformat (self):
+		"""
+		Return the date in ISO 8601 form, to the precision it was given.
+		"""
+		parts = ['%04d' % self.year]
+		if self.month is not None:
+			parts.append ('-%02d' % self.month)
+			if self.day is not None:
+				parts.append ('-%02d' % self.day)
+		if self.hour is not None:
+			parts.append ('T%02d:%02d' % (self.hour, self.minute or 0))
+			if self.second is not None:
+				parts.append (':%02d' % self.second)
+			if self.tz == 0:
+				parts.append ('Z')
+			elif self.tz is not None:
+				parts.append ('%s%02d:%02d' % (self.tz < 0 and '-' or '+',
+					abs (self.tz) // 60, abs (self.tz) % 60))
+		return ''.join (parts)
+
+	@property
+	def sort_key (self):
+		"""
+		An integer that sorts dates in order, missing fields counting as zero.
+		"""
+		fields = [self.year, self.month or 0, self.day or 0, self.hour or 0,
+			self.minute or 0, self.second or 0]
+		if self.tz and (self.hour is not None):
+			try:
+				secs = calendar.timegm ((self.year, self.month or 1,
+					self.day or 1, self.hour, self.minute or 0,
+					self.second or 0)) - 60 * self.tz
+				fields = time.gmtime (secs)[:6]
+			except (ValueError, OverflowError):
+				# a year that cannot be handled (e.g. 0), so left as given
+				pass
+		key = 0
+		for f in fields:
+			key = key * 100 + f
+		return key
+
+
+def _make_date (fields, tz):
+	fields = fields + [None] * (6 - len (fields))
+	if fields[3] is None:
+		# a time zone means nothing without a time
+		tz = None
+	return ParsedDate (*(fields + [tz]))
+
+
+def _parse_tz (s):
+	# parse a time zone: Z, or +HH, +HH'mm', +HHmm or +HH:mm
+	if not s:
+		return None
+	if s[0] == 'Z':
+		return 0
+	if s[0] not in '+-':
+		return None
+	hh = s[1:3]
+	if not hh.isdigit():
+		return None
+	mm = s[3:].strip ("':")[:2]
+	mins = int (hh) * 60 + (mm.isdigit() and int (mm) or 0)
+	return s[0] == '-' and -mins or mins
+
+
+def parse_pdf_date (s):
+	"""
+	Parse a PDF date, ``D:YYYYMMDDHHmmSSOHH'mm'``, where all but the year may
+	be missing and the prefix is optional.
+
+	:Returns:
+		A `ParsedDate`, or `None` if there is not even a year.
+
+	A field out of range ends the date, so that "20010000" is just 2001.
+	"""
+	s = s.strip()
+	if s.startswith ('D:'):
+		s = s[2:]
+	fields = []
+	i = 0
+	for width, lo, hi in PDF_FIELDS:
+		part = s[i:i + width]
+		if (len (part) < width) or not part.isdigit():
+			break
+		val = int (part)
+		if not (lo <= val <= hi):
+			break
+		fields.append (val)
+		i += width
+	if not fields:
+		return None
+	return _make_date (fields, _parse_tz (s[i:]))
+
+
+def parse_iso_date (s):
+	"""
+	Parse an ISO 8601 date, ``YYYY[-MM[-DD]]`` with an optional time.
+
+	:Returns:
+		A `ParsedDate`, or `None` if there is not even a year.
+
+	"""
+	s = s.strip()
+	year = s[:4]
+	if not year.isdigit():
+		return None
+	fields = [int (year)]
+	# the date: -MM-DD, each checked in turn
+	for start, lo, hi in [(5, 1, 12), (8, 1, 31)]:
+		part = s[start:start + 2]
+		if (s[start - 1:start] != '-') or not part.isdigit() or \
+				not (lo <= int (part) <= hi):
+			return _make_date (fields, None)
+		fields.append (int (part))
+	# the time: THH:MM[:SS[.sss]], then the zone
+	if s[10:11] not in ['T', ' ']:
+		return _make_date (fields, None)
+	hh, mm = s[11:13], s[14:16]
+	if not (hh.isdigit() and mm.isdigit() and (s[13:14] == ':')):
+		return _make_date (fields, None)
+	fields.extend ([int (hh), int (mm)])
+	i = 16
+	if (s[i:i + 1] == ':') and s[i + 1:i + 3].isdigit():
+		fields.append (int (s[i + 1:i + 3]))
+		i += 3
+		# fractions of a second are dropped
+		if s[i:i + 1] == '.':
+			i += 1
+			while s[i:i + 1].isdigit():
+				i += 1
+	return _make_date (fields, _parse_tz (s[i:]))
+
+
+_cache = {}
+
+
+def _parse (s):
+	if s.startswith ('D:') or s[:8].isdigit():
+		return parse_pdf_date (s)
+	return parse_iso_date (s)
+
+
+def _lookup (s):
+	# return the parsed date and sort key for a string, remembering them
+	try:
+		return _cache[s]
+	except KeyError:
+		pass
+	d = None
+	if isinstance (s, basestring):
+		d = _parse (s.strip())
+	entry = (d, d and d.sort_key)
+	if MAX_CACHE_SIZE <= len (_cache):
+		_cache.clear()
+	_cache[s] = entry
+	return entry
+
+
+def parse_date (s):
+	"""
+	Parse a date in any of the forms handled.
+
+	:Returns:
+		A `ParsedDate`, or `None` if it cannot be parsed.
+
+	"""
+	return _lookup (s)[0]
+
+
+def date_sort_key (s):
+	"""
+	Return the sort key of a date string, or `None` if it cannot be parsed.
+	"""
+	return _lookup (s)[1]
+
+
+def parse_dates (strs):
+	"""
+	Parse a list of dates, returning a list of `ParsedDate` (or `None`).
+	"""
+	return [_lookup (s)[0] for s in strs]
+
+
+def date_sort_keys (strs):
+	"""
+	Return the sort keys for a list of dates (or `None` for any unparseable).
+	"""
+	return [_lookup (s)[1] for s in strs]
+
+
+def earliest_date (strs):
+	"""
+	Return the earliest of several dates as a `ParsedDate`, or `None`.
+
+	Dates that cannot be parsed are ignored.
+	"""
+	best = None
+	for s in strs:
+		d, key = _lookup (s)
+		if (d is not None) and ((best is None) or (key < best[1])):
+			best = (d, key)
+	return best and best[0]
+
+
+### END #######################################################################
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Finding copies of the same ebook by their contents, reading as little as possible.
+
+Books are narrowed down in stages, each more expensive than the last but done
+for fewer books:
+
+1. Every book is stat-ed and its format found by the reader registry, from its
+   first bytes. Books that are not epubs can only be copies of books of the
+   same size.
+2. For epubs, the central directory of the zip is read (as the epub reader
+   does on opening), giving the name, CRC and size of every member. Epubs with
+   the same members hold the same files, however they were zipped.
+3. Candidates are given a partial hash: of the OPF and the member list for
+   epubs, or of the start and end of the file for anything else.
+4. Only books whose partial hashes match are hashed in full: their contents
+   for epubs, all their bytes for anything else.
+
+Duplicates are reported in sets, as either identical files or (for epubs) the
+same files packaged differently. Where some epubs in a set of the latter are
+also identical files, they are reported again as a set of their own.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple
+import hashlib
+import os
+
+from biblio.sniffmetadata.cache import file_digest
+from biblio.sniffmetadata.instrument import get_profiler
+from biblio.sniffmetadata.readers.registry import default_registry
+
+
+### CONSTANTS & DEFINES
+
+# the kinds of duplicate
+IDENTICAL = 'identical'
+SAME_CONTENT = 'same content'
+
+# how much of the start and end of a file is hashed in the partial hash
+PARTIAL_BYTES = 1 << 16
+
+
+### IMPLEMENTATION ###
+
+class DuplicateSet (namedtuple ('DuplicateSet', ['kind', 'digest', 'paths'])):
+	"""
+	Books found to be copies of each other.
+
+	The kind is `IDENTICAL` if the files are the same byte for byte, or
+	`SAME_CONTENT` for epubs that hold the same files but are zipped
+	differently. The digest is the full hash they share: of the files or of
+	their contents respectively.
+	"""
+	__slots__ = ()
+
+
+def _groups (keyed):
+	# gather (key, path) pairs into (key, paths) where more than one path
+	by_key = {}
+	for k, p in keyed:
+		by_key.setdefault (k, []).append (p)
+	return [(k, v) for k, v in by_key.iteritems() if 1 < len (v)]
+
+
+def partial_digest (path, size, nbytes=PARTIAL_BYTES):
+	"""
+	Return a hash of the start and end of a file.
+	"""
+	h = hashlib.sha1()
+	hndl = open (path, 'rb')
+	try:
+		h.update (hndl.read (nbytes))
+		if (2 * nbytes) < size:
+			hndl.seek (-nbytes, os.SEEK_END)
+			h.update (hndl.read (nbytes))
+		elif nbytes < size:
+			h.update (hndl.read())
+	finally:
+		hndl.close()
+	return h.hexdigest()
+
+
+def epub_members (rdr):
+	"""
+	Return the sorted (name, CRC, size) of every member of an open epub.
+	"""
+	return sorted ([(i.filename, i.CRC, i.file_size) for i in
+		rdr.members.itervalues()])
+
+
+def _members_key (members):
+	return hashlib.sha1 (''.join (['%s\0%08x\0%d\n' % (
+		n.encode ('utf8') if isinstance (n, unicode) else n, crc, size)
+		for n, crc, size in members])).hexdigest()
+
+
+def epub_partial_digest (rdr, members):
+	"""
+	Return a hash of an open epub's OPF and the list of its members.
+	"""
+	h = hashlib.sha1 (_members_key (members))
+	contents_path = rdr.find_contents_file()
+	if contents_path:
+		h.update (rdr.read_member (contents_path))
+	return h.hexdigest()
+
+
+def epub_content_digest (rdr, members):
+	"""
+	Return a hash of the names and contents of every member of an open epub.
+
+	Unlike the hash of the file, this is the same however the epub was zipped.
+	"""
+	h = hashlib.sha1()
+	for name, crc, size in members:
+		h.update ('%s\0%d\0' % (name.encode ('utf8') if isinstance (name,
+			unicode) else name, size))
+		h.update (rdr.read_member (name))
+	return h.hexdigest()
+
+
+def _epub_reader():
+	from biblio.sniffmetadata.readers.epubmetadatareader import EpubMetaReader
+	return EpubMetaReader
+
+
+def _open_epub (path):
+	return _epub_reader() (path)
+
+
+def _key_epubs (paths, func, unreadable):
+	# key epubs by func (rdr, members), noting any that cannot be read
+	keyed = []
+	for p in paths:
+		try:
+			with _open_epub (p) as rdr:
+				keyed.append ((func (rdr, epub_members (rdr)), p))
+		except Exception:
+			unreadable.append (p)
+	return keyed
+
+
+def _epub_duplicates (paths, sizes, prof):
+	# returns the sets found, and the epubs that could not be read as such
+	unreadable = []
+	with prof.phase ('dedupe.directory'):
+		keyed = _key_epubs (paths, lambda rdr, members: _members_key (members),
+			unreadable)
+	found = []
+	for members_key, group in _groups (keyed):
+		prof.count ('dedupe.partial_hashes', len (group))
+		with prof.phase ('dedupe.partial'):
+			keyed = _key_epubs (group, epub_partial_digest, unreadable)
+		for partial, candidates in _groups (keyed):
+			prof.count ('dedupe.full_hashes', len (candidates))
+			with prof.phase ('dedupe.full'):
+				keyed = _key_epubs (candidates, epub_content_digest, unreadable)
+			for digest, dupes in _groups (keyed):
+				found.extend (_epub_sets (digest, dupes, sizes, prof))
+	return found, unreadable
+
+
+def _epub_sets (digest, dupes, sizes, prof):
+	# sort epubs with the same contents into those that are the same files
+	identical = []
+	for size, group in _groups ([(sizes[p], p) for p in dupes]):
+		prof.count ('dedupe.full_hashes', len (group))
+		with prof.phase ('dedupe.full'):
+			keyed = [(file_digest (p), p) for p in group]
+		identical.extend ([DuplicateSet (IDENTICAL, file_hash, sorted (same))
+			for file_hash, same in _groups (keyed)])
+	if (len (identical) == 1) and (len (identical[0].paths) == len (dupes)):
+		return identical
+	return [DuplicateSet (SAME_CONTENT, digest, sorted (dupes))] + identical
+
+
+def _file_duplicates (paths, sizes, prof):
+	found = []
+	for size, group in _groups ([(sizes[p], p) for p in paths]):
+		prof.count ('dedupe.partial_hashes', len (group))
+		with prof.phase ('dedupe.partial'):
+			keyed = [(partial_digest (p, size), p) for p in group]
+		for partial, candidates in _groups (keyed):
+			prof.count ('dedupe.full_hashes', len (candidates))
+			with prof.phase ('dedupe.full'):
+				keyed = [(file_digest (p), p) for p in candidates]
+			for digest, dupes in _groups (keyed):
+				found.append (DuplicateSet (IDENTICAL, digest, sorted (dupes)))
+	return found
+
+
+def find_duplicate_files (paths, registry=None):
+	"""
+	Find books that are copies of each other.
+
+	:Parameters:
+		paths
+			An iterable of the paths of books.
+		registry
+			The `ReaderRegistry` used to recognise epubs, by default the
+			default one.
+
+	:Returns:
+		A list of `DuplicateSet`, sorted by their first path. Identical epubs
+		within a set of the same content are listed in a further set.
+
+	Epubs that cannot be read as zips are compared as plain files. Paths that
+	cannot be stat-ed or read are skipped.
+	"""
+	prof = get_profiler()
+	registry = registry or default_registry
+	epub_reader = _epub_reader()
+	sizes = {}
+	epubs = []
+	others = []
+	with prof.phase ('dedupe.stat'):
+		for p in paths:
+			if p in sizes:
+				continue
+			try:
+				sizes[p] = os.stat (p).st_size
+				reader = registry.reader_for_path (p)
+			except EnvironmentError:
+				sizes.pop (p, None)
+				continue
+			if (reader is not None) and issubclass (reader, epub_reader):
+				epubs.append (p)
+			else:
+				others.append (p)
+	found, unreadable = _epub_duplicates (epubs, sizes, prof)
+	found.extend (_file_duplicates (others + unreadable, sizes, prof))
+	return sorted (found, key=lambda x: x.paths)
+
+
+### END #######################################################################
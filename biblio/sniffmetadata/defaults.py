@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Defaults shared by the library and the scripts.
+
+These are kept apart from the modules that use them, so that the scripts can
+offer them as option defaults without importing those modules (and all that
+they import) on every run.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+
+
+### CONSTANTS & DEFINES
+
+## Rename templates
+
+# will be supplied with metadata, unknown and ext
+DEFAULT_TMPL = """
+## the first authors family name
+##
+#if $metadata.authors
+#set $auth = $metadata.authors[0].family or $metadata.authors[0].given
+#elif $metadata.creators
+#set $auth = $metadata.creators[0].family or $metadata.creators[0].given
+#else
+#set $auth = $unknown
+#end if
+##
+## the publication year
+##
+#if $metadata.publication
+#set $year = $metadata.publication.year
+#else
+#set $year = $unknown
+#end if
+##
+## title
+##
+#set $title = $metadata.short_title or $unknown
+##
+## isbn
+##
+#if $metadata.isbn
+#set $isbn = $metadata.isbn[0].value
+#else
+#set $isbn = $unknown
+#end if
+##
+## put it all together
+##
+$auth ($year) $title (isbn$isbn).$ext
+"""
+
+DEFAULT_CACHE_DIR = os.path.join (
+	os.environ.get ('XDG_CACHE_HOME', os.path.expanduser (os.path.join ('~', '.cache'))),
+	'biblio-sniffmetadata', 'templates')
+
+
+## Metadata cache
+
+DEFAULT_MAX_ENTRIES = 500000
+
+
+## Export
+
+EXPORT_FORMATS = ['columnar', 'csv', 'jsonl']
+
+
+## Renaming
+
+DEFAULT_JOURNAL = 'sniff_metadata.journal'
+
+
+### END #######################################################################
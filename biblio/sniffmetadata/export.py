@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Exporting the metadata of many books in a form suitable for analysis.
+
+A few commonly used fields are pulled out of each record (title, first author,
+year, ISBN, language, publisher and path) and accumulated in typed column
+buffers. These are written in batches to a compact binary file, in which each
+string column is stored as an array of offsets into a single block of UTF-8
+text and the year as an array of integers (in the manner of Arrow). The file
+can be read back quickly with `read_columnar`.
+
+Writers for CSV and JSON lines are also provided, with the same interface.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from array import array
+import csv
+import json
+import struct
+import sys
+
+from biblio.sniffmetadata.utils import first_isbn, publication_year
+
+
+### CONSTANTS & DEFINES
+
+COLUMNAR_MAGIC = 'SNIFCOL1'
+
+# column name and type: 's' for string, 'h' for (16-bit) integer
+COLUMNS = [
+	('path', 's'),
+	('title', 's'),
+	('author', 's'),
+	('year', 'h'),
+	('isbn', 's'),
+	('language', 's'),
+	('publisher', 's'),
+]
+
+COLUMN_NAMES = [c[0] for c in COLUMNS]
+
+DEFAULT_BATCH_SIZE = 65536
+
+# offsets into string data are unsigned 32-bit ints
+OFFSET_TYPE = 'I'
+
+
+### IMPLEMENTATION ###
+
+def _first_value (md, field):
+	vals = md.get (field)
+	if vals:
+		return vals[0].value
+	return u''
+
+
+def path_to_unicode (path):
+	"""
+	Return a path as unicode, whatever it was encoded in.
+
+	Paths are tried as UTF-8 and then the filesystem encoding, with any bytes
+	that cannot be decoded replaced, so that one odd name cannot spoil an
+	export.
+	"""
+	if isinstance (path, unicode):
+		return path
+	try:
+		return path.decode ('utf8')
+	except UnicodeDecodeError:
+		return path.decode (sys.getfilesystemencoding() or 'utf8', 'replace')
+
+
+def summarise_record (path, md):
+	"""
+	Return the exported fields of a book, in column order.
+	"""
+	auths = md.authors() or md.creators()
+	year = publication_year (md)
+	return (
+		path_to_unicode (path),
+		_first_value (md, 'title'),
+		auths and auths[0].value or u'',
+		year and int (year) or 0,
+		first_isbn (md) or u'',
+		_first_value (md, 'language'),
+		_first_value (md, 'publisher'),
+	)
+
+
+def _to_utf8 (s):
+	if isinstance (s, unicode):
+		return s.encode ('utf8')
+	return s
+
+
+def _write_array (hndl, arr):
+	# arrays are always written little-endian
+	if sys.byteorder == 'big':
+		arr = array (arr.typecode, arr)
+		arr.byteswap()
+	hndl.write (arr.tostring())
+
+
+def _read_array (hndl, typecode, count):
+	arr = array (typecode)
+	arr.fromstring (hndl.read (arr.itemsize * count))
+	if sys.byteorder == 'big':
+		arr.byteswap()
+	return arr
+
+
+class ColumnarWriter (object):
+	"""
+	Accumulates book records in column buffers and writes them in batches.
+	"""
+	def __init__ (self, hndl, batch_size=DEFAULT_BATCH_SIZE):
+		"""
+		C'tor.
+
+		:Parameters:
+			hndl
+				An open (binary) file to write to.
+			batch_size
+				The number of records to hold before writing them out.
+
+		"""
+		self._hndl = hndl
+		self.batch_size = batch_size
+		self._hndl.write (COLUMNAR_MAGIC)
+		self._reset()
+
+	def _reset (self):
+		self._rows = 0
+		self._buffers = []
+		for name, col_type in COLUMNS:
+			if col_type == 's':
+				self._buffers.append ((array (OFFSET_TYPE, [0]), []))
+			else:
+				self._buffers.append (array (col_type))
+
+	def add (self, path, md):
+		"""
+		Add a book to the export.
+		"""
+		for (name, col_type), buf, val in zip (COLUMNS, self._buffers,
+				summarise_record (path, md)):
+			if col_type == 's':
+				offsets, data = buf
+				val = _to_utf8 (val)
+				data.append (val)
+				offsets.append (offsets[-1] + len (val))
+			else:
+				buf.append (val)
+		self._rows += 1
+		if self.batch_size <= self._rows:
+			self.flush()
+
+	def flush (self):
+		"""
+		Write out any buffered records as a batch.
+		"""
+		if not self._rows:
+			return
+		self._hndl.write (struct.pack ('<I', self._rows))
+		for (name, col_type), buf in zip (COLUMNS, self._buffers):
+			self._hndl.write (col_type)
+			if col_type == 's':
+				offsets, data = buf
+				data = ''.join (data)
+				_write_array (self._hndl, offsets)
+				self._hndl.write (struct.pack ('<I', len (data)))
+				self._hndl.write (data)
+			else:
+				_write_array (self._hndl, buf)
+		self._reset()
+
+	def close (self):
+		self.flush()
+
+
+def iter_columnar_batches (hndl):
+	"""
+	Read back a columnar export, batch by batch.
+
+	:Returns:
+		An iterator of dicts, mapping column names to lists of unicode strings
+		or arrays of integers.
+
+	"""
+	if hndl.read (len (COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+		raise ValueError ("not a columnar metadata export")
+	while True:
+		header = hndl.read (4)
+		if not header:
+			return
+		rows = struct.unpack ('<I', header)[0]
+		batch = {}
+		for name, col_type in COLUMNS:
+			if hndl.read (1) != col_type:
+				raise ValueError ("malformed column '%s'" % name)
+			if col_type == 's':
+				offsets = _read_array (hndl, OFFSET_TYPE, rows + 1)
+				size = struct.unpack ('<I', hndl.read (4))[0]
+				data = hndl.read (size)
+				# replacing anything undecodable, as older exports could hold
+				# paths in other encodings
+				batch[name] = [data[offsets[i]:offsets[i+1]].decode ('utf8',
+					'replace') for i in xrange (rows)]
+			else:
+				batch[name] = _read_array (hndl, col_type, rows)
+		yield batch
+
+
+def read_columnar (path):
+	"""
+	Read a whole columnar export into memory.
+
+	:Returns:
+		A dict of column names to lists (or arrays) of values.
+
+	"""
+	cols = dict ([(name, []) for name in COLUMN_NAMES])
+	hndl = open (path, 'rb')
+	try:
+		for batch in iter_columnar_batches (hndl):
+			for name in COLUMN_NAMES:
+				cols[name].extend (batch[name])
+	finally:
+		hndl.close()
+	return cols
+
+
+class CsvWriter (object):
+	"""
+	Writes book records as CSV, with a header row.
+	"""
+	def __init__ (self, hndl):
+		self._writer = csv.writer (hndl)
+		self._writer.writerow (COLUMN_NAMES)
+
+	def add (self, path, md):
+		self._writer.writerow ([_to_utf8 (x) for x in summarise_record (path, md)])
+
+	def close (self):
+		pass
+
+
+class JsonlWriter (object):
+	"""
+	Writes book records as JSON objects, one per line.
+	"""
+	def __init__ (self, hndl):
+		self._hndl = hndl
+
+	def add (self, path, md):
+		rec = dict (zip (COLUMN_NAMES, summarise_record (path, md)))
+		self._hndl.write (json.dumps (rec, sort_keys=True))
+		self._hndl.write ('\n')
+
+	def close (self):
+		pass
+
+
+def make_writer (fmt, hndl, **kwargs):
+	"""
+	Return a writer for the named export format.
+	"""
+	writers = {
+		'columnar': ColumnarWriter,
+		'csv': CsvWriter,
+		'jsonl': JsonlWriter,
+	}
+	return writers[fmt] (hndl, **kwargs)
+
+
+### END #######################################################################
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Keeping the number of open ebook files bounded in long-running processes.
+
+Readers hold their ebook open until closed. A `HandlePool` hands out readers
+as context managers, so they are always closed promptly, and limits how many
+may be open at once across threads. It also counts readers opened and closed,
+and the file descriptors used by the process, so that a leak shows up as a
+steady climb rather than an eventual "too many open files".
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from contextlib import contextmanager
+import os
+import threading
+
+
+### CONSTANTS & DEFINES
+
+DEFAULT_MAX_OPEN = 64
+
+# where a process can list its own open file descriptors
+FD_DIRS = ['/proc/self/fd', '/dev/fd']
+
+
+### IMPLEMENTATION ###
+
+def count_open_fds():
+	"""
+	Return the number of file descriptors open in this process, or `None`.
+
+	`None` is returned where this cannot be told.
+	"""
+	for d in FD_DIRS:
+		try:
+			# listing the directory takes a descriptor of its own
+			return len (os.listdir (d)) - 1
+		except OSError:
+			continue
+	return None
+
+
+class HandlePool (object):
+	"""
+	Opens readers, closes them after use and limits how many are open at once.
+	"""
+	def __init__ (self, max_open=DEFAULT_MAX_OPEN):
+		"""
+		C'tor.
+
+		:Parameters:
+			max_open
+				The most readers that may be open at once. Any more wait until
+				another is closed.
+
+		"""
+		self.max_open = max_open
+		self._slots = threading.BoundedSemaphore (max_open)
+		self._lock = threading.Lock()
+		self._open = 0
+		self._peak_open = 0
+		self._opened = 0
+		self._closed = 0
+		self._failed = 0
+
+	@contextmanager
+	def reader (self, reader_cls, src):
+		"""
+		Open a reader for an ebook, for use in a `with` statement.
+
+		:Parameters:
+			reader_cls
+				The class of reader.
+			src
+				A path, open file or buffer, as accepted by the reader.
+
+		The reader is closed when the block is left, however that happens.
+		"""
+		self._slots.acquire()
+		try:
+			try:
+				rdr = reader_cls (src)
+			except:
+				with self._lock:
+					self._failed += 1
+				raise
+			with self._lock:
+				self._open += 1
+				self._opened += 1
+				self._peak_open = max (self._peak_open, self._open)
+			try:
+				yield rdr
+			finally:
+				rdr.close()
+				with self._lock:
+					self._open -= 1
+					self._closed += 1
+		finally:
+			self._slots.release()
+
+	def stats (self):
+		"""
+		Return the usage of the pool.
+
+		:Returns:
+			A dict giving the number of readers currently 'open', the
+			'peak_open', the total 'opened', 'closed' and 'failed' to open, and
+			the file descriptors ('fds') open in the whole process.
+
+		"""
+		with self._lock:
+			stats = {
+				'open': self._open,
+				'peak_open': self._peak_open,
+				'opened': self._opened,
+				'closed': self._closed,
+				'failed': self._failed,
+			}
+		stats['fds'] = count_open_fds()
+		return stats
+
+
+### END #######################################################################
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+A persistent, incrementally updated index of the metadata of an ebook library.
+
+The index records the path, a fingerprint (device, inode, size & modification
+time) and the Dublin Core metadata of every book under a set of directories.
+When updated, the directories are walked and compared against the index using
+stat data alone, so that only books that have been added or modified need be
+read. Books that have been moved or renamed are recognised by their fingerprint
+and simply have their path updated, and books that have gone are dropped.
+
+The index can then be queried by ISBN, author or year without opening any
+books.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple
+import json
+import os
+
+from biblio.sniffmetadata.batch import scan_paths
+from biblio.sniffmetadata.readers.registry import default_registry
+from biblio.sniffmetadata.metadata import MetadataDict
+from biblio.sniffmetadata.isbn import canonical_isbns, clean_isbn, to_isbn13
+from biblio.sniffmetadata.utils import publication_year
+
+
+### CONSTANTS & DEFINES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+	path TEXT PRIMARY KEY,
+	dev INTEGER NOT NULL,
+	inode INTEGER NOT NULL,
+	size INTEGER NOT NULL,
+	mtime REAL NOT NULL,
+	year TEXT,
+	record TEXT,
+	error TEXT
+);
+CREATE INDEX IF NOT EXISTS books_year ON books (year);
+CREATE TABLE IF NOT EXISTS isbns (
+	isbn TEXT NOT NULL,
+	path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS isbns_isbn ON isbns (isbn);
+CREATE INDEX IF NOT EXISTS isbns_path ON isbns (path);
+CREATE TABLE IF NOT EXISTS authors (
+	name TEXT NOT NULL,
+	path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS authors_name ON authors (name);
+CREATE INDEX IF NOT EXISTS authors_path ON authors (path);
+"""
+
+DETAIL_TABLES = ['isbns', 'authors']
+
+
+### IMPLEMENTATION ###
+
+ChangeSet = namedtuple ('ChangeSet', ['added', 'modified', 'moved', 'deleted',
+	'errors'])
+
+
+def normalize_isbn (val):
+	"""
+	Return the form an ISBN is indexed under.
+
+	Valid ISBNs are indexed as ISBN-13, so a book can be found by either form.
+	"""
+	return to_isbn13 (val) or clean_isbn (val)
+
+
+def fingerprint (st):
+	"""
+	Return the identifying details of a file from its stat data.
+	"""
+	return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+
+def like_escape (s):
+	"""
+	Return a string with the wildcards of a LIKE pattern escaped by '\\'.
+	"""
+	for c in '\\%_':
+		s = s.replace (c, '\\' + c)
+	return s
+
+
+def walk_library (roots, exts=None):
+	"""
+	Find all ebooks under a set of directories.
+
+	:Parameters:
+		roots
+			A list of directories (or individual files) to search.
+		exts
+			The file extensions to consider, defaulting to all those handled
+			by the readers.
+
+	:Returns:
+		An iterator of (absolute path, stat data) pairs, in sorted order
+		within each directory.
+
+	"""
+	if exts is None:
+		exts = default_registry.handled_exts()
+	def wanted (name):
+		return os.path.splitext (name)[1][1:].lower() in exts
+	for r in roots:
+		r = os.path.abspath (r)
+		if os.path.isfile (r):
+			yield r, os.stat (r)
+			continue
+		for dir_path, dir_names, file_names in os.walk (r):
+			# walk in a predictable order
+			dir_names.sort()
+			for f in sorted (file_names):
+				if wanted (f):
+					p = os.path.join (dir_path, f)
+					try:
+						yield p, os.stat (p)
+					except OSError:
+						# vanished while we were looking
+						pass
+
+
+class LibraryIndex (object):
+	"""
+	A searchable record of the books in a library.
+	"""
+	def __init__ (self, db_path):
+		import sqlite3
+		self._conn = sqlite3.connect (db_path)
+		self._conn.executescript (SCHEMA)
+
+	def close (self):
+		if self._conn is not None:
+			self._conn.commit()
+			self._conn.close()
+			self._conn = None
+
+	def _known_under (self, roots):
+		# return the fingerprints of indexed books under the given roots
+		known = {}
+		for r in roots:
+			prefix = r.rstrip (os.sep) + os.sep
+			for p, dev, ino, size, mtime in self._conn.execute (
+					"""SELECT path, dev, inode, size, mtime FROM books
+					WHERE path = ? OR path LIKE ? ESCAPE '\\'""",
+					(r, like_escape (prefix) + '%')):
+				# LIKE ignores case, paths don't
+				if (p == r) or p.startswith (prefix):
+					known[p] = (dev, ino, size, mtime)
+		return known
+
+	def _remove (self, path):
+		self._conn.execute ("DELETE FROM books WHERE path = ?", (path,))
+		for t in DETAIL_TABLES:
+			self._conn.execute ("DELETE FROM %s WHERE path = ?" % t, (path,))
+
+	def _move (self, old_path, new_path):
+		self._conn.execute ("UPDATE books SET path = ? WHERE path = ?",
+			(new_path, old_path))
+		for t in DETAIL_TABLES:
+			self._conn.execute ("UPDATE %s SET path = ? WHERE path = ?" % t,
+				(new_path, old_path))
+
+	def _store (self, path, ident, record, error=None):
+		self._remove (path)
+		md = year = None
+		if record is not None:
+			md = MetadataDict.from_compact (record)
+			year = publication_year (md)
+		self._conn.execute ("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+			(path,) + tuple (ident) + (year, json.dumps (record), error))
+		if md is not None:
+			ids = [x.value for x in md.identifiers()]
+			isbns = set ([c or clean_isbn (v) for v, c in
+				zip (ids, canonical_isbns (ids))])
+			self._conn.executemany ("INSERT INTO isbns VALUES (?, ?)",
+				[(x, path) for x in isbns if x])
+			names = set()
+			for x in md.creators():
+				names.add (x.value.strip().lower())
+				if x.attribs.get ('file-as'):
+					names.add (x.attribs['file-as'].strip().lower())
+			self._conn.executemany ("INSERT INTO authors VALUES (?, ?)",
+				[(x, path) for x in names if x])
+
+	def update (self, roots, jobs=1):
+		"""
+		Bring the index up to date with the books under a set of directories.
+
+		:Parameters:
+			roots
+				The directories to search. Only indexed books under these will
+				be checked for deletion.
+			jobs
+				The number of processes to read new books with.
+
+		:Returns:
+			A `ChangeSet` of the paths added, modified, moved (as old and new
+			path pairs) and deleted, and those (with error messages) that could
+			not be read.
+
+		"""
+		roots = [os.path.abspath (r) for r in roots]
+		seen = dict ([(p, fingerprint (st)) for p, st in walk_library (roots)])
+		known = self._known_under (roots)
+
+		added = [p for p in seen if p not in known]
+		deleted = [p for p in known if p not in seen]
+		modified = [p for p in seen if (p in known) and (known[p] != seen[p])]
+
+		# a book that is gone with the same fingerprint as a new one has moved
+		gone_by_ident = dict ([(known[p], p) for p in deleted])
+		moved = []
+		for p in added:
+			old_p = gone_by_ident.pop (seen[p], None)
+			if old_p is not None:
+				moved.append ((old_p, p))
+		moved_to = set ([new_p for old_p, new_p in moved])
+		added = [p for p in added if p not in moved_to]
+		deleted = gone_by_ident.values()
+
+		for old_p, new_p in moved:
+			self._move (old_p, new_p)
+		for p in deleted:
+			self._remove (p)
+		errors = []
+		for res in scan_paths (sorted (added + modified), jobs=jobs):
+			# unreadable books are recorded too, so they aren't retried until
+			# they change
+			if res.error:
+				errors.append ((res.path, res.error))
+			self._store (res.path, seen[res.path], res.record, res.error)
+		self._conn.commit()
+
+		return ChangeSet (sorted (added), sorted (modified), sorted (moved),
+			sorted (deleted), errors)
+
+	def __len__ (self):
+		return self._conn.execute ("SELECT COUNT(*) FROM books").fetchone()[0]
+
+	def _books (self, sql, args):
+		books = []
+		for p, r in self._conn.execute (sql, args):
+			record = json.loads (r)
+			if record is not None:
+				record = MetadataDict.from_compact (record)
+			books.append ((p, record))
+		return books
+
+	def get (self, path):
+		"""
+		Return the metadata recorded for a book, or `None`.
+		"""
+		res = self._books ("SELECT path, record FROM books WHERE path = ?",
+			(os.path.abspath (path),))
+		if res:
+			return res[0][1]
+		return None
+
+	def find_by_isbn (self, isbn):
+		"""
+		Return the (path, metadata) of books with the given identifier.
+		"""
+		return self._books ("""SELECT DISTINCT books.path, books.record FROM books
+			JOIN isbns ON books.path = isbns.path WHERE isbns.isbn = ?""",
+			(normalize_isbn (isbn),))
+
+	def find_duplicates (self):
+		"""
+		Return books that share an ISBN with another.
+
+		:Returns:
+			A list of (ISBN-13, list of paths) pairs, sorted by ISBN.
+
+		"""
+		rows = self._conn.execute ("""SELECT isbn, path FROM isbns WHERE isbn IN
+			(SELECT isbn FROM isbns GROUP BY isbn HAVING COUNT (DISTINCT path) > 1)
+			ORDER BY isbn, path""").fetchall()
+		dupes = []
+		for isbn, path in rows:
+			# other identifiers (e.g. UUIDs) are indexed alongside ISBNs
+			if to_isbn13 (isbn) is None:
+				continue
+			if not dupes or dupes[-1][0] != isbn:
+				dupes.append ((isbn, []))
+			dupes[-1][1].append (path)
+		return dupes
+
+	def find_by_author (self, name):
+		"""
+		Return the (path, metadata) of books by an author.
+
+		The name is matched case-insensitively against any part of the author
+		names or their sortable ("file-as") forms.
+		"""
+		return self._books ("""SELECT DISTINCT books.path, books.record FROM books
+			JOIN authors ON books.path = authors.path
+			WHERE authors.name LIKE ? ESCAPE '\\'""",
+			('%%%s%%' % like_escape (name.strip().lower()),))
+
+	def find_by_year (self, year):
+		"""
+		Return the (path, metadata) of books published in a given year.
+		"""
+		return self._books ("SELECT path, record FROM books WHERE year = ?",
+			(str (year),))
+
+
+### END #######################################################################
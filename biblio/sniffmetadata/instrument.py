@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Timing the phases of reading ebooks, and counting the work done.
+
+Readers, the batch functions and the scripts report what they do to the
+current profiler: how long each phase (opening a book, finding its contents
+file, parsing, munging, rendering names, renaming) takes and counts like the
+bytes read, members decompressed and XML elements visited. By default this is
+a `NullProfiler`, which does nothing and costs next to nothing, so the calls
+can be left in the hot paths. To collect figures, install a `Profiler`::
+
+	prof = Profiler()
+	set_profiler (prof)
+	... read books ...
+	print prof.report()
+
+The figures can also be passed to hooks (e.g. to push them to a metrics
+system) by calling `emit`.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import time
+
+
+### CONSTANTS & DEFINES
+
+### IMPLEMENTATION ###
+
+class _Phase (object):
+	# times a block, adding the result to a profiler
+	__slots__ = ('_prof', '_name', '_start')
+
+	def __init__ (self, prof, name):
+		self._prof = prof
+		self._name = name
+
+	def __enter__ (self):
+		self._start = time.time()
+		return self
+
+	def __exit__ (self, exc_type, exc_val, exc_tb):
+		self._prof.add_time (self._name, time.time() - self._start)
+
+
+class _NullPhase (object):
+	# a block that is not timed
+	__slots__ = ()
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, exc_type, exc_val, exc_tb):
+		pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullProfiler (object):
+	"""
+	A profiler that records nothing, for when profiling is off.
+	"""
+	enabled = False
+
+	def phase (self, name):
+		return _NULL_PHASE
+
+	def add_time (self, name, secs):
+		pass
+
+	def count (self, name, n=1):
+		pass
+
+	def merge (self, stats):
+		pass
+
+	def to_dict (self):
+		return {'phases': {}, 'counters': {}}
+
+	def emit (self):
+		pass
+
+
+class Profiler (object):
+	"""
+	Records the time taken by phases of work, and counts of what was done.
+	"""
+	enabled = True
+
+	def __init__ (self, hooks=None):
+		"""
+		C'tor.
+
+		:Parameters:
+			hooks
+				Callables to be passed the figures (as per `to_dict`) whenever
+				`emit` is called.
+
+		"""
+		self.hooks = list (hooks or [])
+		self.reset()
+
+	def reset (self):
+		# phase name -> [calls, total secs, max secs]
+		self._phases = {}
+		self._counters = {}
+
+	def phase (self, name):
+		"""
+		Return a context manager that times a block as the named phase.
+		"""
+		return _Phase (self, name)
+
+	def add_time (self, name, secs):
+		entry = self._phases.get (name)
+		if entry is None:
+			self._phases[name] = [1, secs, secs]
+		else:
+			entry[0] += 1
+			entry[1] += secs
+			if entry[2] < secs:
+				entry[2] = secs
+
+	def count (self, name, n=1):
+		self._counters[name] = self._counters.get (name, 0) + n
+
+	def merge (self, stats):
+		"""
+		Add in figures from elsewhere (e.g. a worker process), as per `to_dict`.
+		"""
+		for name, ph in stats.get ('phases', {}).iteritems():
+			entry = self._phases.setdefault (name, [0, 0.0, 0.0])
+			entry[0] += ph['calls']
+			entry[1] += ph['total']
+			entry[2] = max (entry[2], ph['max'])
+		for name, n in stats.get ('counters', {}).iteritems():
+			self.count (name, n)
+
+	def to_dict (self):
+		"""
+		Return the figures as plain types.
+
+		:Returns:
+			A dict with 'phases' (each name mapping to the number of 'calls'
+			and the 'total' and 'max' seconds) and 'counters'.
+
+		"""
+		return {
+			'phases': dict ([(k, {'calls': v[0], 'total': v[1], 'max': v[2]})
+				for k, v in self._phases.iteritems()]),
+			'counters': dict (self._counters),
+		}
+
+	def emit (self):
+		"""
+		Pass the current figures to all hooks.
+		"""
+		stats = self.to_dict()
+		for h in self.hooks:
+			h (stats)
+
+	def report (self):
+		"""
+		Return a table of the figures, slowest phases first.
+		"""
+		lines = ['%-24s %8s %10s %10s %10s' % ('phase', 'calls', 'total/s',
+			'mean/ms', 'max/ms')]
+		for name, (calls, total, max_secs) in sorted (self._phases.iteritems(),
+				key=lambda x: -x[1][1]):
+			lines.append ('%-24s %8d %10.3f %10.3f %10.3f' % (name, calls, total,
+				1000.0 * total / calls, 1000.0 * max_secs))
+		if self._counters:
+			lines.append ('')
+			lines.append ('%-24s %8s' % ('counter', 'value'))
+			for name, n in sorted (self._counters.iteritems()):
+				lines.append ('%-24s %8d' % (name, n))
+		return '\n'.join (lines)
+
+
+NULL_PROFILER = NullProfiler()
+
+_profiler = NULL_PROFILER
+
+
+def get_profiler():
+	"""
+	Return the profiler currently in use.
+	"""
+	return _profiler
+
+
+def set_profiler (prof):
+	"""
+	Install a profiler, returning the previous one.
+
+	Pass `None` to turn profiling off.
+	"""
+	global _profiler
+	old = _profiler
+	_profiler = prof or NULL_PROFILER
+	return old
+
+
+### END #######################################################################
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Normalizing, validating and comparing ISBNs in bulk.
+
+Identifiers in ebook metadata come in all forms: with or without hyphens and
+spaces, prefixed by "urn:isbn:" or "ISBN", as ISBN-10 or ISBN-13, and often
+with a wrong check digit. Here identifiers are cleaned, checked and converted
+to a canonical ISBN-13, so that books can be compared with each other.
+
+As a library may hold hundreds of thousands of identifiers, the main functions
+work on whole batches at once. If numpy is available, check digits are
+calculated for the entire batch as array operations, otherwise a table-driven
+loop is used.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from operator import mul
+import re
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+### CONSTANTS & DEFINES
+
+ISBN_PREFIX_RE = re.compile (r'^\s*(urn:)?isbn(-?1[03])?:?\s*', re.I)
+
+SEPARATOR_RE = re.compile (u'[\\s\\-\u2010-\u2015]+', re.U)
+
+# without re.U, these only match ASCII digits
+ISBN10_RE = re.compile (r'^\d{9}[\dX]$')
+ISBN13_RE = re.compile (r'^\d{13}$')
+
+ISBN10_WEIGHTS = (10, 9, 8, 7, 6, 5, 4, 3, 2, 1)
+ISBN13_WEIGHTS = (1, 3) * 6 + (1,)
+
+# the prefix for converting ISBN-10s to ISBN-13s, & its part of the checksum
+BOOKLAND_PREFIX = '978'
+BOOKLAND_SUM = sum (map (mul, map (int, BOOKLAND_PREFIX), ISBN13_WEIGHTS[:3]))
+
+ZERO = ord ('0')
+
+# below this, the overhead of building arrays outweighs any gain
+MIN_ARRAY_BATCH = 64
+
+
+### IMPLEMENTATION ###
+
+def clean_isbn (val):
+	"""
+	Strip any prefix and separators from an identifier.
+
+	The result is uppercased (for a final 'X') but not otherwise checked.
+	"""
+	val = ISBN_PREFIX_RE.sub ('', val)
+	return SEPARATOR_RE.sub ('', val).upper()
+
+
+def normalize_isbns (vals):
+	"""
+	Clean a batch of identifiers.
+	"""
+	prefix_sub = ISBN_PREFIX_RE.sub
+	sep_sub = SEPARATOR_RE.sub
+	return [sep_sub ('', prefix_sub ('', v)).upper() for v in vals]
+
+
+def _isbn13_sum (val):
+	# the weighted sum of the digits of an ISBN-13 (or its first 12 digits),
+	# summing the character codes in C & then taking off those of '0'
+	return sum (bytearray (val[::2])) + 3 * sum (bytearray (val[1::2])) - \
+		ZERO * (len (val) + 2 * (len (val) // 2))
+
+
+def _isbn10_sum (val):
+	# the weighted sum of the digits of an ISBN-10 (or its first 9 digits),
+	# where 'X' is swapped for ':' (the character after '9') to be worth 10
+	chars = bytearray (val.replace ('X', ':'))
+	return sum (map (mul, chars, ISBN10_WEIGHTS[:len (chars)])) - \
+		ZERO * sum (ISBN10_WEIGHTS[:len (chars)])
+
+
+def isbn10_check_digit (val):
+	"""
+	Return the check character for the first nine digits of an ISBN-10.
+	"""
+	check = (11 - _isbn10_sum (str (val[:9])) % 11) % 11
+	return check == 10 and 'X' or str (check)
+
+
+def isbn13_check_digit (val):
+	"""
+	Return the check digit for the first twelve digits of an ISBN-13.
+	"""
+	return str ((10 - _isbn13_sum (str (val[:12])) % 10) % 10)
+
+
+def _to_isbn13 (val):
+	# the canonical form of a cleaned identifier, or None
+	if ISBN13_RE.match (val):
+		val = str (val)
+		if _isbn13_sum (val) % 10 == 0:
+			return val
+	elif ISBN10_RE.match (val):
+		val = str (val)
+		if _isbn10_sum (val) % 11 == 0:
+			stem = BOOKLAND_PREFIX + val[:9]
+			return stem + isbn13_check_digit (stem)
+	return None
+
+
+def isbn10_to_13 (val):
+	"""
+	Convert a valid ISBN-10 to an ISBN-13.
+
+	:Returns:
+		The ISBN-13, or `None` if the original is not a valid ISBN-10.
+
+	"""
+	val = clean_isbn (val)
+	if len (val) != 10:
+		return None
+	return _to_isbn13 (val)
+
+
+def to_isbn13 (val):
+	"""
+	Return the canonical ISBN-13 for an identifier, or `None` if not a valid ISBN.
+	"""
+	return _to_isbn13 (clean_isbn (val))
+
+
+def is_valid_isbn (val):
+	"""
+	Is this identifier a valid ISBN-10 or ISBN-13?
+	"""
+	return _to_isbn13 (clean_isbn (val)) is not None
+
+
+def _as_digit_array (vals, width):
+	# pack same-length strings into a 2D array of character values, where
+	# anything that is not a digit ends up above 9
+	packed = ''.join ([v.encode ('ascii', 'replace') if isinstance (v, unicode)
+		else v for v in vals])
+	chars = numpy.frombuffer (packed, dtype=numpy.uint8).reshape (-1, width)
+	return chars.astype (numpy.int32) - ZERO
+
+
+def _array_isbn13s (vals):
+	# valid flags for a batch of 13-character strings
+	digits = _as_digit_array (vals, 13)
+	ok = (digits <= 9).all (axis=1) & (digits >= 0).all (axis=1)
+	ok &= digits.dot (numpy.array (ISBN13_WEIGHTS)) % 10 == 0
+	return ok
+
+
+def _array_isbn10s (vals):
+	# ISBN-13s (or None) for a batch of 10-character strings
+	digits = _as_digit_array (vals, 10)
+	# a final 'X' stands for 10
+	last = digits[:, 9]
+	last[last == ord ('X') - ZERO] = 10
+	ok = ((digits[:, :9] >= 0) & (digits[:, :9] <= 9)).all (axis=1) & \
+		(last >= 0) & (last <= 10)
+	ok &= digits.dot (numpy.array (ISBN10_WEIGHTS)) % 11 == 0
+	# the check digit of the ISBN-13, over "978" and the first nine digits
+	stem_sum = digits[:, :9].dot (numpy.array (ISBN13_WEIGHTS[3:12])) + \
+		BOOKLAND_SUM
+	checks = (10 - stem_sum % 10) % 10
+	return [ok_flag and '%s%s%d' % (BOOKLAND_PREFIX, v[:9], c) or None
+		for v, ok_flag, c in zip (vals, ok.tolist(), checks.tolist())]
+
+
+def canonical_isbns (vals, use_arrays=None):
+	"""
+	Convert a batch of identifiers to canonical ISBN-13s.
+
+	:Parameters:
+		vals
+			A sequence of identifier strings, in any form.
+		use_arrays
+			Whether to use numpy for the check digits. By default, it is used
+			if it is available and the batch is large enough to benefit.
+
+	:Returns:
+		A list, in the same order as `vals`, of ISBN-13s (with an ISBN-10 being
+		converted) or `None` for anything that is not a valid ISBN.
+
+	"""
+	cleaned = normalize_isbns (vals)
+	if use_arrays is None:
+		use_arrays = numpy is not None and MIN_ARRAY_BATCH <= len (cleaned)
+	if not use_arrays:
+		return [_to_isbn13 (v) for v in cleaned]
+
+	results = [None] * len (cleaned)
+	posns13 = [i for i, v in enumerate (cleaned) if len (v) == 13]
+	posns10 = [i for i, v in enumerate (cleaned) if len (v) == 10]
+	if posns13:
+		ok = _array_isbn13s ([cleaned[i] for i in posns13])
+		for i, ok_flag in zip (posns13, ok.tolist()):
+			if ok_flag:
+				results[i] = str (cleaned[i])
+	if posns10:
+		for i, isbn in zip (posns10,
+				_array_isbn10s ([cleaned[i] for i in posns10])):
+			results[i] = isbn
+	return results
+
+
+def find_duplicates (books):
+	"""
+	Find books that share an ISBN.
+
+	:Parameters:
+		books
+			An iterable of (path, `MetadataDict`) pairs.
+
+	:Returns:
+		A list of (ISBN-13, list of paths) pairs, for every ISBN found in more
+		than one book, sorted by ISBN.
+
+	All the identifiers of all the books are canonicalised as a single batch,
+	then gathered into a hash index of ISBN to paths. ISBN-10 and ISBN-13
+	forms of the same number are treated as identical.
+	"""
+	owners = []
+	ids = []
+	for path, md in books:
+		for x in md.identifiers():
+			owners.append (path)
+			ids.append (x.value)
+	by_isbn = {}
+	for path, isbn in zip (owners, canonical_isbns (ids)):
+		if isbn is not None:
+			paths = by_isbn.setdefault (isbn, [])
+			# a book may give the same ISBN in several forms
+			if path not in paths:
+				paths.append (path)
+	return sorted ([(k, v) for k, v in by_isbn.iteritems() if 1 < len (v)])
+
+
+### END #######################################################################
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Simple containers for Dublin Core metadata as extracted from ebooks.
+
+Readers return metadata as a `MetadataDict`, which maps Dublin Core element
+names (e.g. 'creator', 'title') onto a list of `MetaValue` objects, each of
+which holds the text of an element and its (cleaned) attributes. There are a
+few accessors for commonly used but awkward to find information, like authors
+and ISBNs.
+
+For shipping records between processes or storing them, they can be reduced to
+a "compact" form of plain dicts, lists and tuples.
+
+As a library may hold millions of these values, they are kept small: values
+have no instance dictionary, and attribute dictionaries are read-only and
+shared between all values with the same attributes (which is most of them, as
+attributes like `role` and `scheme` only take a few values).
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+### CONSTANTS & DEFINES
+
+# the most distinct attribute dicts to share, to bound the memory used
+MAX_INTERNED_ATTRIBS = 50000
+
+
+### IMPLEMENTATION ###
+
+class FrozenAttribs (dict):
+	"""
+	A read-only dictionary of attributes, so it can be safely shared.
+	"""
+	__slots__ = ()
+
+	def _readonly (self, *args, **kwargs):
+		raise TypeError ("metadata attributes are read-only")
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = \
+		_readonly
+
+	def __reduce__ (self):
+		return (intern_attribs, (dict (self),))
+
+
+EMPTY_ATTRIBS = FrozenAttribs()
+
+_interned_attribs = {}
+
+
+def intern_key (k):
+	"""
+	Return a shared copy of a field name or attribute key.
+	"""
+	try:
+		return intern (str (k))
+	except UnicodeEncodeError:
+		return k
+
+
+def intern_attribs (attribs):
+	"""
+	Return a shared, read-only copy of an attribute dictionary.
+	"""
+	if not attribs:
+		return EMPTY_ATTRIBS
+	if isinstance (attribs, FrozenAttribs):
+		return attribs
+	key = tuple (sorted (attribs.iteritems()))
+	shared = _interned_attribs.get (key)
+	if shared is None:
+		shared = dict.__new__ (FrozenAttribs)
+		for k, v in key:
+			dict.__setitem__ (shared, intern_key (k), v)
+		if len (_interned_attribs) < MAX_INTERNED_ATTRIBS:
+			_interned_attribs[key] = shared
+	return shared
+
+
+class MetaValue (object):
+	"""
+	A single metadata value and any attributes it was qualified by.
+	"""
+	__slots__ = ('value', 'attribs')
+
+	def __init__ (self, value, attribs=None):
+		self.value = value
+		self.attribs = intern_attribs (attribs)
+
+	def __reduce__ (self):
+		return (MetaValue, (self.value, self.attribs))
+
+	def __eq__ (self, other):
+		return isinstance (other, MetaValue) and \
+			(self.value, self.attribs) == (other.value, other.attribs)
+
+	def __ne__ (self, other):
+		return not (self == other)
+
+	def __unicode__ (self):
+		return self.value
+
+	def __str__ (self):
+		return unicode(self.value).encode ('utf8')
+
+	def __repr__ (self):
+		return "MetaValue(%r, %r)" % (self.value, self.attribs)
+
+
+class MetadataDict (dict):
+	"""
+	A dictionary of Dublin Core element names to lists of values.
+	"""
+	__slots__ = ()
+
+	def _values_with_attrib (self, field, attrib, vals):
+		return [x for x in self.get (field, []) if
+			x.attribs.get (attrib, '').lower() in vals]
+
+	def creators (self):
+		return self.get ('creator', [])
+
+	def authors (self):
+		"""
+		Return those creators explicitly marked as authors.
+		"""
+		return self._values_with_attrib ('creator', 'role', ['aut'])
+
+	def identifiers (self):
+		return self.get ('identifier', [])
+
+	def isbn (self):
+		"""
+		Return those identifiers explicitly marked as ISBNs.
+		"""
+		return self._values_with_attrib ('identifier', 'scheme', ['isbn'])
+
+	def publication_date (self):
+		"""
+		Return those dates explicitly marked as being of publication.
+		"""
+		return self._values_with_attrib ('date', 'event', ['publication'])
+
+	def to_compact (self):
+		"""
+		Reduce the metadata to plain builtin types.
+
+		:Returns:
+			A dict of field names to lists of (value, attribute dict) tuples.
+
+		This is cheap to pickle, store or send between processes.
+
+		"""
+		return dict ([(k, [(x.value, dict (x.attribs)) for x in v]) for k, v in
+			self.iteritems()])
+
+	@classmethod
+	def from_compact (cls, compact):
+		"""
+		Rebuild metadata from the output of `to_compact`.
+		"""
+		return cls ([(intern_key (k), [MetaValue (val, att) for val, att in v])
+			for k, v in compact.iteritems()])
+
+
+### END #######################################################################
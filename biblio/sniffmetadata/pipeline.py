@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Unpacking archives of ebooks and reading their metadata in a single pass.
+
+Archives are unpacked (see `unpack`) in a background thread, each into a
+directory of its own. As soon as an archive is done, the ebooks found in its
+directory are queued to be read (see `batch`), so reading starts with the first
+archive rather than after the last.
+
+The queue between the two stages is bounded. If reading falls behind, no more
+archives are started until it catches up, so the amount of unread, unpacked
+material on disk (and the delay before any book is read) stays flat however
+large the drop.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple, deque
+import os
+import Queue
+import sys
+import threading
+
+from biblio.sniffmetadata.batch import scan_paths
+from biblio.sniffmetadata.index import walk_library
+from biblio.sniffmetadata.unpack import STATUS_OK
+
+
+### CONSTANTS & DEFINES
+
+# how many unpacked books may be waiting to be read
+DEFAULT_QUEUE_SIZE = 64
+
+
+### IMPLEMENTATION ###
+
+class ArchiveResult (namedtuple ('ArchiveResult', ['unpacked', 'dest_dir',
+		'books'])):
+	"""
+	The outcome of unpacking an archive in the pipeline.
+
+	:Parameters:
+		unpacked
+			The `UnpackResult` of the archive.
+		dest_dir
+			Where it was unpacked.
+		books
+			The paths of the ebooks found there, which will be read next.
+
+	"""
+	__slots__ = ()
+
+
+class BookResult (namedtuple ('BookResult', ['archive', 'scan'])):
+	"""
+	The outcome of reading a book unpacked in the pipeline.
+
+	:Parameters:
+		archive
+			The path of the archive the book came from.
+		scan
+			The `ScanResult` of reading the book.
+
+	"""
+	__slots__ = ()
+
+
+# queue messages
+_ARCHIVE, _BOOK, _FAILED, _DONE = range (4)
+
+
+def dest_dir_for (archive, dest_root):
+	"""
+	Return a new directory for unpacking an archive in.
+
+	This is named for the archive, with a number added if need be to avoid
+	reusing an existing directory.
+	"""
+	base = os.path.join (dest_root,
+		os.path.splitext (os.path.basename (archive))[0] or 'archive')
+	dest = base
+	i = 1
+	while os.path.exists (dest):
+		dest = '%s-%s' % (base, i)
+		i += 1
+	os.makedirs (dest)
+	return dest
+
+
+class UnpackSniffPipeline (object):
+	"""
+	Unpacks archives & reads the ebooks within, as a stream.
+	"""
+	def __init__ (self, scheduler, dest_root, jobs=1, cache=None,
+			queue_size=DEFAULT_QUEUE_SIZE):
+		"""
+		C'tor.
+
+		:Parameters:
+			scheduler
+				An `UnpackScheduler` for the archives.
+			dest_root
+				Under which the archives are unpacked.
+			jobs
+				The number of processes to read books in.
+			cache
+				An optional `MetadataCache`, as per `scan_paths`.
+			queue_size
+				The most unpacked books that may be waiting to be read.
+
+		"""
+		self.scheduler = scheduler
+		self.dest_root = dest_root
+		self.jobs = jobs
+		self.cache = cache
+		self.queue_size = queue_size
+
+	def _unpack_all (self, archives, queue, stop):
+		# the unpacking stage, run in a background thread
+		try:
+			dest_dirs = {}
+			def dest_for (archive):
+				dest_dirs[archive] = dest_dir_for (archive, self.dest_root)
+				return dest_dirs[archive]
+			results = self.scheduler.run (archives, dest_for=dest_for)
+			try:
+				for res in results:
+					dest = dest_dirs.pop (res.path)
+					books = []
+					if res.status == STATUS_OK:
+						books = [p for p, st in walk_library ([dest])]
+					queue.put ((_ARCHIVE, ArchiveResult (res, dest, books)))
+					for p in books:
+						queue.put ((_BOOK, (res.path, p)))
+					if stop.is_set():
+						return
+			finally:
+				results.close()
+		except:
+			queue.put ((_FAILED, sys.exc_info()))
+		else:
+			queue.put ((_DONE, None))
+
+	def run (self, archives):
+		"""
+		Unpack a series of archives and read the books in them.
+
+		:Parameters:
+			archives
+				An iterable of archive paths.
+
+		:Returns:
+			An iterator of `ArchiveResult` and `BookResult`. Each archive comes
+			before the books in it, and books are in the order their archives
+			finished.
+
+		"""
+		queue = Queue.Queue (self.queue_size)
+		stop = threading.Event()
+		# archives are passed on once the reading stage asks for their books
+		events = deque()
+		sources = deque()
+
+		worker = threading.Thread (target=self._unpack_all,
+			args=(archives, queue, stop))
+		worker.daemon = True
+
+		def unpacked_books():
+			# only start unpacking once asked for the first book, which is after
+			# any reading processes have been forked: forking while the thread
+			# holds a lock could leave them deadlocked
+			worker.start()
+			while True:
+				kind, payload = queue.get()
+				if kind == _ARCHIVE:
+					events.append (payload)
+				elif kind == _BOOK:
+					archive, p = payload
+					sources.append (archive)
+					yield p
+				elif kind == _FAILED:
+					raise payload[0], payload[1], payload[2]
+				else:
+					return
+
+		try:
+			# books are handed out one at a time, so none wait on a part-filled
+			# chunk
+			for scan in scan_paths (unpacked_books(), jobs=self.jobs,
+					chunksize=1, cache=self.cache):
+				while events:
+					yield events.popleft()
+				yield BookResult (sources.popleft(), scan)
+			while events:
+				yield events.popleft()
+		finally:
+			# unblock & wind up the unpacking if we are stopped early
+			stop.set()
+			while worker.is_alive():
+				try:
+					queue.get (timeout=0.1)
+				except Queue.Empty:
+					pass
+
+
+### END #######################################################################
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Reading metadata from ebooks on slow (e.g. network) storage.
+
+On network filesystems, opening a file and seeking to its end (where both the
+zip central directory of an epub and the trailer of a PDF live) takes far
+longer than parsing the metadata. Reading books one after another therefore
+leaves the CPU idle most of the time.
+
+Here, the tail of each upcoming book is read in background threads while
+earlier books are parsed, so that by the time a book is opened its directory
+or trailer is already in the OS cache. The number of books being prefetched at
+any time is bounded. Results are produced by a generator, in input order, and
+so can be consumed incrementally by other code.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import deque
+import os
+
+from biblio.sniffmetadata.batch import sniff_path
+
+
+### CONSTANTS & DEFINES
+
+# enough to hold the central directory or trailer of most books
+DEFAULT_TAIL_BYTES = 64 * 1024
+
+DEFAULT_INFLIGHT = 8
+
+
+### IMPLEMENTATION ###
+
+def prefetch_tail (path, nbytes=DEFAULT_TAIL_BYTES):
+	"""
+	Read the end of a file, so it is cached for later reading.
+
+	:Returns:
+		The number of bytes read, or `None` if the file could not be read.
+
+	Errors are swallowed, as they will be reported when the file is read
+	properly.
+	"""
+	try:
+		hndl = open (path, 'rb')
+		try:
+			size = os.fstat (hndl.fileno()).st_size
+			hndl.seek (max (0, size - nbytes))
+			return len (hndl.read (nbytes))
+		finally:
+			hndl.close()
+	except EnvironmentError:
+		return None
+
+
+def iter_scan (paths, inflight=DEFAULT_INFLIGHT, tail_bytes=DEFAULT_TAIL_BYTES):
+	"""
+	Read the metadata from many ebooks, overlapping I/O with parsing.
+
+	:Parameters:
+		paths
+			An iterable of ebook paths. This is consumed lazily.
+		inflight
+			The most books to prefetch at once, which is also the number of
+			I/O threads used.
+		tail_bytes
+			How much of the end of each book to prefetch.
+
+	:Returns:
+		An iterator of `ScanResult`, in the same order as `paths`.
+
+	"""
+	from multiprocessing.pool import ThreadPool
+	pool = ThreadPool (inflight)
+	try:
+		pending = deque()
+		for p in paths:
+			pending.append ((p, pool.apply_async (prefetch_tail, (p, tail_bytes))))
+			if inflight <= len (pending):
+				head, job = pending.popleft()
+				job.wait()
+				yield sniff_path (head)
+		while pending:
+			head, job = pending.popleft()
+			job.wait()
+			yield sniff_path (head)
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+
+### END #######################################################################
@@ -1,77 +1,124 @@
-#!/usr/bin/env python
-# -*- coding: utf8 -*-
-"""
-An abstract base class for ebook metadata readers.
-
-This exists soley to ensure some conformity in the interface of readers, and
-provides two functions:
-
-* read: read the metadata structure(s) within the document. Different documents
-  may return different structures.
-  
-* munge: read the metadata and convert it to a universal form. This should call
-  read and may mangle or transform the data based on heuristics.
-
-"""
-
-__author__ = "Paul-Michael Agapow (pma@agapow.net)"
-
-
-### IMPORTS
-
-### CONSTANTS & DEFINES
-
-### IMPLEMENTATION ###
-
-class BaseMetadataReader (object):
-	
-	# override in subclass
-	handled_exts = []
-	
-	def __init__ (self, path_or_hndl):
-		self._file = self._open_file (path_or_hndl)
-		
-	def __del__ (self):
-		"""
-		D'tor, which cleans up including closing ebook file, if necessary.
-		"""
-		self._close_file()
-		
-	def _open_file (self, path_or_hndl):
-		"""
-		Open and prep ebook file, if necessary.
-		"""
-		if has_attr (path_or_hndl, 'read'):
-			self._opened_file = False
-			return path_or_hndl
-		else:
-			self._opened_file = True
-			return open (path_or_hndl, 'rb')
-			
-		
-	def _close_file (self):
-		"""
-		Close the ebook file, if necessary.
-		"""
-		if self._opened_file:
-			self._file.close()
-		
-	def read_metadata (self):
-		"""
-		Search for and return metadata within the ebook.
-		
-		:Returns:
-			Format dependant metadata.
-			
-		"""
-		pass
-	
-	def read_metadata_as_dublincore (self):
-		return self.munge_metadata_to_dublincore (self.read_metadata())
-		
-	def munge_metadata_to_dublincore (self, raw_metadata):
-		pass
-	
-	
-	
-### END #######################################################################
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+An abstract base class for ebook metadata readers.
+
+This exists soley to ensure some conformity in the interface of readers, and
+provides two functions:
+
+* read: read the metadata structure(s) within the document. Different documents
+  may return different structures.
+  
+* munge: read the metadata and convert it to a universal form. This should call
+  read and may mangle or transform the data based on heuristics.
+
+Readers are created from a path, an open file, or the contents of an ebook
+already in memory (see `buffers`). Any file a reader opens is held until it is
+closed, which is best done by using the reader as a context manager::
+
+	with EpubMetaReader (path) as rdr:
+		md = rdr.read_metadata_as_dublincore()
+
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from biblio.sniffmetadata.instrument import get_profiler
+
+from buffers import is_buffer, BufferFile
+
+
+### CONSTANTS & DEFINES
+
+### IMPLEMENTATION ###
+
+class BaseMetadataReader (object):
+	
+	# override in subclass
+	handled_exts = []
+	# the prefix for the phases & counters reported to the profiler
+	profile_name = 'book'
+	
+	def __init__ (self, path_or_hndl):
+		# set first, so a failure to open can be cleaned up after
+		self._file = None
+		self._opened_file = False
+		self.closed = False
+		self.profiler = get_profiler()
+		try:
+			with self.profiler.phase (self.profile_name + '.open'):
+				self._file = self._open_file (path_or_hndl)
+		except:
+			self.close()
+			raise
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	def close (self):
+		"""
+		Close the ebook file, if necessary. This may be called more than once.
+		"""
+		if not self.closed:
+			self.closed = True
+			self._close_file()
+
+	def __del__ (self):
+		"""
+		D'tor, a last resort for closing the ebook file if `close` was not called.
+		"""
+		try:
+			self.close()
+		except Exception:
+			pass
+		
+	def _open_file (self, path_or_hndl):
+		"""
+		Open and prep ebook file, if necessary.
+		"""
+		if is_buffer (path_or_hndl):
+			self._opened_file = False
+			return BufferFile (path_or_hndl)
+		elif hasattr (path_or_hndl, 'read'):
+			self._opened_file = False
+			return path_or_hndl
+		else:
+			self._opened_file = True
+			return open (path_or_hndl, 'rb')
+			
+		
+	def _close_file (self):
+		"""
+		Close the ebook file, if necessary.
+		"""
+		if self._opened_file and (self._file is not None):
+			self._file.close()
+		
+	def read_metadata (self):
+		"""
+		Search for and return metadata within the ebook.
+		
+		:Returns:
+			Format dependant metadata.
+			
+		"""
+		pass
+	
+	def read_metadata_as_dublincore (self):
+		with self.profiler.phase (self.profile_name + '.read'):
+			raw = self.read_metadata()
+		with self.profiler.phase (self.profile_name + '.munge'):
+			return self.munge_metadata_to_dublincore (raw)
+		
+	def munge_metadata_to_dublincore (self, raw_metadata):
+		pass
+	
+	
+	
+### END #######################################################################
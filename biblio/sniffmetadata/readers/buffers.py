@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Reading ebooks held in memory, rather than files on disk.
+
+Readers may be given the contents of an ebook as a string (bytes), bytearray,
+buffer, memoryview or mmap. These are read in place through a `BufferFile`,
+which behaves like an open file but only copies the bytes asked for, so an
+ebook that is already in memory need not be written out or duplicated.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import mmap
+import os
+
+
+### CONSTANTS & DEFINES
+
+# the starts of ebook files, by which contents are told from paths
+DATA_MAGICS = ('PK\x03\x04', '%PDF')
+
+# how far into a string to look for a NUL, which no path contains
+NUL_SEARCH_SIZE = 512
+
+
+### IMPLEMENTATION ###
+
+def is_buffer (obj):
+	"""
+	Is this the contents of an ebook, rather than a path or open file?
+
+	A plain string is taken to be a path, unless it starts with the signature
+	of an ebook format or contains a NUL byte.
+	"""
+	if isinstance (obj, (bytearray, buffer, memoryview, mmap.mmap)):
+		return True
+	if isinstance (obj, str):
+		return obj.startswith (DATA_MAGICS) or ('\0' in obj[:NUL_SEARCH_SIZE])
+	return False
+
+
+def as_buffer (obj):
+	"""
+	Return ebook contents in a form that can be sliced & searched as a string.
+
+	Strings, buffers and mmaps are returned as is and bytearrays are wrapped
+	without copying. As the regular expressions of Python 2 cannot search a
+	memoryview, those are copied.
+	"""
+	if isinstance (obj, bytearray):
+		return buffer (obj)
+	if isinstance (obj, memoryview):
+		return obj.tobytes()
+	return obj
+
+
+class BufferFile (object):
+	"""
+	A read-only file over ebook contents held in memory.
+	"""
+	def __init__ (self, buf):
+		"""
+		C'tor.
+
+		:Parameters:
+			buf
+				The contents, as anything accepted by `is_buffer`. This is not
+				copied, and is left open when the file is closed.
+
+		"""
+		if isinstance (buf, bytearray):
+			buf = buffer (buf)
+		self._buf = buf
+		self._size = len (buf)
+		self._pos = 0
+		self.closed = False
+
+	def read (self, size=-1):
+		start = self._pos
+		if (size is None) or (size < 0):
+			end = self._size
+		else:
+			end = min (self._size, start + size)
+		if end <= start:
+			return ''
+		self._pos = end
+		chunk = self._buf[start:end]
+		if isinstance (chunk, memoryview):
+			return chunk.tobytes()
+		return chunk
+
+	def seek (self, offset, whence=os.SEEK_SET):
+		if whence == os.SEEK_CUR:
+			offset += self._pos
+		elif whence == os.SEEK_END:
+			offset += self._size
+		if offset < 0:
+			raise IOError ("negative seek position %s" % offset)
+		self._pos = offset
+
+	def tell (self):
+		return self._pos
+
+	def close (self):
+		self._buf = None
+		self.closed = True
+
+
+### END #######################################################################
@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+A lightweight reader for the document information of PDF files.
+
+pyPdf parses the whole cross-reference structure of a document on opening it,
+which is slow and memory-hungry for large (e.g. scanned) files when all we want
+is the metadata. This instead memory-maps the file, reads the trailer from the
+end of it and follows references only as far as the `/Info` dictionary. The XMP
+metadata stream is only located and decoded if asked for.
+
+Classic cross-reference tables, cross-reference streams and compressed object
+streams are understood. Anything else that cannot be handled (e.g. encryption
+or exotic stream filters) raises `PdfInfoError`, so that the caller can fall
+back to a full parser.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple
+import mmap
+import re
+import struct
+import zlib
+
+
+### CONSTANTS & DEFINES
+
+# how far from the end of the file to look for 'startxref'
+TAIL_SIZE = 2048
+
+WHITESPACE = '\x00\t\n\x0c\r '
+
+NAME_RE = re.compile (r'/([^\s()<>\[\]{}/%]*)')
+NUMBER_RE = re.compile (r'[+-]?(?:\d+\.?\d*|\.\d+)')
+REF_RE = re.compile (r'(\d+)\s+(\d+)\s+R(?![^\s()<>\[\]{}/%])')
+KEYWORD_RE = re.compile (r'[^\s()<>\[\]{}/%]+')
+OBJ_HEADER_RE = re.compile (r'(\d+)\s+(\d+)\s+obj')
+SUBSECTION_RE = re.compile (r'(\d+)\s+(\d+)')
+STARTXREF_RE = re.compile (r'startxref\s+(\d+)')
+NAME_ESCAPE_RE = re.compile (r'#([0-9A-Fa-f]{2})')
+HEX_STRING_END_RE = re.compile (r'>')
+
+KEYWORDS = {
+	'true': True,
+	'false': False,
+	'null': None,
+}
+
+STRING_ESCAPES = {
+	'n': '\n',
+	'r': '\r',
+	't': '\t',
+	'b': '\b',
+	'f': '\f',
+	'(': '(',
+	')': ')',
+	'\\': '\\',
+}
+
+# what parsing a malformed document can otherwise raise
+PARSE_ERRORS = (ValueError, KeyError, IndexError, TypeError, struct.error,
+	zlib.error)
+
+# the kinds of cross-reference entry
+XREF_FREE = 0
+XREF_OFFSET = 1
+XREF_COMPRESSED = 2
+
+
+### IMPLEMENTATION ###
+
+class PdfInfoError (Exception):
+	"""
+	The document could not be understood by this reader.
+	"""
+	pass
+
+
+class PdfName (str):
+	pass
+
+
+PdfRef = namedtuple ('PdfRef', ['num', 'gen'])
+
+
+class PdfStream (dict):
+	"""
+	A stream dictionary, along with where its data starts in the file.
+	"""
+	def __init__ (self, d, data_start):
+		dict.__init__ (self, d)
+		self.data_start = data_start
+
+
+def decode_text (s):
+	"""
+	Convert a PDF text string to unicode.
+
+	Strings are either UTF-16 (with a byte order mark) or PDFDocEncoding, which
+	we approximate with Latin-1.
+	"""
+	if s.startswith ('\xfe\xff'):
+		return s[2:].decode ('utf-16-be', 'replace')
+	return s.decode ('latin-1')
+
+
+def skip_whitespace (data, pos):
+	"""
+	Return the position of the next token, skipping whitespace and comments.
+	"""
+	size = len (data)
+	while pos < size:
+		c = data[pos]
+		if c in WHITESPACE:
+			pos += 1
+		elif c == '%':
+			while (pos < size) and (data[pos] not in '\r\n'):
+				pos += 1
+		else:
+			break
+	return pos
+
+
+def _parse_literal_string (data, pos):
+	# pos is just after the opening bracket
+	buf = []
+	depth = 1
+	while True:
+		c = data[pos]
+		pos += 1
+		if c == '\\':
+			c = data[pos]
+			pos += 1
+			if c in STRING_ESCAPES:
+				buf.append (STRING_ESCAPES[c])
+			elif c in '01234567':
+				digits = c
+				while (len (digits) < 3) and (data[pos] in '01234567'):
+					digits += data[pos]
+					pos += 1
+				buf.append (chr (int (digits, 8) & 0xFF))
+			elif c == '\r':
+				# line continuation
+				if data[pos] == '\n':
+					pos += 1
+			elif c != '\n':
+				buf.append (c)
+		elif c == '(':
+			depth += 1
+			buf.append (c)
+		elif c == ')':
+			depth -= 1
+			if depth == 0:
+				return ''.join (buf), pos
+			buf.append (c)
+		else:
+			buf.append (c)
+
+
+def parse_object (data, pos):
+	"""
+	Parse a single (direct) PDF object.
+
+	:Parameters:
+		data
+			A string, buffer or mmap holding the PDF.
+		pos
+			Where to start parsing.
+
+	:Returns:
+		The parsed object and the position just after it. Dictionaries become
+		dicts, arrays lists, names `PdfName`, references `PdfRef` and strings
+		are left undecoded.
+
+	"""
+	try:
+		pos = skip_whitespace (data, pos)
+		c = data[pos]
+		if c == '/':
+			m = NAME_RE.match (data, pos)
+			name = NAME_ESCAPE_RE.sub (lambda x: chr (int (x.group(1), 16)),
+				m.group(1))
+			return PdfName ('/' + name), m.end()
+		elif c == '<':
+			if data[pos+1] == '<':
+				d = {}
+				pos += 2
+				while True:
+					pos = skip_whitespace (data, pos)
+					if data[pos:pos+2] == '>>':
+						return d, pos + 2
+					key, pos = parse_object (data, pos)
+					val, pos = parse_object (data, pos)
+					d[key] = val
+			else:
+				# a search, as buffers have no find method
+				m = HEX_STRING_END_RE.search (data, pos)
+				if not m:
+					raise PdfInfoError ("unterminated hex string")
+				end = m.start()
+				hex_str = ''.join (data[pos+1:end].split())
+				if len (hex_str) % 2:
+					hex_str += '0'
+				return hex_str.decode ('hex'), end + 1
+		elif c == '[':
+			arr = []
+			pos += 1
+			while True:
+				pos = skip_whitespace (data, pos)
+				if data[pos] == ']':
+					return arr, pos + 1
+				val, pos = parse_object (data, pos)
+				arr.append (val)
+		elif c == '(':
+			return _parse_literal_string (data, pos + 1)
+		elif c in '+-.0123456789':
+			m = REF_RE.match (data, pos)
+			if m:
+				return PdfRef (int (m.group(1)), int (m.group(2))), m.end()
+			m = NUMBER_RE.match (data, pos)
+			num = m.group(0)
+			if '.' in num:
+				return float (num), m.end()
+			return int (num), m.end()
+		else:
+			m = KEYWORD_RE.match (data, pos)
+			if m and (m.group(0) in KEYWORDS):
+				return KEYWORDS[m.group(0)], m.end()
+	except (IndexError, ValueError, AttributeError, TypeError), err:
+		raise PdfInfoError ("malformed object at %s: %s" % (pos, err))
+	raise PdfInfoError ("unexpected token at %s" % pos)
+
+
+def _unpredict (data, parms):
+	# undo PNG predictors, as used by xref streams
+	predictor = parms.get ('/Predictor', 1)
+	if predictor == 1:
+		return data
+	if predictor < 10:
+		raise PdfInfoError ("unsupported predictor %s" % predictor)
+	columns = parms.get ('/Columns', 1)
+	rows = []
+	prev = [0] * columns
+	for i in xrange (0, len (data), columns + 1):
+		filter_type = ord (data[i])
+		row = [ord (x) for x in data[i+1:i+1+columns]]
+		if filter_type == 1:
+			for j in xrange (1, len (row)):
+				row[j] = (row[j] + row[j-1]) & 0xFF
+		elif filter_type == 2:
+			row = [(x + y) & 0xFF for x, y in zip (row, prev)]
+		elif filter_type != 0:
+			raise PdfInfoError ("unsupported PNG filter %s" % filter_type)
+		rows.append (''.join ([chr (x) for x in row]))
+		prev = row
+	return ''.join (rows)
+
+
+class LazyPdfInfo (object):
+	"""
+	The document information and XMP metadata of a PDF.
+
+	This mimics the `documentInfo` and `xmpMetadata` attributes of a pyPdf
+	`PdfFileReader`, although the XMP metadata is returned as the raw packet.
+	"""
+	def __init__ (self, src):
+		"""
+		C'tor.
+
+		:Parameters:
+			src
+				An open (binary) file handle for the PDF, which is mapped into
+				memory, or the contents of the PDF as a string, buffer or mmap.
+
+		The trailer and document information are read immediately, raising
+		`PdfInfoError` if they cannot be.
+		"""
+		self._mapped = hasattr (src, 'fileno')
+		if self._mapped:
+			try:
+				self._data = mmap.mmap (src.fileno(), 0, access=mmap.ACCESS_READ)
+			except (ValueError, EnvironmentError), err:
+				raise PdfInfoError ("cannot map file: %s" % err)
+		elif hasattr (src, 'read'):
+			raise PdfInfoError ("cannot map a file without a descriptor")
+		else:
+			self._data = src
+		self._xref = {}
+		self._objstms = {}
+		self._xmp = None
+		self._xmp_read = False
+		try:
+			self.trailer = self._read_trailer()
+			if '/Encrypt' in self.trailer:
+				raise PdfInfoError ("encrypted documents are not supported")
+			self.documentInfo = self._read_info()
+		except PARSE_ERRORS, err:
+			self.close()
+			raise PdfInfoError ("malformed document: %s" % err)
+		except:
+			self.close()
+			raise
+
+	def close (self):
+		# contents that were passed in belong to the caller
+		if self._mapped and (self._data is not None):
+			self._data.close()
+		self._data = None
+
+	def _read_trailer (self):
+		data = self._data
+		size = len (data)
+		tail_start = max (0, size - TAIL_SIZE)
+		tail = data[tail_start:]
+		idx = tail.rfind ('startxref')
+		if idx < 0:
+			raise PdfInfoError ("no startxref found")
+		m = STARTXREF_RE.match (tail, idx)
+		if not m:
+			raise PdfInfoError ("malformed startxref")
+		trailer = {}
+		pos = int (m.group(1))
+		seen = set()
+		# newer sections come first, so never override what they set
+		while (pos is not None) and (pos not in seen):
+			seen.add (pos)
+			entries, section_trailer = self._read_xref_section (pos)
+			for k, v in entries:
+				self._xref.setdefault (k, v)
+			hybrid = section_trailer.get ('/XRefStm')
+			if isinstance (hybrid, int):
+				for k, v in self._read_xref_section (hybrid)[0]:
+					self._xref.setdefault (k, v)
+			for k, v in section_trailer.iteritems():
+				trailer.setdefault (k, v)
+			pos = section_trailer.get ('/Prev')
+		return trailer
+
+	def _read_xref_section (self, pos):
+		# return the entries & trailer of the xref table or stream at pos
+		data = self._data
+		pos = skip_whitespace (data, pos)
+		if data[pos:pos+4] == 'xref':
+			return self._read_xref_table (pos + 4)
+		stm = self._read_indirect (pos)
+		if not (isinstance (stm, PdfStream) and stm.get ('/Type') == '/XRef'):
+			raise PdfInfoError ("no xref table or stream at %s" % pos)
+		return self._read_xref_stream (stm), stm
+
+	def _read_xref_table (self, pos):
+		data = self._data
+		entries = []
+		while True:
+			pos = skip_whitespace (data, pos)
+			if data[pos:pos+7] == 'trailer':
+				trailer, pos = parse_object (data, pos + 7)
+				return entries, trailer
+			m = SUBSECTION_RE.match (data, pos)
+			if not m:
+				raise PdfInfoError ("malformed xref table at %s" % pos)
+			start, count = int (m.group(1)), int (m.group(2))
+			pos = m.end()
+			for i in xrange (count):
+				pos = skip_whitespace (data, pos)
+				line = data[pos:pos+18]
+				pos += 18
+				if line[17:18] == 'n':
+					entries.append ((start + i, (XREF_OFFSET, int (line[:10]), 0)))
+				else:
+					entries.append ((start + i, (XREF_FREE, 0, 0)))
+
+	def _read_xref_stream (self, stm):
+		data = self.stream_data (stm)
+		widths = stm['/W']
+		index = stm.get ('/Index', [0, stm['/Size']])
+		row_len = sum (widths)
+		entries = []
+		row = 0
+		for first, count in zip (index[0::2], index[1::2]):
+			for num in xrange (first, first + count):
+				fields = []
+				pos = row * row_len
+				for w in widths:
+					val = 0
+					for c in data[pos:pos+w]:
+						val = (val << 8) + ord (c)
+					fields.append (val)
+					pos += w
+				if widths[0] == 0:
+					fields[0] = XREF_OFFSET
+				entries.append ((num, tuple (fields)))
+				row += 1
+		return entries
+
+	def _read_indirect (self, pos):
+		# parse the "n g obj ..." at pos
+		data = self._data
+		m = OBJ_HEADER_RE.match (data, skip_whitespace (data, pos))
+		if not m:
+			raise PdfInfoError ("no object at %s" % pos)
+		obj, pos = parse_object (data, m.end())
+		if isinstance (obj, dict):
+			pos = skip_whitespace (data, pos)
+			if data[pos:pos+6] == 'stream':
+				pos += 6
+				if data[pos:pos+2] == '\r\n':
+					pos += 2
+				elif data[pos] in '\r\n':
+					pos += 1
+				return PdfStream (obj, pos)
+		return obj
+
+	def _scan_for_object (self, ref):
+		# last resort if the xref is wrong: search for the object header
+		header_re = re.compile (r'(?<!\d)%d\s+%d\s+obj' % (ref.num, ref.gen))
+		last = None
+		for m in header_re.finditer (self._data):
+			last = m.start()
+		if last is None:
+			raise PdfInfoError ("cannot find object %s %s" % ref)
+		return self._read_indirect (last)
+
+	def _object_from_stream (self, stm_num, idx):
+		if stm_num not in self._objstms:
+			stm = self.resolve (PdfRef (stm_num, 0))
+			data = self.stream_data (stm)
+			first = self.resolve (stm['/First'])
+			header = data[:first].split()
+			offsets = [first + int (x) for x in header[1::2]]
+			self._objstms[stm_num] = (data, offsets)
+		data, offsets = self._objstms[stm_num]
+		return parse_object (data, offsets[idx])[0]
+
+	def resolve (self, obj):
+		"""
+		Return the object an indirect reference refers to.
+
+		Anything other than a reference is returned as is.
+		"""
+		depth = 0
+		while isinstance (obj, PdfRef):
+			depth += 1
+			if 32 < depth:
+				raise PdfInfoError ("reference loop")
+			kind, a, b = self._xref.get (obj.num, (XREF_FREE, 0, 0))
+			if kind == XREF_OFFSET:
+				try:
+					obj = self._read_indirect (a)
+				except PdfInfoError:
+					obj = self._scan_for_object (obj)
+			elif kind == XREF_COMPRESSED:
+				obj = self._object_from_stream (a, b)
+			else:
+				obj = self._scan_for_object (obj)
+		return obj
+
+	def stream_data (self, stm):
+		"""
+		Return the decoded contents of a stream.
+		"""
+		length = self.resolve (stm.get ('/Length'))
+		if not isinstance (length, int):
+			raise PdfInfoError ("stream has no length")
+		data = self._data[stm.data_start:stm.data_start + length]
+		filters = self.resolve (stm.get ('/Filter', []))
+		parms = self.resolve (stm.get ('/DecodeParms', {}))
+		if not isinstance (filters, list):
+			filters = [filters]
+			parms = [parms]
+		elif not isinstance (parms, list):
+			parms = [parms]
+		for i, f in enumerate (filters):
+			if f not in ('/FlateDecode', '/Fl'):
+				raise PdfInfoError ("unsupported filter %s" % f)
+			try:
+				data = zlib.decompress (data)
+			except zlib.error, err:
+				raise PdfInfoError ("cannot decompress stream: %s" % err)
+			p = (i < len (parms)) and self.resolve (parms[i]) or None
+			if p:
+				data = _unpredict (data, p)
+		return data
+
+	def _read_info (self):
+		info = self.resolve (self.trailer.get ('/Info'))
+		if info is None:
+			return None
+		if not isinstance (info, dict):
+			raise PdfInfoError ("document information is not a dictionary")
+		clean_info = {}
+		for k, v in info.iteritems():
+			v = self.resolve (v)
+			if isinstance (v, str) and not isinstance (v, PdfName):
+				v = decode_text (v)
+			clean_info[k] = v
+		return clean_info
+
+	@property
+	def xmpMetadata (self):
+		"""
+		The raw XMP metadata packet of the document, or `None`.
+
+		This is only read when first asked for.
+		"""
+		if not self._xmp_read:
+			self._xmp_read = True
+			try:
+				root = self.resolve (self.trailer.get ('/Root'))
+				if isinstance (root, dict):
+					stm = self.resolve (root.get ('/Metadata'))
+					if isinstance (stm, PdfStream):
+						self._xmp = self.stream_data (stm)
+			except (PdfInfoError,) + PARSE_ERRORS:
+				# leave it unread rather than fail the whole document
+				pass
+		return self._xmp
+
+
+### END #######################################################################
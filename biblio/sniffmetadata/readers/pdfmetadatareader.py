@@ -1,63 +1,129 @@
-#!/usr/bin/env python
-# -*- coding: utf8 -*-
-"""
-"""
-
-
-### IMPORTS
-
-from datetime import datetime
-
-from biblio.bibrecord.dublin import DublinCoreCollection
-
-from basemetadatareader import BaseMetadataReader
-
-
-### CONSTANTS & DEFINES
-
-# map fields from one schema to other
-DOCINFO_TO_DUBLIN = {
-	'Author': 'authors',
-	'Title': 'titles',
-	'CreationDate': 'date_created',
-	'ModDate': 'date_modified',
-	'Creator': 'creator',
-	'Producer': 'publishers',
-}
-
-
-### IMPLEMENTATION ###
-
-def date_from_string (s):
-	return datetime.strptime(s[:8].replace("-", ""), "%Y%m%d").date()
-	
-
-class PdfMetaReader (BaseMetadataReader):
-	def _open_file (self, path):
-		from pyPdf import PdfFileReader
-		return PdfFileReader(open(path, 'rb'))
-		
-	def _close_file (self):
-		pass
-		
-	def read_metadata (self):
-		return self._file.documentInfo, self._file.xmpMetadata
-	
-	def munge_docinfo_to_dublincore (self, docinfo):
-		clean_dict = {}
-		for k, v in docinfo.iteritems():
-			if k.startswith('/'):
-				k = k[1:]
-			if v.startswith ('D:'):
-				v = date_from_string (v[2:])
-			
-			clean_dict[k] = v
-		return clean_dict
-		
-	def munge_metadata_to_dublincore (self, md):
-		docinfo, xmp = md
-		print self.munge_docinfo_to_dict (docinfo)
-		DublinCoreCollection
-
-
-### END #######################################################################
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+"""
+
+
+### IMPORTS
+
+from biblio.sniffmetadata.dates import parse_pdf_date
+from biblio.sniffmetadata.metadata import MetaValue, MetadataDict
+
+from basemetadatareader import BaseMetadataReader
+from buffers import is_buffer, as_buffer, BufferFile
+from pdfinfo import LazyPdfInfo, PdfInfoError
+from xmp import parse_xmp, merge_metadata, is_newer
+
+
+### CONSTANTS & DEFINES
+
+# map docinfo fields to Dublin Core elements and the attributes to qualify them
+DOCINFO_TO_DC = {
+	'Author': ('creator', {}),
+	'Title': ('title', {}),
+	'Subject': ('description', {}),
+	'CreationDate': ('date', {'event': 'creation'}),
+	'ModDate': ('date', {'event': 'modification'}),
+}
+
+
+### IMPLEMENTATION ###
+
+class PdfMetaReader (BaseMetadataReader):
+	handled_exts = ['pdf']
+	profile_name = 'pdf'
+
+	def _open_file (self, path_or_hndl):
+		"""
+		Open the PDF, reading as little of it as possible.
+
+		The document information is read directly from the trailer, falling
+		back to a full parse with pyPdf for anything that cannot be handled that
+		way. Note that in the former case, the XMP metadata is the raw packet.
+		PDFs in memory are read in place.
+		"""
+		if is_buffer (path_or_hndl):
+			self._hndl = BufferFile (path_or_hndl)
+			src = as_buffer (path_or_hndl)
+		elif hasattr (path_or_hndl, 'read'):
+			self._hndl = src = path_or_hndl
+		else:
+			self._hndl = src = open (path_or_hndl, 'rb')
+		# only close what we opened ourselves
+		self._opened_file = self._hndl is not path_or_hndl
+		try:
+			return LazyPdfInfo (src)
+		except PdfInfoError:
+			from pyPdf import PdfFileReader
+			self.profiler.count ('pdf.fallbacks')
+			self._hndl.seek (0)
+			return PdfFileReader (self._hndl)
+		
+	def _close_file (self):
+		if isinstance (self._file, LazyPdfInfo):
+			self._file.close()
+		hndl = getattr (self, '_hndl', None)
+		if self._opened_file and (hndl is not None):
+			hndl.close()
+		self._hndl = self._file = None
+		
+	def read_metadata (self):
+		return self._file.documentInfo, self.read_xmp_packet()
+
+	def read_xmp_packet (self):
+		"""
+		Return the raw XMP metadata packet of the PDF, or `None`.
+		"""
+		if isinstance (self._file, LazyPdfInfo):
+			return self._file.xmpMetadata
+		# pyPdf would parse the packet into a DOM, so fetch the stream itself
+		try:
+			stm = self._file.trailer['/Root'].getObject().get ('/Metadata')
+			if stm is not None:
+				return stm.getObject().getData()
+		except Exception:
+			pass
+		return None
+	
+	def munge_docinfo_to_dublincore (self, docinfo):
+		clean_dict = {}
+		for k, v in docinfo.iteritems():
+			if k.startswith('/'):
+				k = k[1:]
+			if isinstance (v, basestring) and v.startswith ('D:'):
+				v = parse_pdf_date (v) or v
+			
+			clean_dict[k] = v
+		return clean_dict
+		
+	def munge_metadata_to_dublincore (self, md):
+		"""
+		Combine the document information and XMP metadata as Dublin Core.
+
+		Each element is taken from the XMP where it is given there, unless the
+		document information was modified after the XMP, in which case the
+		document information is preferred instead.
+		"""
+		docinfo, xmp = md
+		info_md = None
+		if docinfo is not None:
+			info_md = MetadataDict()
+			for k, v in self.munge_docinfo_to_dublincore (docinfo).iteritems():
+				if k in DOCINFO_TO_DC and v:
+					field, attribs = DOCINFO_TO_DC[k]
+					if hasattr (v, 'isoformat'):
+						v = v.isoformat()
+					info_md.setdefault (field, []).append (MetaValue (v, attribs))
+		if not xmp:
+			return info_md
+		with self.profiler.phase ('pdf.xmp'):
+			xmp_md, xmp_modified = parse_xmp (xmp)
+		if xmp_md is None:
+			self.profiler.count ('pdf.xmp_errors')
+			return info_md
+		if is_newer ((docinfo or {}).get ('/ModDate'), xmp_modified):
+			return merge_metadata (info_md, xmp_md)
+		return merge_metadata (xmp_md, info_md)
+
+
+### END #######################################################################
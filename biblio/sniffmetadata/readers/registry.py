@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Choosing the right reader for an ebook by looking at its contents.
+
+Each reader is registered along with a "sniffer", which looks at the start of
+a file and says whether it is (or might be) in a format the reader handles. The
+file extension is only used as a hint, to break ties or when there is nothing
+to sniff, so misnamed files are still read correctly and directories of mixed
+formats can be processed in one pass. A file that no sniffer recognises is not
+handed to a reader on the strength of its extension alone, as it would only
+fail to open.
+
+Sniffers are handed a short signature of the file rather than its raw first
+bytes, from which the fields that vary between files of the same format (like
+zip timestamps and checksums) are dropped. This means that dispatch decisions
+can be cached by signature and reused across many files.
+
+Readers may be registered by their dotted name, in which case the reader (and
+whatever it depends on) is only imported when a file is first found to need
+it. A run over a single epub then never loads the PDF machinery.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import struct
+
+
+### CONSTANTS & DEFINES
+
+# how much of the start of a file to read
+HEAD_SIZE = 512
+
+ZIP_MAGIC = 'PK\x03\x04'
+PDF_MAGIC = '%PDF-'
+EPUB_MIMETYPE = 'application/epub+zip'
+
+# how much of the first member of a zip to include in the signature
+ZIP_PEEK = 32
+
+# how confident a sniffer is
+NO_MATCH = 0
+POSSIBLE_MATCH = 1
+CERTAIN_MATCH = 2
+
+# the most signatures to remember dispatch decisions for
+MAX_CACHE_SIZE = 1024
+
+
+### IMPLEMENTATION ###
+
+def head_signature (head):
+	"""
+	Reduce the start of a file to the parts that identify its format.
+
+	For zip files, this is the magic number, the name of the first member and
+	the start of its contents. For everything else it is the first few bytes.
+	"""
+	if head.startswith (ZIP_MAGIC) and (30 <= len (head)):
+		name_len, extra_len = struct.unpack ('<HH', head[26:30])
+		data_start = 30 + name_len + extra_len
+		return '%s%s\0%s' % (ZIP_MAGIC, head[30:30 + name_len],
+			head[data_start:data_start + ZIP_PEEK])
+	return head[:8]
+
+
+def sniff_epub (sig):
+	"""
+	Is this the signature of an epub?
+
+	A zip whose first member is an uncompressed mimetype file (as the standard
+	demands) is certainly an epub, while any other zip might be.
+	"""
+	if sig.startswith (ZIP_MAGIC):
+		if sig[len (ZIP_MAGIC):].startswith ('mimetype\0' + EPUB_MIMETYPE):
+			return CERTAIN_MATCH
+		return POSSIBLE_MATCH
+	return NO_MATCH
+
+
+def sniff_pdf (sig):
+	"""
+	Is this the signature of a PDF?
+	"""
+	if sig.startswith (PDF_MAGIC):
+		return CERTAIN_MATCH
+	return NO_MATCH
+
+
+def load_reader (name):
+	"""
+	Import and return a reader class, given its full dotted name.
+	"""
+	mod_name, cls_name = name.rsplit ('.', 1)
+	mod = __import__ (mod_name, {}, {}, [cls_name])
+	return getattr (mod, cls_name)
+
+
+def read_head (path, size=HEAD_SIZE):
+	hndl = open (path, 'rb')
+	try:
+		return hndl.read (size)
+	finally:
+		hndl.close()
+
+
+class ReaderRegistry (object):
+	"""
+	A collection of readers, and the means of choosing between them.
+	"""
+	def __init__ (self):
+		self._entries = []
+		self._cache = {}
+
+	def register (self, reader, sniffer, exts=None):
+		"""
+		Add a reader to those that may be chosen.
+
+		:Parameters:
+			reader
+				The reader class, or its full dotted name if it is to be
+				imported only when needed.
+			sniffer
+				A callable that is passed a file signature (see
+				`head_signature`) and returns one of `NO_MATCH`, `POSSIBLE_MATCH`
+				or `CERTAIN_MATCH`.
+			exts
+				The file extensions that suggest this reader, defaulting to its
+				`handled_exts`. These must be given if the reader is named.
+
+		"""
+		if exts is None:
+			if isinstance (reader, basestring):
+				raise ValueError ("extensions must be given for reader '%s'" %
+					reader)
+			exts = reader.handled_exts
+		self._entries.append ([reader, sniffer, [x.lower() for x in exts]])
+		self._cache.clear()
+
+	def _load (self, entry):
+		# import a named reader, remembering it
+		if isinstance (entry[0], basestring):
+			entry[0] = load_reader (entry[0])
+		return entry[0]
+
+	@property
+	def readers (self):
+		"""
+		All the registered reader classes, importing any that are named.
+		"""
+		return [self._load (e) for e in self._entries]
+
+	def handled_exts (self):
+		"""
+		Return all the extensions suggesting a registered reader.
+		"""
+		exts = set()
+		for reader, sniffer, reader_exts in self._entries:
+			exts.update (reader_exts)
+		return exts
+
+	def reader_for_head (self, head, ext=None):
+		"""
+		Choose a reader given the start of a file and (optionally) its extension.
+
+		:Returns:
+			A reader class or `None` if no reader recognises the file. The
+			extension alone is only enough if the file is empty.
+
+		"""
+		ext = (ext or '').lower()
+		key = (ext, head_signature (head))
+		if key not in self._cache:
+			best = None
+			best_rank = (NO_MATCH, False)
+			for entry in self._entries:
+				rank = (entry[1] (key[1]), ext in entry[2])
+				if best_rank < rank:
+					best, best_rank = entry, rank
+			if head and (best_rank[0] == NO_MATCH):
+				# the contents say it is not what its extension says
+				best = None
+			if best is not None:
+				best = self._load (best)
+			if MAX_CACHE_SIZE <= len (self._cache):
+				self._cache.clear()
+			self._cache[key] = best
+		return self._cache[key]
+
+	def reader_for_path (self, path):
+		"""
+		Choose a reader for a file, by reading its start.
+
+		:Returns:
+			A reader class or `None` if no reader recognises the file.
+
+		"""
+		ext = os.path.splitext (path)[1][1:]
+		return self.reader_for_head (read_head (path), ext)
+
+	def reader_for_buffer (self, buf, ext=None):
+		"""
+		Choose a reader for an ebook held in memory.
+
+		:Returns:
+			A reader class or `None` if no reader recognises the contents.
+
+		"""
+		head = buf[:HEAD_SIZE]
+		if isinstance (head, memoryview):
+			head = head.tobytes()
+		return self.reader_for_head (str (head), ext)
+
+
+def _make_default_registry():
+	registry = ReaderRegistry()
+	registry.register (
+		'biblio.sniffmetadata.readers.epubmetadatareader.EpubMetaReader',
+		sniff_epub, ['epub'])
+	registry.register (
+		'biblio.sniffmetadata.readers.pdfmetadatareader.PdfMetaReader',
+		sniff_pdf, ['pdf'])
+	return registry
+
+
+# the registry used unless another is given
+default_registry = _make_default_registry()
+
+
+### END #######################################################################
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Reading Dublin Core metadata from the XMP packets of PDFs.
+
+XMP is an RDF/XML packet that often carries better metadata than the document
+information of a PDF: several creators, titles in several languages, subjects
+and identifiers. Here the packet is streamed through `iterparse` and only the
+properties of interest are kept, each being discarded once read so that no
+tree is built. Tags are looked up in a table built once, when this module is
+imported, and shared by every document.
+
+A PDF may carry both XMP and document information, and they may disagree.
+`merge_metadata` combines them, element by element, with one preferred over
+the other: the XMP, unless the document information was changed after it (as
+happens when a tool that knows nothing of XMP edits the document).
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from cStringIO import StringIO
+
+try:
+	from xml.etree import cElementTree as et
+except ImportError:
+	from xml.etree import ElementTree as et
+
+from biblio.sniffmetadata.dates import date_sort_key
+from biblio.sniffmetadata.metadata import MetadataDict, MetaValue
+
+
+### CONSTANTS & DEFINES
+
+RDF_NS = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+DC_NS = "http://purl.org/dc/elements/1.1/"
+XMP_NS = "http://ns.adobe.com/xap/1.0/"
+PDF_NS = "http://ns.adobe.com/pdf/1.3/"
+PRISM_NS = "http://prismstandard.org/namespaces/basic/2.0/"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+DC_ELEMENTS = ['contributor', 'coverage', 'creator', 'date', 'description',
+	'format', 'identifier', 'language', 'publisher', 'relation', 'rights',
+	'source', 'subject', 'title', 'type']
+
+# XMP properties to Dublin Core elements and the attributes to qualify them
+XMP_TO_DC = dict ([('{%s}%s' % (DC_NS, e), (e, {})) for e in DC_ELEMENTS])
+XMP_TO_DC.update ({
+	'{%s}CreateDate' % XMP_NS: ('date', {'event': 'creation'}),
+	'{%s}ModifyDate' % XMP_NS: ('date', {'event': 'modification'}),
+	'{%s}Keywords' % PDF_NS: ('subject', {}),
+	'{%s}isbn' % PRISM_NS: ('identifier', {'scheme': 'ISBN'}),
+})
+
+# properties giving when the metadata was last changed, in order of preference
+MODIFIED_TAGS = ['{%s}MetadataDate' % XMP_NS, '{%s}ModifyDate' % XMP_NS]
+
+DESCRIPTION_TAG = '{%s}Description' % RDF_NS
+RDF_TAG = '{%s}RDF' % RDF_NS
+ALT_TAG = '{%s}Alt' % RDF_NS
+ITEMS_PATH = '*/{%s}li' % RDF_NS
+LANG_ATTR = '{%s}lang' % XML_NS
+DEFAULT_LANG = 'x-default'
+
+PACKET_END = '<?xpacket end'
+
+
+### IMPLEMENTATION ###
+
+def _text (elem):
+	return (elem.text or '').strip()
+
+
+def property_values (elem):
+	"""
+	Return the values of an XMP property element.
+
+	Simple properties have a single value. Arrays (an rdf:Seq, rdf:Bag or
+	rdf:Alt) have one per item, except that only one of a set of alternatives
+	in different languages is returned: the default, or else the first.
+	"""
+	items = elem.findall (ITEMS_PATH)
+	if not items:
+		return [_text (elem)]
+	if elem[0].tag == ALT_TAG:
+		for li in items:
+			if li.get (LANG_ATTR) == DEFAULT_LANG:
+				return [_text (li)]
+		return [_text (items[0])]
+	return [_text (li) for li in items]
+
+
+def _trim_packet (packet):
+	# drop anything after the packet, which the parser would choke on
+	end = packet.rfind (PACKET_END)
+	if end != -1:
+		close = packet.find ('?>', end)
+		if close != -1:
+			return packet[:close + 2]
+	return packet
+
+
+def parse_xmp (packet):
+	"""
+	Extract Dublin Core metadata from an XMP packet.
+
+	:Parameters:
+		packet
+			The XMP packet as a string, or as a pyPdf `XmpInformation`.
+
+	:Returns:
+		A `MetadataDict` (`None` if the packet cannot be parsed) and when the
+		metadata was last modified, as given in the packet (or `None`).
+
+	"""
+	if hasattr (packet, 'stream'):
+		packet = packet.stream.getData()
+	fields = {}
+	modified = {}
+	try:
+		for event, elem in et.iterparse (StringIO (_trim_packet (packet)),
+				events=('start', 'end')):
+			tag = elem.tag
+			if event == 'start':
+				if tag == DESCRIPTION_TAG:
+					# simple properties may be given as attributes
+					for k, v in elem.attrib.items():
+						if k in XMP_TO_DC:
+							fields.setdefault (k, []).append (v.strip())
+						if k in MODIFIED_TAGS:
+							modified[k] = v.strip()
+			elif tag in XMP_TO_DC:
+				fields.setdefault (tag, []).extend (property_values (elem))
+				if tag in MODIFIED_TAGS:
+					modified[tag] = _text (elem)
+				elem.clear()
+			elif tag in MODIFIED_TAGS:
+				modified[tag] = _text (elem)
+			elif tag == DESCRIPTION_TAG:
+				elem.clear()
+			elif tag == RDF_TAG:
+				break
+	except SyntaxError:
+		# as raised for malformed XML
+		return None, None
+	md = MetadataDict()
+	for tag, vals in fields.iteritems():
+		field, attribs = XMP_TO_DC[tag]
+		md.setdefault (field, []).extend ([MetaValue (v, attribs) for v in vals
+			if v])
+	for tag in MODIFIED_TAGS:
+		if modified.get (tag):
+			return md, modified[tag]
+	return md, None
+
+
+def is_newer (date, other):
+	"""
+	Is one date (PDF or ISO 8601) later than another?
+
+	If either is missing or cannot be parsed, the answer is no.
+	"""
+	a, b = date_sort_key (date), date_sort_key (other)
+	return (a is not None) and (b is not None) and (b < a)
+
+
+def merge_metadata (preferred, other):
+	"""
+	Combine two sets of Dublin Core metadata for a document.
+
+	:Returns:
+		A `MetadataDict` where each element is taken from `preferred` if it
+		has any values there, and from `other` otherwise. Either may be `None`.
+
+	"""
+	if preferred is None:
+		return other
+	merged = MetadataDict (preferred)
+	for k, v in (other or {}).iteritems():
+		if not merged.get (k):
+			merged[k] = v
+	return merged
+
+
+### END #######################################################################
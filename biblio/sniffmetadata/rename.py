@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Renaming many ebooks safely, with a plan, a journal and the means to undo it.
+
+Renaming is done in three steps:
+
+1. Every new name is worked out first by `plan_renames`, which gives each book
+   its new name in its own directory. Names that clash (with each other or with
+   files already there) are made unique by numbering, as in "Name (2).epub".
+2. The plan is written to a `RenameJournal` and flushed to disk before any file
+   is touched.
+3. `apply_plan` then carries out the plan a directory at a time, noting each
+   finished directory in the journal.
+
+If a run is interrupted, `resume` finishes the plan and `rollback` undoes what
+was done, both working from the journal. A dry run is just a plan that is
+printed rather than applied.
+
+When asked to copy rather than rename, books are cloned (copy-on-write, where
+the filesystem supports it) or hard-linked, so that no data is copied unless
+neither can be done.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple
+import errno
+import json
+import os
+import re
+import shutil
+import sys
+
+from biblio.sniffmetadata.defaults import DEFAULT_JOURNAL
+from biblio.sniffmetadata.instrument import get_profiler
+
+
+### CONSTANTS & DEFINES
+
+ACTION_RENAME = 'rename'
+ACTION_COPY = 'copy'
+
+# how a copy was made
+CLONE_REFLINK = 'reflink'
+CLONE_HARDLINK = 'hardlink'
+CLONE_COPY = 'copy'
+
+# the state of a journal
+STATUS_PENDING = 'pending'
+STATUS_COMPLETE = 'complete'
+STATUS_ROLLED_BACK = 'rolled back'
+
+# the Linux ioctl for cloning a file, from <linux/fs.h>
+FICLONE = 0x40049409
+
+# what may not appear in a file name
+UNSAFE_NAME_RE = re.compile (r'[/\\\0]')
+
+
+### IMPLEMENTATION ###
+
+class RenameError (Exception):
+	"""
+	A rename could not be planned, carried out or undone.
+	"""
+	pass
+
+
+class RenameOp (namedtuple ('RenameOp', ['src', 'dest', 'action'])):
+	"""
+	A single planned rename or copy of a book.
+	"""
+	__slots__ = ()
+
+
+class JournalState (namedtuple ('JournalState', ['ops', 'done', 'status'])):
+	"""
+	What a journal records: the planned operations, the indices of those done
+	(and not undone) and whether the plan is pending, complete or rolled back.
+	"""
+	__slots__ = ()
+
+
+def safe_name (name):
+	"""
+	Make a new name fit to be a file name, with no directory parts.
+	"""
+	name = UNSAFE_NAME_RE.sub ('_', name).strip()
+	if name in ['', '.', '..']:
+		name = '_'
+	return name
+
+
+def _numbered (name, n):
+	base, ext = os.path.splitext (name)
+	return '%s (%d)%s' % (base, n, ext)
+
+
+def plan_renames (pairs, copy=False):
+	"""
+	Work out every rename (or copy) before any is done.
+
+	:Parameters:
+		pairs
+			An iterable of (path, new name) pairs. Each book keeps to its own
+			directory.
+		copy
+			Copy books to their new names, rather than renaming them.
+
+	:Returns:
+		A list of `RenameOp`. Books that already have their new name are left
+		out, unless they are being copied.
+
+	Clashes are found with a set of the names in each directory, which is
+	listed only once however many books it holds. A book is not renumbered
+	to avoid its own name, so planning again with the same names gives no
+	renames.
+	"""
+	action = copy and ACTION_COPY or ACTION_RENAME
+	fs_enc = sys.getfilesystemencoding() or 'utf8'
+	# directory -> names taken, as compared by the filesystem
+	taken = {}
+	ops = []
+	for src, new_name in pairs:
+		dir_path = os.path.dirname (src)
+		names = taken.get (dir_path)
+		if names is None:
+			try:
+				listing = os.listdir (dir_path or os.curdir)
+			except OSError:
+				listing = []
+			names = taken[dir_path] = set ([os.path.normcase (x) for x in
+				listing])
+		if isinstance (new_name, unicode) and not isinstance (src, unicode):
+			new_name = new_name.encode (fs_enc)
+		new_name = safe_name (new_name)
+		src_name = os.path.normcase (os.path.basename (src))
+		if not copy:
+			# a book doesn't clash with itself, so a numbered name it already
+			# has is kept & planning again changes nothing
+			names.discard (src_name)
+		dest_name = new_name
+		n = 1
+		while os.path.normcase (dest_name) in names:
+			n += 1
+			dest_name = _numbered (new_name, n)
+		names.add (src_name)
+		if (os.path.normcase (dest_name) == src_name) and not copy:
+			continue
+		names.add (os.path.normcase (dest_name))
+		ops.append (RenameOp (src, os.path.join (dir_path, dest_name), action))
+	return ops
+
+
+def _reflink (src, dest):
+	# try to clone a file, returning whether it could be
+	if not sys.platform.startswith ('linux'):
+		return False
+	import fcntl
+	src_hndl = open (src, 'rb')
+	try:
+		fd = os.open (dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+		try:
+			fcntl.ioctl (fd, FICLONE, src_hndl.fileno())
+			cloned = True
+		except (IOError, OSError):
+			cloned = False
+		finally:
+			os.close (fd)
+	finally:
+		src_hndl.close()
+	if cloned:
+		shutil.copystat (src, dest)
+	else:
+		os.unlink (dest)
+	return cloned
+
+
+def clone_file (src, dest):
+	"""
+	Copy a file, sharing its data where the filesystem allows.
+
+	:Returns:
+		How the copy was made: `CLONE_REFLINK` (a copy-on-write clone),
+		`CLONE_HARDLINK` or `CLONE_COPY`.
+
+	A clone is tried first, then a hard link. Only if neither can be made are
+	the contents copied, to a temporary name so that a partial copy is never
+	left under the new one.
+	"""
+	if os.path.lexists (dest):
+		raise RenameError ("'%s' already exists" % dest)
+	if _reflink (src, dest):
+		return CLONE_REFLINK
+	try:
+		os.link (src, dest)
+		return CLONE_HARDLINK
+	except OSError, err:
+		if err.errno == errno.EEXIST:
+			raise RenameError ("'%s' already exists" % dest)
+	tmp_path = dest + '.partial'
+	shutil.copy2 (src, tmp_path)
+	os.rename (tmp_path, dest)
+	return CLONE_COPY
+
+
+def _is_done (op):
+	# has this operation already been done, e.g. before an interruption?
+	if op.action == ACTION_COPY:
+		return os.path.exists (op.dest)
+	return os.path.exists (op.dest) and not os.path.exists (op.src)
+
+
+def _apply (op):
+	if op.action == ACTION_COPY:
+		return clone_file (op.src, op.dest)
+	if os.path.lexists (op.dest):
+		raise RenameError ("'%s' already exists" % op.dest)
+	os.rename (op.src, op.dest)
+	return ACTION_RENAME
+
+
+def _undo (op):
+	if op.action == ACTION_COPY:
+		if os.path.lexists (op.dest):
+			os.unlink (op.dest)
+	elif os.path.exists (op.dest):
+		if os.path.lexists (op.src):
+			raise RenameError ("'%s' already exists" % op.src)
+		os.rename (op.dest, op.src)
+
+
+def _sync_dir (dir_path):
+	# make renames in a directory durable, where the platform allows
+	try:
+		fd = os.open (dir_path or os.curdir, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync (fd)
+	except OSError:
+		pass
+	finally:
+		os.close (fd)
+
+
+def _by_directory (ops, indices):
+	# group operations by directory, keeping the order within each
+	batches = {}
+	order = []
+	for i in indices:
+		d = os.path.dirname (ops[i].dest)
+		if d not in batches:
+			batches[d] = []
+			order.append (d)
+		batches[d].append (i)
+	return [(d, batches[d]) for d in order]
+
+
+class RenameJournal (object):
+	"""
+	A record on disk of a rename plan and its progress.
+
+	The journal is a file of JSON lines: first one for each planned operation,
+	then one for each batch of operations done (or undone) and lastly the
+	outcome. It is flushed to disk before any file is touched and after each
+	batch.
+	"""
+	def __init__ (self, path=DEFAULT_JOURNAL):
+		self.path = path
+		self._hndl = None
+
+	def _write (self, records):
+		if self._hndl is None:
+			self._hndl = open (self.path, 'ab')
+		for r in records:
+			self._hndl.write (json.dumps (r) + '\n')
+		self._hndl.flush()
+		os.fsync (self._hndl.fileno())
+
+	def start (self, ops):
+		"""
+		Record a new plan, replacing any finished journal.
+
+		An unfinished journal is never replaced, as it may be the only record of
+		what an interrupted run did.
+		"""
+		if os.path.exists (self.path):
+			if read_journal (self.path).status == STATUS_PENDING:
+				raise RenameError ("journal '%s' is unfinished: resume or roll "
+					"it back first" % self.path)
+			os.unlink (self.path)
+		self._write ([{'op': i, 'src': op.src, 'dest': op.dest,
+			'action': op.action} for i, op in enumerate (ops)])
+
+	def mark (self, key, indices):
+		"""
+		Record that some operations have been 'done' or 'undone'.
+		"""
+		self._write ([{key: indices}])
+
+	def finish (self, status):
+		self._write ([{'status': status}])
+
+	def close (self):
+		if self._hndl is not None:
+			self._hndl.close()
+			self._hndl = None
+
+
+def read_journal (path):
+	"""
+	Read a rename journal.
+
+	:Returns:
+		A `JournalState`.
+
+	A final line cut short (e.g. by a crash while it was written) is ignored.
+	"""
+	if not os.path.exists (path):
+		raise RenameError ("no journal '%s'" % path)
+	ops = []
+	done = set()
+	status = STATUS_PENDING
+	hndl = open (path, 'rb')
+	try:
+		for line in hndl:
+			try:
+				rec = json.loads (line)
+			except ValueError:
+				break
+			if 'op' in rec:
+				ops.append (RenameOp (rec['src'], rec['dest'], rec['action']))
+			elif 'done' in rec:
+				done.update (rec['done'])
+				status = STATUS_PENDING
+			elif 'undone' in rec:
+				done.difference_update (rec['undone'])
+			elif 'status' in rec:
+				status = rec['status']
+	finally:
+		hndl.close()
+	return JournalState (ops, done, status)
+
+
+def apply_plan (ops, journal=None, indices=None):
+	"""
+	Carry out planned renames, a directory at a time.
+
+	:Parameters:
+		ops
+			A list of `RenameOp`, as from `plan_renames`.
+		journal
+			A `RenameJournal` the plan has been started in, if any.
+		indices
+			Which of the operations to do, defaulting to all of them.
+
+	:Returns:
+		A dict counting how the operations were done ('rename', 'reflink',
+		'hardlink' or 'copy') and listing any 'errors' as (op, message) pairs.
+
+	An operation that fails is reported and the rest carried on with, so that
+	the plan can be resumed once the problem is dealt with. The journal is
+	only marked as complete if everything was done.
+	"""
+	if indices is None:
+		indices = range (len (ops))
+	prof = get_profiler()
+	results = {'errors': []}
+	for dir_path, batch in _by_directory (ops, indices):
+		done = []
+		for i in batch:
+			op = ops[i]
+			try:
+				if _is_done (op):
+					how = 'already done'
+				else:
+					with prof.phase ('rename'):
+						how = _apply (op)
+			except (EnvironmentError, RenameError), err:
+				results['errors'].append ((op, str (err)))
+				continue
+			results[how] = results.get (how, 0) + 1
+			done.append (i)
+		_sync_dir (dir_path)
+		if journal is not None and done:
+			journal.mark ('done', done)
+	if journal is not None and not results['errors']:
+		journal.finish (STATUS_COMPLETE)
+	return results
+
+
+def resume (journal_path=DEFAULT_JOURNAL):
+	"""
+	Finish the plan in an unfinished journal.
+
+	:Returns:
+		As for `apply_plan`.
+
+	"""
+	state = read_journal (journal_path)
+	if state.status == STATUS_ROLLED_BACK:
+		raise RenameError ("journal '%s' has been rolled back" % journal_path)
+	journal = RenameJournal (journal_path)
+	try:
+		return apply_plan (state.ops, journal,
+			[i for i in range (len (state.ops)) if i not in state.done])
+	finally:
+		journal.close()
+
+
+def rollback (journal_path=DEFAULT_JOURNAL):
+	"""
+	Undo what was done by the plan in a journal.
+
+	Renamed books get their old names back and copies are removed, most
+	recent first. Operations not marked as done are checked too, as a run
+	interrupted partway through a directory will have done some of them
+	without saying so.
+
+	:Returns:
+		A dict giving the number 'undone' and listing any 'errors' as
+		(op, message) pairs.
+
+	"""
+	state = read_journal (journal_path)
+	ops = state.ops
+	done = set (state.done)
+	if state.status == STATUS_PENDING:
+		done.update ([i for i, op in enumerate (ops) if (i not in done) and
+			_is_done (op)])
+	journal = RenameJournal (journal_path)
+	results = {'undone': 0, 'errors': []}
+	try:
+		for dir_path, batch in _by_directory (ops, sorted (done, reverse=True)):
+			undone = []
+			for i in batch:
+				try:
+					_undo (ops[i])
+				except (EnvironmentError, RenameError), err:
+					results['errors'].append ((ops[i], str (err)))
+					continue
+				undone.append (i)
+			_sync_dir (os.path.dirname (ops[batch[0]].src))
+			if undone:
+				journal.mark ('undone', undone)
+				results['undone'] += len (undone)
+		if not results['errors']:
+			journal.finish (STATUS_ROLLED_BACK)
+	finally:
+		journal.close()
+	return results
+
+
+### END #######################################################################
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Benchmarking the ebook readers against a synthetic corpus.
+
+This script should be called::
+
+	python bench_sniff.py [OPTIONS]
+
+A corpus is generated (or reused) in the given directory, each case is read and
+timed, and a table of results printed. Results may be saved as JSON and compared
+against those of an earlier run.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+__version__ = '0.1'
+
+
+### IMPORTS
+
+from optparse import OptionParser
+import json
+import os
+import sys
+
+from biblio.sniffmetadata import benchmark
+
+
+### CONSTANTS & DEFINES
+
+### IMPLEMENTATION ###
+
+### MAIN ###
+
+def parse_args():
+	usage = '%prog [OPTIONS]'
+	version = "version %s" %  __version__
+	epilog = 'Cases are: %s.' % ', '.join ([c[0] for c in benchmark.DEFAULT_CASES])
+
+	optparser = OptionParser (usage=usage, version=version, epilog=epilog)
+
+	optparser.add_option ('--corpus-dir',
+		dest="corpus_dir",
+		action='store',
+		default='bench-corpus',
+		metavar='DIR',
+		help="Where to generate (or find) the synthetic corpus",
+	)
+
+	optparser.add_option ('--scale',
+		dest="scale",
+		action='store',
+		type='float',
+		default=1.0,
+		metavar='X',
+		help="Multiply the number of books in each case by this",
+	)
+
+	optparser.add_option ('--repeat',
+		dest="repeat",
+		action='store',
+		type='int',
+		default=1,
+		metavar='N',
+		help="Read each book N times",
+	)
+
+	optparser.add_option ('--case',
+		dest="cases",
+		action='append',
+		default=[],
+		metavar='NAME',
+		help="Only run this case (may be given more than once)",
+	)
+
+	optparser.add_option ('--memory',
+		dest="memory",
+		action='store',
+		type='int',
+		default=0,
+		metavar='N',
+		help="Also measure the memory needed to hold N records",
+	)
+
+	optparser.add_option ('--xmp',
+		dest="xmp",
+		action='store',
+		type='int',
+		default=0,
+		metavar='N',
+		help="Also compare reading N XMP packets with pyPdf",
+	)
+
+	optparser.add_option ('--channel',
+		dest="channel",
+		action='store',
+		type='int',
+		default=0,
+		metavar='N',
+		help="Also compare returning results from 1, 4 & 16 workers through "
+			"shared memory & pickled, for N small epubs",
+	)
+
+	optparser.add_option ('--imports',
+		dest="imports",
+		action='store_true',
+		default=False,
+		help="Also time importing the package & scripts",
+	)
+
+	optparser.add_option ('--output',
+		dest="output",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="Save results to this file as JSON",
+	)
+
+	optparser.add_option ('--compare',
+		dest="compare",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="Compare results with those saved in this file",
+	)
+
+	options, pargs = optparser.parse_args()
+	if pargs:
+		optparser.error ('unexpected arguments: %s' % ' '.join (pargs))
+
+	## Postconditions & return:
+	return options
+
+
+def main():
+	options = parse_args()
+
+	cases = benchmark.DEFAULT_CASES
+	if options.cases:
+		cases = [c for c in cases if c[0] in options.cases]
+
+	print "* Generating corpus in '%s' ..." % options.corpus_dir
+	corpus = benchmark.generate_corpus (options.corpus_dir, cases, options.scale)
+	print "* Running benchmarks ..."
+	results = benchmark.run_benchmarks (corpus, options.repeat)
+	print benchmark.format_results (results)
+
+	if options.memory:
+		mem = benchmark.run_memory_benchmark (options.memory)
+		results['memory'] = mem
+		print
+		print "* Memory for %(records)s records: %(plain_bytes_per_record).0f bytes " \
+			"each as plain objects, %(compact_bytes_per_record).0f compact " \
+			"(%(saving).0f%% saving)" % dict (mem, saving=100 * mem['saving'])
+
+	if options.xmp:
+		xmp = benchmark.run_xmp_benchmark (options.xmp)
+		results['xmp'] = xmp
+		print
+		if xmp['pypdf_per_sec']:
+			print "* XMP: %(xmp_per_sec).0f packets/s, against %(pypdf_per_sec).0f " \
+				"for pyPdf (%(speedup).1fx)" % xmp
+		else:
+			print "* XMP: %(xmp_per_sec).0f packets/s (pyPdf is not installed)" % xmp
+
+	if options.channel:
+		print
+		print "* Comparing results returned through shared memory & pickled ..."
+		results['channel'] = benchmark.run_channel_benchmark (
+			os.path.join (options.corpus_dir, 'channel'), options.channel)
+		print benchmark.format_channel_results (results['channel'])
+
+	if options.imports:
+		results['imports'] = benchmark.run_import_benchmark()
+		print
+		print benchmark.format_import_results (results['imports'])
+
+	if options.output:
+		hndl = open (options.output, 'wb')
+		json.dump (results, hndl, indent=1, sort_keys=True)
+		hndl.close()
+
+	if options.compare:
+		hndl = open (options.compare, 'rb')
+		old = json.load (hndl)
+		hndl.close()
+		print
+		print '%-24s %10s %10s %8s' % ('case', 'old/s', 'new/s', 'ratio')
+		for name, old_rate, new_rate, ratio in \
+				benchmark.compare_results (old, results):
+			print '%-24s %10.1f %10.1f %8.2f' % (name, old_rate, new_rate, ratio)
+		if ('imports' in old) and ('imports' in results):
+			print
+			print '%-32s %10s %10s %8s' % ('module', 'old ms', 'new ms', 'ratio')
+			for name, old_ms, new_ms, ratio in \
+					benchmark.compare_import_results (old['imports'],
+						results['imports']):
+				print '%-32s %10.1f %10.1f %8.2f' % (name, old_ms, new_ms, ratio)
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit (main())
+
+
+### END #######################################################################
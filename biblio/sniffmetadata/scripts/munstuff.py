@@ -5,16 +5,27 @@ Unpacking mutliple archive files from the commandline.
 
 Stuffit has a commandline interface, but it can only call one file at a time.
 This wrapper calls unstuff repeatedly, passing archive passwords and deletion
-flags, while extinguishing hung processes.
+flags, while extinguishing hung processes. Several archives are unpacked at
+once (see ``--jobs``), and a summary of the outcomes is printed at the end.
+
+With ``--sniff``, each archive is unpacked into a directory of its own under
+``--dest`` and the metadata of the ebooks within is read as soon as it is
+done, while later archives are still being unpacked.
 
 """
 
+__version__ = '0.1'
+
 
 ### IMPORTS
 
 import argparse as ap
-from multiprocessing import Process
-from os import system
+import sys
+
+from biblio.sniffmetadata.unpack import UnpackScheduler, summarise_results, \
+	default_jobs, DEFAULT_COMMAND, DEFAULT_TIMEOUT, STATUS_OK
+from biblio.sniffmetadata.pipeline import UnpackSniffPipeline, ArchiveResult, \
+	DEFAULT_QUEUE_SIZE
 
 
 ### CONSTANTS & DEFINES
@@ -22,25 +33,30 @@ from os import system
 _DEV_MODE = True
 
 
-### IMPLEMENTATION ### 
+### IMPLEMENTATION ###
 
-def run_with_timeout (func, args=(), kwargs={}, timeout=30):
+def report_result (res):
 	"""
-	Run callable in seperate process, with an optional timeout.
-	
-	:Returns:
-		A boolean for process completion.
-	
+	Print the outcome of unpacking an archive.
 	"""
-	# XXX: unsure about child processes being killed, like if I call to shell
-	it = Process (target=func, args=args, kwargs=kwargs)
-	it.start()
-	it.join (timeout)
-	if it.is_alive():
-		it.terminate()
-		return False
-	else:
-		return True
+	print "* %-7s %6.1fs  %s" % (res.status, res.duration, res.path)
+	if (res.status != STATUS_OK) and res.output.strip():
+		for line in res.output.strip().splitlines():
+			print "\t%s" % line
+
+
+def report_book (res):
+	"""
+	Print the outcome of reading an unpacked book.
+	"""
+	scan = res.scan
+	if scan.error:
+		print "\t! %s: %s" % (scan.path, scan.error)
+		return
+	md = scan.metadata()
+	titles = md and md.get ('title')
+	title = titles and titles[0].value or '(no title)'
+	print (u"\t> %s: %s" % (scan.path, title)).encode ('ascii', 'replace')
 
 
 ## MAIN ###
@@ -51,54 +67,118 @@ def parse_args():
 	"""
 	op = ap.ArgumentParser (description='Unpacks multiple archives using Stuffit.')
 	op.add_argument('--version', action='version', version=__version__)
-	
-	op.add_argument ('--password', 
+
+	op.add_argument ('--password',
 		dest='password',
-		type=int,
 		help='To be used for decoding archives',
 		metavar='PASSWORD',
 		default=None,
 	)
-	
+
 	op.add_argument ('--delete',
 		dest='delete',
 		help='Delete archives after sucessful unpacking',
 		action='store_true',
 	)
-	
-	op.add_argument ('--timeout', 
+
+	op.add_argument ('--timeout',
 		dest='timeout',
 		help='Time limit for unpacking individual files',
 		metavar='SECONDS',
-		default=30,
+		type=float,
+		default=DEFAULT_TIMEOUT,
+	)
+
+	op.add_argument ('--jobs', '-j',
+		dest='jobs',
+		help='How many archives to unpack at once (default: number of CPUs)',
+		metavar='N',
+		type=int,
+		default=default_jobs(),
+	)
+
+	op.add_argument ('--command',
+		dest='command',
+		help='The program used to unpack archives',
+		metavar='PROGRAM',
+		default=DEFAULT_COMMAND,
 	)
-	
-	op.add_argument('infiles', action="store")
-	
+
+	op.add_argument ('--sniff',
+		dest='sniff',
+		help='Read the metadata of the unpacked ebooks as each archive finishes',
+		action='store_true',
+	)
+
+	op.add_argument ('--dest',
+		dest='dest',
+		help='Where to unpack archives for --sniff, each in its own directory',
+		metavar='DIR',
+		default='.',
+	)
+
+	op.add_argument ('--sniff-jobs',
+		dest='sniff_jobs',
+		help='How many processes to read ebooks in, for --sniff',
+		metavar='N',
+		type=int,
+		default=1,
+	)
+
+	op.add_argument ('--queue-size',
+		dest='queue_size',
+		help='The most unpacked ebooks that may wait to be read, for --sniff',
+		metavar='N',
+		type=int,
+		default=DEFAULT_QUEUE_SIZE,
+	)
+
+	op.add_argument('infiles', nargs='+')
+
 	opts = op.parse_args()
-	
+
 	## Postconditions & return:
-	# TODO: assert infiles
+	if (opts.jobs < 1) or (opts.sniff_jobs < 1) or (opts.queue_size < 1):
+		op.error ('--jobs, --sniff-jobs & --queue-size must be at least 1')
 	return opts
 
 
 def main (infiles, opts):
-	for f in infiles:
-		password = delete = ''
-		if opts.password:
-			password = '-p "%s"' % opts.password
-		if opts.delete:
-			delete = '-D'
-		cmdline = 'stuff %s %s "%s"' % (password, delete, f)
-		run_with_timeout (system, args=[cmdline], timeout=timeout)
-	
-	
-	
+	scheduler = UnpackScheduler (jobs=opts.jobs, timeout=opts.timeout,
+		command=opts.command, password=opts.password, delete=opts.delete)
+	results = []
+	books = book_errors = 0
+	if opts.sniff:
+		pipeline = UnpackSniffPipeline (scheduler, opts.dest,
+			jobs=opts.sniff_jobs, queue_size=opts.queue_size)
+		for res in pipeline.run (infiles):
+			if isinstance (res, ArchiveResult):
+				report_result (res.unpacked)
+				results.append (res.unpacked)
+			else:
+				report_book (res)
+				books += 1
+				if res.scan.error:
+					book_errors += 1
+	else:
+		for res in scheduler.run (infiles):
+			report_result (res)
+			results.append (res)
+	summary = summarise_results (results)
+	print "* %(total)s archives: %(ok)s unpacked, %(failed)s failed, " \
+		"%(timeout)s timed out, %(error)s could not be run " \
+		"(%(duration).1fs in total)" % summary
+	if opts.sniff:
+		print "* %s ebooks read, %s with errors" % (books, book_errors)
+	return ((summary['total'] != summary['ok']) or book_errors) and 1 or 0
+
 
 if __name__ == '__main__':
 	try:
 		opts = parse_args()
-		main (opts.infiles, opts)
+		sys.exit (main (opts.infiles, opts))
+	except SystemExit:
+		raise
 	except BaseException, err:
 		if (_DEV_MODE):
 			raise
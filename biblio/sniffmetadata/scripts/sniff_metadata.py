@@ -1,441 +1,627 @@
-#!/usr/bin/env python
-# -*- coding: utf8 -*-
-"""
-Listing epub ebook metadata and perhaps renaming the book appropriately.
-
-This script should be called::
-
-	python epubmetareader.py [list|rename] book1.epub book2.epub ...
-	
-Due to some variations in the way metadata is actually written, this script
-does a a bit of searching and cleaning up to best extract book information. If
-the "list" command is used, this metadata is dumped to the screen. If "rename"
-is used, the original file is renamed in the format::
-
-	<first author surname> (<publication year>) <short title> (isbn<isbn>).epub
-	
-This only uses the standard Python library to do its magic and should be easily
-modifiable.
-"""
-
-__author__ = "Paul-Michael Agapow (pma@agapow.net)"
-__version__ = '0.1'
-
-
-### IMPORTS
-
-from xml.etree import ElementTree as et
-from zipfile import ZipFile
-from xml.dom.minidom import parseString
-import copy
-import re
-from StringIO import StringIO
-import types
-import os 
-
-
-### CONSTANTS & DEFINES
-
-OPF_NS = "http://www.idpf.org/2007/opf"
-DC_NS = "http://purl.org/dc/elements/1.1/"
-
-DENAMESPACE_RE = re.compile (r'^.+\}')
-
-YEAR_RE = re.compile (r'^\d\d\d\d')
-
-CLEAN_ISBN_RE = re.compile (r'[\- ]+')
-
-CMD_SYNONYMS = {
-	'info': ['list'],
-	'rename': [],
-}
-
-
-### IMPLEMENTATION ###
-
-class VocabProcessor (object):
-	"""
-	Transforms commands and vocabularies to a standard form.
-	"""
-	def __init__ (self, syn_dict, **kwargs):
-		self._content = {}
-		
-	def add_member (self, item, synonyms=[], value=None):
-		item = item.strip().lower()
-		assert (item not in self._content.keys()), "vocab item '%s' is a duplicate" % item 
-		if value is None:
-			value = item
-		self._content[item] = value
-		for s in synonyms:
-			assert (s not in self._content.keys()), "vocab item '%s' is a duplicate" % s
-			self._content[s] = value
-		
-	def __getitem__ (self, item):
-		return self._content[item.strip().lower()]
-
-
-def rename_file (p, md):
-	# tmpl = <1st author surname> (<year>) <short title> (ISBN<isbn>)
-	UNKNOWN = 'UNKNOWN'
-	
-	# grab the first author or creator
-	auths = md.authors() or md.creators()
-	if auths:
-		# extract their surname
-		first_auth = auths[0]
-		name = first_auth.attribs.get('file-as', '').split(',')[0] \
-			or first_auth.value.split(' ')[-1] \
-			or UNKNOWN
-		
-	# get year
-	pubdate = None
-	dateval = md.publication_date() or md.get('date')
-	if dateval:
-		earliest_date = sorted (dateval, cmp=lambda x, y: cmp (x.value, y.value))[0]
-		m = YEAR_RE.match (earliest_date.value)
-		if m:
-			pubdate = m.group(0)
-	if not pubdate:
-		pubdate = UNKNOWN
-		
-	# get title
-	short_title = None
-	title = md.get('title')
-	if title:
-		short_title = title.value.split(':')[0]
-	else:
-		short_title = UNKNOWN
-	
-	# get isbn
-	isbn = None
-	ids = md.isbn()
-	if ids:
-		isbn = CLEAN_ISBN_RE.sub ('', ids[0].value).upper()
-	else:
-		isbn = UNKNOWN
-		for x in md.identifiers():
-			id_val = CLEAN_ISBN_RE.sub ('', x.value).upper()
-			if len(id_val) in [10, 13]:
-				isbn = id_val
-				break
-	
-	# build name
-	new_file_name = u"%(name)s (%(pubdate)s) %(short_title)s (isbn%(isbn)s).epub" % {
-		'name': name,
-		'pubdate': pubdate,
-		'short_title': short_title,
-		'isbn': isbn,
-	}
-	print new_file_name
-	os.rename (p, new_file_name)
-	
-# will be supplied with metadata, unknown and ext
-DEFAULT_TMPL = """
-## the first authors family name
-##
-#if $metadata.authors
-#set $auth = $metadata.authors[0].family or $metadata.authors[0].given
-#elsif $metadata.creators
-#set $auth = $metadata.creators[0].family or $metadata.authors[0].given
-#else
-#set $auth = $unknown
-#end if
-$auth
-##
-## the publication year in brackets
-##
- (
-#if $metadata.publication then $metadata.publication.year else $unknown
-)
-##
-## title
-##
- #if $metadata.short_title then $metadata.short_title else $unknown
-##
-## isbn in brackets
-##
- (isbn
-#if $metadata.isbn then $metadata.isbn[0].value else $unknown
-)
-##
-## file extension
-##
-.$ext
-"""
-	
-	
-def pretty_print(element):
-	txt = et.tostring(element)
-	return parseString(txt).toprettyxml()
-
-
-def strip_namespace(tag):
-	"""
-	Remove the namespace portion of an Etree tagname.
-	"""
-	return DENAMESPACE_RE.sub ('', tag)
-	
-
-def clean_attribs (attrib_dict):
-	return dict ([(strip_namespace(k).lower(), v) for k,v in attrib_dict.iteritems()])
-	
-
-def tag_to_metval (xml_tag):
-	if xml_tag.text:
-		val_name = xml_tag.text.strip()
-	else:
-		val_name = ''
-	return MetaValue (val_name, clean_attribs(xml_tag.attrib))
-
-
-class EpubMetaReader (object):
-	def __init__ (self, path):
-		self.zip = ZipFile (path, mode='r')
-		
-	def get_metadata (self):
-		"""
-		Search for and return metadata within the ebook.
-		
-		:Returns:
-			A hash of the metadata tags found or `None` if nothing found.
-			
-		Note that if the metadata is found but is empty, an empty hash is returned.
-		We follow this philosophy for the individual fields as well - if a field
-		is not found, it doesn't appear in the metadata, but if it appears but is
-		empty or cannot be parsed, an empty field appears in the metadata.
-		
-		"""
-		# NOTE: a contents file with malformed XML will error, which is acceptable
-		# XXX: other fields to looks at
-		# - subject, type
-		# - date (YYYY[-MM[-DD]]: a required 4-digit year, an optional 2-digit
-		# month, and if the month is given, an optional 2-digit day of month.
-		# The date element has one optional OPF event attribute. The set of values
-		# for event are not defined by this specification; possible values may
-		# include: creation, publication, and modification.)
-		# Possible roles for creastors & contributors include:
-		# Artist [art]	 Use for a person (e.g., a painter) who conceives, and perhaps also implements, an original graphic design or work of art, if specific codes (e.g., [egr], [etr]) are not desired. For book illustrators, prefer Illustrator [ill].
-		# Author [aut]	 Use for a person or corporate body chiefly responsible for the intellectual or artistic content of a work. This term may also be used when more than one person or body bears such responsibility.
-		# Editor [edt]	 Use for a person who prepares for publication a work not primarily his/her own, such as by elucidating text, adding introductory or other critical matter, or technically directing an editorial staff.
-		# Illustrator [ill]	 Use for the person who conceives, and perhaps also implements, a design or illustration, usually to accompany a written text.
-		# Translator [trl]
-		contents = self.read_contents_file()
-		if contents:
-			con_tree = et.fromstring(contents)
-			metadata_tag = "{%s}metadata" % OPF_NS
-			m = con_tree.find(metadata_tag)
-			if m:
-				md_dict = MetadataDict()
-				for t in ['publisher', 'language', 'title', 'description']:
-					elem = m.find("{%s}%s" % (DC_NS, t))
-					if elem != None:
-						md_dict[t] = tag_to_metval (elem)
-				for t in ['creator', 'contributor', 'identifier', 'date']:
-					elems = m.findall("{%s}%s" % (DC_NS, t))
-					if elems != []:
-						md_dict[t] = [tag_to_metval (x) for x in elems]
-				return md_dict
-		# no file, no xml or no metadata tag
-		return None
-		
-	def read_contents_file (self):
-		"""
-		Find and return the contents of the ebook table of contents.
-		"""
-		contents_path = self.find_contents_file()
-		if contents_path:
-			return self.zip.read (self.find_contents_file())
-		else:
-			return None
-
-	def find_contents_file (self):
-		"""
-		Return the path of the table of contents within the epub zip.
-		
-		:Returns:
-			The location of the table of contents or `None` if it cannot be found
-			
-		While the location of the TOC is prescribed by the epub standard, in practice
-		this is much violated. Therefore we looks for it in the variety of locations:
-		
-		1. The location given in the container file
-		2. Within the OEBPS directory
-		3. On the top level
-		
-		"""
-		# possible locations for the toc
-		possible_paths = [
-			self.contents_path_from_container(),
-			'OEBPS/content.opf',
-			'OEBPS/Content.opf',
-			'content.opf',
-			'Content.opf',
-		]
-		# is there a file at any of these?
-		zip_contents = self.zip.namelist()
-		for p in possible_paths:
-			if p in zip_contents:
-				return p
-		# unsucessful
-		return None
-		
-	def read_container_file (self):
-		"""
-		Return the contents of the container file.
-		"""
-		# XXX: it *should* be here. Are there any variants?
-		# TODO: need to cope with failure?
-		return self.zip.read ('META-INF/container.xml')
-		
-	def contents_path_from_container (self):
-		"""
-		Return the location of the TOC file as given in the container file.
-		
-		:Returns:
-			A path within the zip, or `None` if not found.
-			
-		"""
-		# TODO: can we cope with namespace variants (but synonyms)?
-		# XXX: are there any actual variants?
-		container_text = self.read_container_file()
-		if container_text:
-			container_tree = et.fromstring(container_text)
-			ns = "urn:oasis:names:tc:opendocument:xmlns:container"
-			rootfile = container_tree.find("{%s}rootfiles/{%s}rootfile" % (ns, ns))
-			if rootfile != None:
-				return rootfile.attrib.get("full-path", None)
-		return None
-		
-		
-		
-class PdfMetaReader (object):
-	def __init__ (self, path):
-		from pyPdf import PdfFileReader
-		self.doc = PdfFileReader(open(p, 'rb'))
-		
-	def get_metadata (self):
-		return self.rdr.documentInfo, self.rdr.xmpMetadata
-		
-		
-### MAIN ###
-
-def parse_args():
-	import sys
-	args = sys.argv[1:]
-	if len (args) <= 1:
-		optparser.error ('Need at least a command and one input file')
-	
-	# grab and process command argument
-	cmd_vocab = VocabProcessor()
-	cmd_vocab.add_member ('rename')
-	cmd_vocab.add_member ('info', ['list'])
-	raw_cmd = args[0]
-	cmd = cmd_vocab[raw_cmd]
-	if cmd is None:
-		optparser.error ("unrecognised command '%s'" % raw_cmd)	
-	
-	# Construct the option parser.
-	usage = '%prog COMMAND [OPTIONS] INFILE [INFILE ...]'
-	version = "version %s" %  __version__
-	#epilog='Input and output format is currenlty limited to FASTA.'
-
-	optparser = OptionParser (usage=usage, version=version, epilog=epilog)
-	
-	optparser.add_option ('--rename-template-str',
-		dest="rename_template_str",
-		action='store',
-		default=DEFAULT_TMPL,
-		metavar='STR',
-		help="A string giving a Cheetah template for renaming files",
-	)
-	
-	optparser.add_option ('--rename-template-file',
-		dest="rename_template_str",
-		action='store',
-		default=None,
-		metavar='FILE',
-		help="A file containing a Cheetah template for renaming files",
-	)
-	
-	optparser.add_option ('--rename-copy',
-		dest="rename_copy",
-		action='store_true',
-		default=False,
-		help="Rename a copy of the input file?",
-	)
-	
-	optparser.add_option ('--dryrun',
-		dest="dryrun",
-		action='store_true',
-		default=False,
-		help="Do not modify input files, only list modifications",
-	)
-	
-	optparser.add_option ('--unknown-field',
-		dest="unknown_field",
-		action='store',
-		default='unknown',
-		metavar='STR',
-		help="A value passed to the template to use for fields without metadata",
-	)
-	
-	options, pargs = optparser.parse_args (args[1:])
-	
-	## Postconditions & return:
-	return cmd, infiles, options
-
-
-def main():
-	cmd, infiles, options = parse_args()
-	
-	if cmd == 'rename':
-		if options.rename_template_file:
-			tmpl_hndl = open (options.rename_template_file, 'rb')
-			options.rename_template_str = tmpl_hndl.read()
-			tmpl_hndl.close()
-		from Cheetah.Template import Template
-	
-	for p in in_files:
-		print "* Reading '%s' ..." % p
-		rdr = EpubMetaReader (p)
-		md = rdr.get_metadata()
-		
-		if op in ['info', 'list']:
-			# dump metadata to screen
-			buf = StringIO()
-			buf.write (u"----\n" % p)
-			buf.write (u"- path: %s\n" % p)
-			for k, v in md.iteritems():
-				buf.write (u"- %s:" % k)
-				if type(v) == types.ListType:
-					buf.write (u"\n")
-					for x in v:
-						buf.write (u"\t- %s" % x)
-						att_str = ', '.join(["%s: '%s'" % (a, b) for a, b in x.attribs.iteritems()])
-						if att_str:
-							buf.write (u" (%s)\n" % att_str)
-						else:
-							buf.write (u"\n")
-				else:
-					buf.write (u" %s" % v)
-					x = v
-					att_str = ', '.join(["%s='%s'" % (a, b) for a, b in x.attribs.iteritems()])
-					if att_str:
-						buf.write (u" (%s)\n" % att_str)
-					else:
-						buf.write (u"\n")
-			buf.write (u"\n")
-			print (buf.getvalue().encode ('ascii', 'replace'))
-		elif op in ['raw']:
-			print str(md)
-		elif op in ['rename']:
-			rename_file (p, md)
-
-
-	
-	
-if __name__ == '__main__':
-	main()
-	
-	
-### END #######################################################################
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Listing ebook metadata and perhaps renaming the book appropriately.
+
+This script should be called::
+
+	python sniff_metadata.py [info|list|raw|rename|...] [OPTIONS] book1.epub book2.epub ...
+
+Due to some variations in the way metadata is actually written, this script
+does a a bit of searching and cleaning up to best extract book information. If
+the "list" command is used, this metadata is dumped to the screen. If "rename"
+is used, the original file is renamed in the format::
+
+	<first author surname> (<publication year>) <short title> (isbn<isbn>).epub
+
+Directories are searched for ebooks, which may be of mixed formats: the format
+of each is recognised from its contents rather than its extension. Books may be
+read in several processes at once with the ``--jobs`` option,
+although output is always in the order the books were given.
+
+Renaming is planned in full before any book is touched: each book is renamed
+within its own directory, clashing names are numbered and the plan is written
+to a ``--journal``. With ``--dryrun`` the plan is only listed, and with
+``--rename-copy`` books are cloned or hard-linked under their new names. An
+interrupted rename can be finished with the "resume" command or undone with
+"rollback".
+
+The "dupes" command reports books that share an ISBN, comparing ISBN-10s and
+ISBN-13s alike. The "dedupe" command instead finds books that are copies of
+each other by their contents, including epubs that differ only in how they
+were zipped, while reading as little of each as it can.
+
+The "serve" command runs a long-lived server (see `biblio.sniffmetadata.server`)
+that reads books on request, over HTTP on ``--listen`` or a Unix ``--socket``,
+so that the cost of starting up is only paid once.
+
+With ``--profile``, the time taken by each phase of the work (opening books,
+parsing, rendering names, etc.) and counts of the data read are reported at
+the end of the run.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+__version__ = '0.1'
+
+
+### IMPORTS
+
+from optparse import OptionParser
+from StringIO import StringIO
+import os
+import sys
+
+# what only some commands need is imported where it is used, so that short
+# runs do not pay for it
+from biblio.sniffmetadata.batch import scan_paths
+from biblio.sniffmetadata.defaults import DEFAULT_MAX_ENTRIES, EXPORT_FORMATS, \
+	DEFAULT_JOURNAL, DEFAULT_TMPL, DEFAULT_CACHE_DIR
+from biblio.sniffmetadata.instrument import Profiler, set_profiler
+
+
+### CONSTANTS & DEFINES
+
+CMD_SYNONYMS = {
+	'dedupe': [],
+	'dupes': ['duplicates'],
+	'export': [],
+	'index': [],
+	'info': ['list'],
+	'raw': [],
+	'rename': [],
+	'resume': [],
+	'rollback': ['undo'],
+	'serve': ['server'],
+}
+
+
+### IMPLEMENTATION ###
+
+class VocabProcessor (object):
+	"""
+	Transforms commands and vocabularies to a standard form.
+	"""
+	def __init__ (self, syn_dict={}, **kwargs):
+		self._content = {}
+		for k, v in syn_dict.iteritems():
+			self.add_member (k, v)
+
+	def add_member (self, item, synonyms=[], value=None):
+		item = item.strip().lower()
+		assert (item not in self._content.keys()), "vocab item '%s' is a duplicate" % item
+		if value is None:
+			value = item
+		self._content[item] = value
+		for s in synonyms:
+			assert (s not in self._content.keys()), "vocab item '%s' is a duplicate" % s
+			self._content[s] = value
+
+	def __getitem__ (self, item):
+		return self._content[item.strip().lower()]
+
+	def get (self, item, default=None):
+		return self._content.get (item.strip().lower(), default)
+
+
+def expand_paths (paths):
+	"""
+	Yield the given paths, replacing any directories with the ebooks within.
+	"""
+	for p in paths:
+		if os.path.isdir (p):
+			from biblio.sniffmetadata.index import walk_library
+			for book_path, st in walk_library ([p]):
+				yield book_path
+		else:
+			yield p
+
+
+def format_info (p, md):
+	"""
+	Return a human-readable listing of an ebook's metadata.
+
+	Fields and attributes are sorted, so the listing does not depend on how
+	the metadata was read or passed between processes.
+	"""
+	buf = StringIO()
+	buf.write (u"----\n")
+	buf.write (u"- path: %s\n" % p)
+	for k, v in sorted (md.iteritems()):
+		buf.write (u"- %s:" % k)
+		buf.write (u"\n")
+		for x in v:
+			buf.write (u"\t- %s" % x.value)
+			att_str = ', '.join(["%s: '%s'" % (a, b) for a, b in
+				sorted (x.attribs.iteritems())])
+			if att_str:
+				buf.write (u" (%s)\n" % att_str)
+			else:
+				buf.write (u"\n")
+	buf.write (u"\n")
+	return buf.getvalue()
+
+
+### MAIN ###
+
+def parse_args():
+	# Construct the option parser.
+	usage = '%prog COMMAND [OPTIONS] INFILE [INFILE ...]'
+	version = "version %s" %  __version__
+	epilog = 'Commands are: %s.' % ', '.join (sorted (CMD_SYNONYMS.keys()))
+
+	optparser = OptionParser (usage=usage, version=version, epilog=epilog)
+
+	optparser.add_option ('--rename-template-str',
+		dest="rename_template_str",
+		action='store',
+		default=DEFAULT_TMPL,
+		metavar='STR',
+		help="A string giving a Cheetah template for renaming files",
+	)
+
+	optparser.add_option ('--rename-template-file',
+		dest="rename_template_file",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="A file containing a Cheetah template for renaming files",
+	)
+
+	optparser.add_option ('--template-cache',
+		dest="template_cache",
+		action='store',
+		default=DEFAULT_CACHE_DIR,
+		metavar='DIR',
+		help="Where to keep compiled rename templates",
+	)
+
+	optparser.add_option ('--rename-copy',
+		dest="rename_copy",
+		action='store_true',
+		default=False,
+		help="Rename a copy of the input file?",
+	)
+
+	optparser.add_option ('--dryrun',
+		dest="dryrun",
+		action='store_true',
+		default=False,
+		help="Do not modify input files, only list modifications",
+	)
+
+	optparser.add_option ('--journal',
+		dest="journal",
+		action='store',
+		default=DEFAULT_JOURNAL,
+		metavar='FILE',
+		help="Where to record renames, so they can be resumed or rolled back",
+	)
+
+	optparser.add_option ('--unknown-field',
+		dest="unknown_field",
+		action='store',
+		default='unknown',
+		metavar='STR',
+		help="A value passed to the template to use for fields without metadata",
+	)
+
+	optparser.add_option ('--jobs', '-j',
+		dest="jobs",
+		action='store',
+		type='int',
+		default=1,
+		metavar='N',
+		help="Read books in N processes at once",
+	)
+
+	optparser.add_option ('--prefetch',
+		dest="prefetch",
+		action='store',
+		type='int',
+		default=0,
+		metavar='N',
+		help="Prefetch up to N books in the background, for slow or network storage",
+	)
+
+	optparser.add_option ('--cache',
+		dest="cache",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="Keep metadata in this file, so unchanged books are not re-read",
+	)
+
+	optparser.add_option ('--cache-hash',
+		dest="cache_hash",
+		action='store_true',
+		default=False,
+		help="Check cached books by content as well as size & modification time",
+	)
+
+	optparser.add_option ('--cache-size',
+		dest="cache_size",
+		action='store',
+		type='int',
+		default=DEFAULT_MAX_ENTRIES,
+		metavar='N',
+		help="The most books to keep in the cache",
+	)
+
+	optparser.add_option ('--export-format',
+		dest="export_format",
+		action='store',
+		type='choice',
+		choices=EXPORT_FORMATS,
+		default='columnar',
+		metavar='FORMAT',
+		help="The format for the export command: %s" % ', '.join (EXPORT_FORMATS),
+	)
+
+	optparser.add_option ('--export-file',
+		dest="export_file",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="Where the export command writes to (standard output if not given)",
+	)
+
+	optparser.add_option ('--index',
+		dest="index",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="The library index to update, for the index & dupes commands",
+	)
+
+	optparser.add_option ('--profile',
+		dest="profile",
+		action='store_true',
+		default=False,
+		help="Report the time taken by each phase of the work",
+	)
+
+	optparser.add_option ('--profile-json',
+		dest="profile_json",
+		action='store',
+		default=None,
+		metavar='FILE',
+		help="Save the profile to this file as JSON",
+	)
+
+	optparser.add_option ('--listen',
+		dest="listen",
+		action='store',
+		default='127.0.0.1:8765',
+		metavar='HOST:PORT',
+		help="Where the serve command listens",
+	)
+
+	optparser.add_option ('--socket',
+		dest="socket",
+		action='store',
+		default=None,
+		metavar='PATH',
+		help="A Unix socket for the serve command to listen on instead",
+	)
+
+	optparser.add_option ('--batch-size',
+		dest="batch_size",
+		action='store',
+		type='int',
+		default=32,
+		metavar='N',
+		help="The most books the serve command hands to its workers at once",
+	)
+
+	args = sys.argv[1:]
+	if not args:
+		optparser.error ('Need at least a command and one input file')
+
+	# grab and process command argument
+	cmd_vocab = VocabProcessor (CMD_SYNONYMS)
+	raw_cmd = args[0]
+	cmd = cmd_vocab.get (raw_cmd)
+	if cmd is None:
+		optparser.error ("unrecognised command '%s'" % raw_cmd)
+
+	options, infiles = optparser.parse_args (args[1:])
+	if (cmd == 'serve'):
+		if infiles:
+			optparser.error ('the serve command takes no input files')
+		host, sep, port = options.listen.rpartition (':')
+		if not (sep and port.isdigit()):
+			optparser.error ("--listen must be in the form HOST:PORT")
+		options.listen = (host or '127.0.0.1', int (port))
+		if options.batch_size < 1:
+			optparser.error ('--batch-size must be at least 1')
+	elif cmd in ['resume', 'rollback']:
+		if infiles:
+			optparser.error ('the %s command takes no input files' % cmd)
+		if not os.path.exists (options.journal):
+			optparser.error ("no journal found at '%s'" % options.journal)
+	elif not infiles:
+		optparser.error ('Need at least one input file')
+	if options.jobs < 1:
+		optparser.error ('--jobs must be at least 1')
+	if options.prefetch and ((1 < options.jobs) or options.cache):
+		optparser.error ('--prefetch cannot be used with --jobs or --cache')
+
+	if (cmd == 'index') and not options.index:
+		optparser.error ('the index command needs --index')
+	if (cmd == 'export') and (options.export_format == 'columnar') and \
+			not options.export_file:
+		optparser.error ('columnar exports need --export-file')
+
+	## Postconditions & return:
+	return cmd, infiles, options
+
+
+def update_index (roots, options):
+	"""
+	Bring a library index up to date with the given directories.
+	"""
+	from biblio.sniffmetadata.index import LibraryIndex
+	idx = LibraryIndex (options.index)
+	try:
+		changes = idx.update (roots, jobs=options.jobs)
+		for p, err in changes.errors:
+			print >> sys.stderr, "! Error reading '%s': %s" % (p, err)
+		print "* %s books indexed: %s added, %s modified, %s moved, %s deleted" % (
+			len (idx), len (changes.added), len (changes.modified),
+			len (changes.moved), len (changes.deleted))
+	finally:
+		idx.close()
+	return changes.errors and 1 or 0
+
+
+def print_duplicates (dupes):
+	"""
+	List groups of books that share an ISBN.
+	"""
+	for isbn, paths in dupes:
+		print "* ISBN %s:" % isbn
+		for p in paths:
+			print "\t- %s" % p
+	print "* %s ISBNs shared by more than one book" % len (dupes)
+
+
+def print_duplicate_files (dupes):
+	"""
+	List sets of books that are copies of each other.
+	"""
+	# identical files may also be listed within a set of the same content, so
+	# count each book once, keeping one of each group of overlapping sets
+	keep = {}
+	for d in dupes:
+		print "* %s (%s books):" % (d.kind.capitalize(), len (d.paths))
+		for p in d.paths:
+			print "\t- %s" % p
+		kept = [keep[p] for p in d.paths if p in keep]
+		kept = kept and kept[0] or d.paths[0]
+		for p in d.paths:
+			keep.setdefault (p, kept)
+	print "* %s sets of copies, %s books that could be removed" % (len (dupes),
+		len (keep) - len (set (keep.values())))
+
+
+def write_profile (stats, options):
+	"""
+	Save the profile of a run, a hook for the profiler.
+	"""
+	import json
+	hndl = open (options.profile_json, 'wb')
+	try:
+		json.dump (stats, hndl, indent=1, sort_keys=True)
+	finally:
+		hndl.close()
+
+
+def main():
+	cmd, infiles, options = parse_args()
+
+	prof = None
+	if options.profile or options.profile_json:
+		hooks = []
+		if options.profile_json:
+			hooks.append (lambda stats: write_profile (stats, options))
+		prof = Profiler (hooks=hooks)
+		set_profiler (prof)
+	try:
+		return run_command (cmd, infiles, options)
+	finally:
+		if prof is not None:
+			if options.profile:
+				print >> sys.stderr, prof.report()
+			prof.emit()
+
+
+def serve (options):
+	"""
+	Run a metadata server until interrupted.
+	"""
+	import socket
+	from biblio.sniffmetadata.server import make_server, close_server
+	host, port = options.listen
+	try:
+		server = make_server (host, port, socket_path=options.socket,
+			jobs=options.jobs, batch_size=options.batch_size)
+	except socket.error, err:
+		print >> sys.stderr, "! Cannot serve: %s" % err
+		return 1
+	print >> sys.stderr, "* Serving on %s ..." % (options.socket or
+		'%s:%s' % options.listen)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		close_server (server)
+	return 0
+
+
+def report_renames (results):
+	"""
+	Summarise the outcome of renaming, returning the number of errors.
+	"""
+	for op, msg in results['errors']:
+		print >> sys.stderr, "! Error renaming '%s': %s" % (op.src, msg)
+	counts = [(k, v) for k, v in sorted (results.items()) if k != 'errors']
+	print "* %s books renamed (%s), %s errors" % (sum ([v for k, v in counts]),
+		', '.join (['%s: %s' % x for x in counts]) or 'none',
+		len (results['errors']))
+	return len (results['errors'])
+
+
+def rename_books (books, options):
+	"""
+	Plan and carry out (or just list) renames of (path, new name) pairs.
+	"""
+	from biblio.sniffmetadata import rename
+	ops = rename.plan_renames (books, copy=options.rename_copy)
+	if options.dryrun:
+		for op in ops:
+			print "%s '%s' -> '%s'" % (op.action, op.src, op.dest)
+		print "* %s books would be renamed (dry run)" % len (ops)
+		return 0
+	journal = rename.RenameJournal (options.journal)
+	try:
+		journal.start (ops)
+		for op in ops:
+			print "%s '%s' -> '%s'" % (op.action, op.src, op.dest)
+		return report_renames (rename.apply_plan (ops, journal))
+	except rename.RenameError, err:
+		print >> sys.stderr, "! Error renaming: %s" % err
+		return 1
+	finally:
+		journal.close()
+
+
+def run_command (cmd, infiles, options):
+	if cmd == 'serve':
+		return serve (options)
+
+	if cmd == 'resume':
+		from biblio.sniffmetadata.rename import resume, RenameError
+		try:
+			return report_renames (resume (options.journal)) and 1 or 0
+		except RenameError, err:
+			print >> sys.stderr, "! Error resuming: %s" % err
+			return 1
+
+	if cmd == 'rollback':
+		from biblio.sniffmetadata.rename import rollback, RenameError
+		try:
+			results = rollback (options.journal)
+		except RenameError, err:
+			print >> sys.stderr, "! Error rolling back: %s" % err
+			return 1
+		for op, msg in results['errors']:
+			print >> sys.stderr, "! Error restoring '%s': %s" % (op.src, msg)
+		print "* %s renames undone, %s errors" % (results['undone'],
+			len (results['errors']))
+		return results['errors'] and 1 or 0
+
+	if cmd == 'index':
+		return update_index (infiles, options)
+
+	if cmd == 'dedupe':
+		from biblio.sniffmetadata.dedupe import find_duplicate_files
+		print_duplicate_files (find_duplicate_files (expand_paths (infiles)))
+		return 0
+
+	if (cmd == 'dupes') and options.index:
+		# bring the index up to date & let it find them
+		from biblio.sniffmetadata.index import LibraryIndex
+		errors = update_index (infiles, options)
+		idx = LibraryIndex (options.index)
+		try:
+			print_duplicates (idx.find_duplicates())
+		finally:
+			idx.close()
+		return errors
+
+	if cmd == 'rename':
+		if options.rename_template_file:
+			tmpl_hndl = open (options.rename_template_file, 'rb')
+			options.rename_template_str = tmpl_hndl.read()
+			tmpl_hndl.close()
+		# compile the template once, up front
+		from biblio.sniffmetadata.templates import TemplateRenderer
+		renderer = TemplateRenderer (options.rename_template_str,
+			unknown=options.unknown_field, cache_dir=options.template_cache)
+
+	cache = None
+	if options.cache:
+		from biblio.sniffmetadata.cache import MetadataCache
+		cache = MetadataCache (options.cache, max_entries=options.cache_size,
+			use_hash=options.cache_hash)
+
+	if cmd == 'export':
+		if options.export_file:
+			export_hndl = open (options.export_file, 'wb')
+		else:
+			export_hndl = sys.stdout
+		from biblio.sniffmetadata.export import make_writer
+		writer = make_writer (options.export_format, export_hndl)
+		# keep progress out of the way of the exported data
+		progress = sys.stderr
+	else:
+		progress = sys.stdout
+
+	if options.prefetch:
+		from biblio.sniffmetadata.prefetch import iter_scan
+		results = iter_scan (expand_paths (infiles), inflight=options.prefetch)
+	else:
+		results = scan_paths (expand_paths (infiles), jobs=options.jobs,
+			cache=cache)
+
+	errors = 0
+	books = []
+	try:
+		for res in results:
+			p = res.path
+			print >> progress, "* Reading '%s' ..." % p
+			if res.error:
+				errors += 1
+				print >> sys.stderr, "! Error reading '%s': %s" % (p, res.error)
+				continue
+			md = res.metadata()
+			if md is None:
+				print >> sys.stderr, "! No metadata found in '%s'" % p
+				continue
+
+			if cmd in ['info']:
+				# dump metadata to screen
+				print (format_info (p, md).encode ('ascii', 'replace'))
+			elif cmd in ['raw']:
+				# sorted, as for info
+				print '{%s}' % ', '.join (['%r: %r' % (k, v) for k, v in
+					sorted (md.iteritems())])
+			elif cmd in ['rename']:
+				books.append ((p, renderer.render (md,
+					os.path.splitext (p)[1][1:])))
+			elif cmd in ['export']:
+				writer.add (p, md)
+			elif cmd in ['dupes']:
+				books.append ((p, md))
+		if cmd == 'export':
+			writer.close()
+		elif cmd == 'dupes':
+			from biblio.sniffmetadata.isbn import find_duplicates
+			print_duplicates (find_duplicates (books))
+		elif cmd == 'rename':
+			if rename_books (books, options):
+				errors += 1
+	finally:
+		if (cmd == 'export') and options.export_file:
+			export_hndl.close()
+		if cache is not None:
+			cache.close()
+	return errors and 1 or 0
+
+
+if __name__ == '__main__':
+	sys.exit (main())
+
+
+### END #######################################################################
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+A long-lived server that reads the metadata of ebooks on request.
+
+Starting Python, importing the readers and their dependencies and setting up
+worker processes takes far longer than reading the metadata of a single book.
+Here that is done once, and books are then read on request over HTTP, on
+either a local TCP port or a Unix socket. Requests are:
+
+* ``POST /sniff`` with a JSON body of ``{"paths": [...]}``: read the books at
+  the given paths (as seen by the server).
+* ``POST /sniff?name=book.epub`` with the raw contents of a book as the body.
+* ``GET /status``: counts of requests and books, and the use of file handles.
+
+Each book is returned as a JSON object with its "path" (or name), its Dublin
+Core "metadata" as a dict of element names to lists of values (each with a
+"value" and "attribs") and any "error". Books from concurrent requests are
+gathered into batches for the worker processes, so that a burst of small
+requests makes good use of them.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn, UnixStreamServer
+import errno
+import importlib
+import json
+import os
+import Queue
+import socket
+import stat
+import sys
+import threading
+import time
+import urlparse
+
+from biblio.sniffmetadata.batch import ScanResult, sniff_path, sniff_buffer, \
+	handle_pool, _init_worker
+from biblio.sniffmetadata.export import path_to_unicode
+from biblio.sniffmetadata.readers.registry import default_registry
+
+
+### CONSTANTS & DEFINES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# the most books sent to the workers at once
+DEFAULT_BATCH_SIZE = 32
+
+# how long to wait for more books to fill a batch, in seconds
+DEFAULT_BATCH_WAIT = 0.005
+
+# the largest book that can be sent in a request
+MAX_BODY_BYTES = 256 * 1024 * 1024
+
+
+### IMPLEMENTATION ###
+
+def record_to_json (record):
+	"""
+	Convert a compact metadata record to a JSON-friendly form.
+	"""
+	if record is None:
+		return None
+	return dict ([(k, [{'value': val, 'attribs': att} for val, att in v])
+		for k, v in record.iteritems()])
+
+
+def result_to_json (res):
+	return {
+		'path': path_to_unicode (res.path),
+		'metadata': record_to_json (res.record),
+		'error': res.error,
+	}
+
+
+def _sniff_item (item):
+	# read a single book, given as ('path', path) or ('data', contents, name)
+	if item[0] == 'path':
+		return sniff_path (item[1])
+	return sniff_buffer (item[1], item[2])
+
+
+def _warm_up():
+	# import the readers & what they import lazily, so the first request need
+	# not (the readers being registered by name, to start the scripts quickly)
+	default_registry.readers
+	try:
+		importlib.import_module ('pyPdf')
+	except ImportError:
+		# only needed for PDFs the readers' own parser cannot handle
+		pass
+
+
+def _init_server_worker():
+	_init_worker()
+	_warm_up()
+
+
+class _Request (object):
+	# books waiting to be read for a single request
+	__slots__ = ('items', 'results', 'done')
+
+	def __init__ (self, items):
+		self.items = items
+		self.results = None
+		self.done = threading.Event()
+
+
+class Batcher (object):
+	"""
+	Gathers books from concurrent requests into batches for the workers.
+	"""
+	def __init__ (self, jobs=1, batch_size=DEFAULT_BATCH_SIZE,
+			batch_wait=DEFAULT_BATCH_WAIT):
+		"""
+		C'tor.
+
+		:Parameters:
+			jobs
+				The number of worker processes. If 1 or less, books are read in
+				this process.
+			batch_size
+				The most books to hand to the workers at once.
+			batch_wait
+				How long to wait for more books before handing over a batch that
+				is not full.
+
+		"""
+		self.batch_size = batch_size
+		self.batch_wait = batch_wait
+		self.jobs = jobs
+		self._pool = None
+		# before forking, so that the workers start warm
+		_warm_up()
+		if 1 < jobs:
+			# fork the workers before any threads are started
+			from multiprocessing import Pool
+			self._pool = Pool (jobs, _init_server_worker)
+		self._queue = Queue.Queue()
+		self._thread = threading.Thread (target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def submit (self, items):
+		"""
+		Read a list of books, waiting until done.
+
+		:Parameters:
+			items
+				A list of ('path', path) or ('data', contents, name) tuples.
+
+		:Returns:
+			A list of `ScanResult`, in the same order.
+
+		"""
+		req = _Request (items)
+		self._queue.put (req)
+		req.done.wait()
+		return req.results
+
+	def _next_batch (self):
+		# wait for a request, then gather others until the batch is full or
+		# the wait is over
+		reqs = [self._queue.get()]
+		if reqs[0] is None:
+			return None
+		size = len (reqs[0].items)
+		deadline = time.time() + self.batch_wait
+		while size < self.batch_size:
+			timeout = deadline - time.time()
+			if timeout <= 0:
+				break
+			try:
+				req = self._queue.get (timeout=timeout)
+			except Queue.Empty:
+				break
+			if req is None:
+				# finish this batch, then stop
+				self._queue.put (None)
+				break
+			reqs.append (req)
+			size += len (req.items)
+		return reqs
+
+	def _run (self):
+		while True:
+			reqs = self._next_batch()
+			if reqs is None:
+				return
+			items = [x for r in reqs for x in r.items]
+			try:
+				if self._pool is not None:
+					chunksize = max (1, len (items) // (4 * self.jobs))
+					results = self._pool.map (_sniff_item, items, chunksize)
+				else:
+					results = [_sniff_item (x) for x in items]
+			except Exception, err:
+				# e.g. a worker died, so report it for every book
+				msg = "%s: %s" % (err.__class__.__name__, err)
+				results = [ScanResult (x[-1] if x[0] == 'data' else x[1], None, msg)
+					for x in items]
+			start = 0
+			for r in reqs:
+				r.results = results[start:start + len (r.items)]
+				start += len (r.items)
+				r.done.set()
+
+	def close (self):
+		self._queue.put (None)
+		self._thread.join()
+		if self._pool is not None:
+			self._pool.close()
+			self._pool.join()
+
+
+class SniffRequestHandler (BaseHTTPRequestHandler):
+	"""
+	Answers requests for the metadata of books.
+	"""
+	server_version = 'SniffMetadata/0.1'
+
+	def address_string (self):
+		# Unix sockets have no client address
+		if isinstance (self.client_address, tuple):
+			return self.client_address[0]
+		return 'local'
+
+	def log_message (self, format, *args):
+		# as the base class, but it looks up the client address directly
+		if not self.server.quiet:
+			sys.stderr.write ("%s - - [%s] %s\n" % (self.address_string(),
+				self.log_date_time_string(), format % args))
+
+	def _send_json (self, code, obj):
+		try:
+			body = json.dumps (obj)
+		except (TypeError, ValueError), err:
+			# e.g. metadata in an encoding other than UTF-8
+			code = 500
+			body = json.dumps ({'error': "cannot encode response: %s" % err})
+		self.send_response (code)
+		self.send_header ('Content-Type', 'application/json')
+		self.send_header ('Content-Length', str (len (body)))
+		self.end_headers()
+		self.wfile.write (body)
+
+	def _error (self, code, msg):
+		self._send_json (code, {'error': msg})
+
+	def do_GET (self):
+		if urlparse.urlparse (self.path).path != '/status':
+			return self._error (404, "no such resource")
+		status = dict (self.server.stats)
+		status['handles'] = handle_pool.stats()
+		self._send_json (200, status)
+
+	def do_POST (self):
+		url = urlparse.urlparse (self.path)
+		if url.path != '/sniff':
+			return self._error (404, "no such resource")
+		length = self.headers.get ('Content-Length')
+		if length is None:
+			return self._error (411, "a content length is required")
+		try:
+			length = int (length)
+			if length < 0:
+				raise ValueError ("negative length")
+		except ValueError:
+			return self._error (400, "bad content length")
+		if MAX_BODY_BYTES < length:
+			return self._error (413, "request too large")
+		body = self.rfile.read (length)
+		ctype = self.headers.get ('Content-Type', '').split (';')[0].strip()
+		if ctype == 'application/json':
+			try:
+				paths = json.loads (body)['paths']
+				if not isinstance (paths, list):
+					raise ValueError ("paths must be a list")
+			except (ValueError, KeyError, TypeError), err:
+				return self._error (400, "bad request: %s" % err)
+			items = [('path', p) for p in paths]
+		else:
+			name = urlparse.parse_qs (url.query).get ('name', [None])[0]
+			items = [('data', body, name)]
+		results = self.server.batcher.submit (items)
+		self.server.count (len (items))
+		self._send_json (200,
+			{'results': [result_to_json (r) for r in results]})
+
+
+class _ServerMixin (ThreadingMixIn):
+	# what is common to the TCP & Unix socket servers
+	daemon_threads = True
+	quiet = False
+
+	def setup_sniffing (self, batcher):
+		self.batcher = batcher
+		self.stats = {'requests': 0, 'books': 0, 'started': time.time()}
+		self._stats_lock = threading.Lock()
+
+	def count (self, books):
+		with self._stats_lock:
+			self.stats['requests'] += 1
+			self.stats['books'] += books
+
+
+class SniffHTTPServer (_ServerMixin, HTTPServer):
+	"""
+	Serves metadata over HTTP on a TCP port.
+	"""
+	allow_reuse_address = True
+
+
+def _remove_socket (path):
+	# delete a Unix socket, refusing to touch anything else at the path
+	try:
+		st = os.lstat (path)
+	except OSError:
+		return
+	if not stat.S_ISSOCK (st.st_mode):
+		raise socket.error (errno.EEXIST, "'%s' exists and is not a socket" %
+			path)
+	os.unlink (path)
+
+
+class SniffUnixServer (_ServerMixin, UnixStreamServer):
+	"""
+	Serves metadata over HTTP on a Unix socket.
+	"""
+	def server_bind (self):
+		# clear out a socket left behind by an earlier server
+		_remove_socket (self.server_address)
+		UnixStreamServer.server_bind (self)
+		self.server_name = 'localhost'
+		self.server_port = 0
+
+
+def make_server (host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None,
+		jobs=1, batch_size=DEFAULT_BATCH_SIZE, batch_wait=DEFAULT_BATCH_WAIT,
+		quiet=False):
+	"""
+	Create a server, ready to be run with `serve_forever`.
+
+	:Parameters:
+		host, port
+			The address to listen on, if no `socket_path` is given.
+		socket_path
+			A Unix socket to listen on instead.
+		jobs, batch_size, batch_wait
+			As for `Batcher`.
+		quiet
+			If true, requests are not logged.
+
+	"""
+	# the workers must be started before any threads
+	batcher = Batcher (jobs, batch_size, batch_wait)
+	try:
+		if socket_path:
+			server = SniffUnixServer (socket_path, SniffRequestHandler)
+		else:
+			server = SniffHTTPServer ((host, port), SniffRequestHandler)
+	except:
+		batcher.close()
+		raise
+	server.quiet = quiet
+	server.setup_sniffing (batcher)
+	return server
+
+
+def close_server (server):
+	"""
+	Shut down a server made by `make_server` and its workers.
+	"""
+	server.server_close()
+	server.batcher.close()
+	if isinstance (server, SniffUnixServer):
+		try:
+			_remove_socket (server.server_address)
+		except socket.error:
+			# something else has taken its place since
+			pass
+
+
+### END #######################################################################
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Building new filenames for ebooks from Cheetah templates.
+
+Cheetah compiles each template to Python source, which is expensive. Here a
+template is compiled once and the generated source is kept in an on-disk cache,
+keyed by a hash of the template, so later runs skip compilation altogether. The
+resulting class is then reused to render names for any number of books.
+
+Templates are passed:
+
+* metadata: a `TemplateMetadata` view of the book's metadata
+* unknown: the value to use for missing fields
+* ext: the extension of the book file
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import hashlib
+import imp
+import os
+import re
+import sys
+
+from biblio.sniffmetadata.defaults import DEFAULT_TMPL, DEFAULT_CACHE_DIR
+from biblio.sniffmetadata.instrument import get_profiler
+from biblio.sniffmetadata.utils import first_isbn, publication_year, short_title
+
+
+### CONSTANTS & DEFINES
+
+TMPL_CLASS_NAME = 'RenameTemplate'
+
+UNSAFE_FILENAME_RE = re.compile (r'[\x00/\\]')
+
+
+### IMPLEMENTATION ###
+
+class TemplateName (object):
+	"""
+	A person's name, as presented to templates.
+	"""
+	def __init__ (self, metval):
+		self.value = metval.value
+		file_as = metval.attribs.get ('file-as', '')
+		if ',' in file_as:
+			family, given = file_as.split (',', 1)
+		else:
+			parts = metval.value.strip().rsplit (' ', 1)
+			family, given = parts[-1], (parts[:-1] or [''])[0]
+		self.family = family.strip()
+		self.given = given.strip()
+
+	def __str__ (self):
+		return self.value
+
+
+class TemplateValue (object):
+	"""
+	A simple value, as presented to templates.
+	"""
+	def __init__ (self, value):
+		self.value = value
+
+	def __str__ (self):
+		return self.value
+
+
+class TemplateDate (object):
+	"""
+	A date, as presented to templates.
+	"""
+	def __init__ (self, year):
+		self.year = year
+
+
+class TemplateMetadata (object):
+	"""
+	A simplified view of a book's metadata for use in templates.
+
+	Unlike `MetadataDict`, everything is a plain attribute, as Cheetah
+	templates expect.
+	"""
+	def __init__ (self, md):
+		self.authors = [TemplateName (x) for x in md.authors()]
+		self.creators = [TemplateName (x) for x in md.creators()]
+		year = publication_year (md)
+		self.publication = year and TemplateDate (year) or None
+		self.short_title = short_title (md)
+		titles = md.get ('title', [])
+		self.title = titles and titles[0].value or None
+		isbn = first_isbn (md)
+		self.isbn = isbn and [TemplateValue (isbn)] or []
+		self.publishers = [x.value for x in md.get ('publisher', [])]
+		self.languages = [x.value for x in md.get ('language', [])]
+
+
+def template_key (source):
+	"""
+	Return the cache key for a template.
+
+	This covers the versions of Cheetah and Python, as the generated code may
+	differ between them.
+	"""
+	from Cheetah.Version import Version
+	h = hashlib.sha1()
+	h.update (source)
+	h.update ('\0%s\0%s' % (Version, sys.version))
+	return h.hexdigest()
+
+
+def compile_template (source, cache_dir=DEFAULT_CACHE_DIR):
+	"""
+	Return a Cheetah template class for the given source.
+
+	:Parameters:
+		source
+			The template text.
+		cache_dir
+			Where to keep compiled templates. If `None`, nothing is cached.
+
+	"""
+	if isinstance (source, unicode):
+		source = source.encode ('utf8')
+	key = cache_dir and template_key (source)
+	code = None
+	cache_path = None
+	if cache_dir:
+		cache_path = os.path.join (cache_dir, 'tmpl_%s.py' % key)
+		if os.path.exists (cache_path):
+			hndl = open (cache_path, 'rb')
+			try:
+				code = hndl.read()
+			finally:
+				hndl.close()
+	if code is None:
+		from Cheetah.Template import Template
+		code = Template.compile (source=source, returnAClass=False,
+			className=TMPL_CLASS_NAME, moduleName=TMPL_CLASS_NAME)
+		if cache_path:
+			if not os.path.isdir (cache_dir):
+				os.makedirs (cache_dir)
+			# write then move, so a half-written file is never seen
+			tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+			hndl = open (tmp_path, 'wb')
+			try:
+				hndl.write (code)
+			finally:
+				hndl.close()
+			os.rename (tmp_path, cache_path)
+	mod = imp.new_module ('biblio_rename_tmpl_%s' % (key or 'uncached'))
+	exec compile (code, cache_path or '<template>', 'exec') in mod.__dict__
+	# keep the module alive, otherwise its globals are cleared out from under
+	# the class
+	sys.modules[mod.__name__] = mod
+	return getattr (mod, TMPL_CLASS_NAME)
+
+
+def clean_file_name (name):
+	"""
+	Tidy a rendered template into a usable filename.
+
+	Line breaks (which templates are full of) are removed, along with any
+	characters that cannot appear in a filename.
+	"""
+	name = ''.join (name.splitlines())
+	return UNSAFE_FILENAME_RE.sub ('_', name).strip()
+
+
+class TemplateRenderer (object):
+	"""
+	Renders filenames for many books from a single compiled template.
+	"""
+	def __init__ (self, source=DEFAULT_TMPL, unknown='unknown',
+			cache_dir=DEFAULT_CACHE_DIR):
+		self.unknown = unknown
+		self._tmpl_cls = compile_template (source, cache_dir)
+
+	def render (self, md, ext):
+		"""
+		Return a new filename for a book.
+
+		:Parameters:
+			md
+				The `MetadataDict` of the book.
+			ext
+				The extension of the book file.
+
+		"""
+		with get_profiler().phase ('render'):
+			ns = {
+				'metadata': TemplateMetadata (md),
+				'unknown': self.unknown,
+				'ext': ext,
+			}
+			return clean_file_name (unicode (self._tmpl_cls (searchList=[ns])))
+
+	def render_all (self, books):
+		"""
+		Render filenames for a stream of books.
+
+		:Parameters:
+			books
+				An iterable of (path, `MetadataDict`) pairs.
+
+		:Returns:
+			An iterator of (path, new filename) pairs.
+
+		"""
+		for p, md in books:
+			yield p, self.render (md, os.path.splitext (p)[1][1:])
+
+
+### END #######################################################################
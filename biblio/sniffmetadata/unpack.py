@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Unpacking many archives at once with an external tool, like Stuffit.
+
+Each archive is unpacked by running the tool directly as a subprocess, in a
+process group of its own. Up to a given number of these run at once, and any
+that take too long are killed along with everything they started, so a hung
+archive neither stalls the rest nor leaves stray processes behind.
+
+The outcome of each archive (its exit status, how long it took and the tail of
+its output) is produced as soon as it finishes.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+from collections import namedtuple, deque
+import errno
+import multiprocessing
+import os
+import signal
+import subprocess
+import tempfile
+import time
+
+
+### CONSTANTS & DEFINES
+
+DEFAULT_COMMAND = 'stuff'
+
+DEFAULT_TIMEOUT = 30
+
+# how often to check on running jobs
+POLL_INTERVAL = 0.05
+
+# how long a killed job has to exit before it is killed outright
+KILL_GRACE = 2.0
+
+# how much output to keep for reporting failures
+OUTPUT_TAIL_BYTES = 2048
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ERROR = 'error'
+
+
+### IMPLEMENTATION ###
+
+class UnpackResult (namedtuple ('UnpackResult', ['path', 'status', 'returncode',
+		'duration', 'output'])):
+	"""
+	The outcome of unpacking a single archive.
+
+	:Parameters:
+		path
+			The path of the archive as passed in.
+		status
+			One of 'ok', 'failed' (a non-zero exit), 'timeout' or 'error' (the
+			tool could not be run).
+		returncode
+			The exit status of the tool, or `None` if it could not be run.
+		duration
+			How long it ran for, in seconds.
+		output
+			The end of what the tool printed.
+
+	"""
+	__slots__ = ()
+
+
+def stuff_command (path, command=DEFAULT_COMMAND, password=None, delete=False):
+	"""
+	Return the arguments for unpacking an archive with Stuffit.
+	"""
+	args = [command]
+	if password:
+		args.extend (['-p', password])
+	if delete:
+		args.append ('-D')
+	args.append (path)
+	return args
+
+
+def default_jobs():
+	try:
+		return multiprocessing.cpu_count()
+	except NotImplementedError:
+		return 1
+
+
+def _kill_group (proc, sig):
+	try:
+		os.killpg (proc.pid, sig)
+	except OSError, err:
+		# already gone
+		if err.errno != errno.ESRCH:
+			raise
+
+
+def _read_tail (hndl, nbytes=OUTPUT_TAIL_BYTES):
+	hndl.seek (0, os.SEEK_END)
+	hndl.seek (max (0, hndl.tell() - nbytes))
+	return hndl.read()
+
+
+class _RunningJob (object):
+	# a launched tool and what is needed to report on it
+	__slots__ = ('path', 'proc', 'output', 'started', 'deadline', 'killed_at')
+
+	def __init__ (self, path, proc, output, timeout):
+		self.path = path
+		self.proc = proc
+		self.output = output
+		self.started = time.time()
+		self.deadline = timeout and (self.started + timeout) or None
+		self.killed_at = None
+
+
+class UnpackScheduler (object):
+	"""
+	Runs an unpacking tool over many archives, several at a time.
+	"""
+	def __init__ (self, jobs=None, timeout=DEFAULT_TIMEOUT,
+			command=DEFAULT_COMMAND, password=None, delete=False,
+			make_args=stuff_command):
+		"""
+		C'tor.
+
+		:Parameters:
+			jobs
+				How many archives to unpack at once. By default, the number of
+				CPUs.
+			timeout
+				How many seconds an archive may take before its unpacking is
+				killed. If `None` or 0, there is no limit.
+			command, password, delete
+				Passed to `make_args`.
+			make_args
+				A callable that returns the arguments for unpacking an archive.
+
+		"""
+		self.jobs = jobs or default_jobs()
+		self.timeout = timeout
+		self.command = command
+		self.password = password
+		self.delete = delete
+		self.make_args = make_args
+
+	def _launch (self, path, dest_dir=None):
+		arc_path = path
+		if dest_dir is not None:
+			# the tool is run in the destination, so must be given a full path
+			arc_path = os.path.abspath (path)
+			if not os.path.isdir (dest_dir):
+				os.makedirs (dest_dir)
+		args = self.make_args (arc_path, command=self.command,
+			password=self.password, delete=self.delete)
+		output = tempfile.TemporaryFile()
+		devnull = open (os.devnull, 'rb')
+		try:
+			# in its own process group, so that it & its children can be
+			# killed together
+			proc = subprocess.Popen (args, stdin=devnull, stdout=output,
+				stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid,
+				cwd=dest_dir)
+		except OSError, err:
+			output.close()
+			return UnpackResult (path, STATUS_ERROR, None, 0.0, str (err))
+		finally:
+			devnull.close()
+		return _RunningJob (path, proc, output, self.timeout)
+
+	def _check (self, job, now):
+		# return the result of a job if it is finished, killing it if overdue
+		returncode = job.proc.poll()
+		if returncode is None:
+			if job.killed_at is not None:
+				if KILL_GRACE < (now - job.killed_at):
+					_kill_group (job.proc, signal.SIGKILL)
+			elif job.deadline and (job.deadline < now):
+				_kill_group (job.proc, signal.SIGTERM)
+				job.killed_at = now
+			return None
+		# the tool may have left children behind, which may have ignored TERM
+		_kill_group (job.proc, signal.SIGKILL)
+		if job.killed_at is not None:
+			status = STATUS_TIMEOUT
+		elif returncode == 0:
+			status = STATUS_OK
+		else:
+			status = STATUS_FAILED
+		try:
+			output = _read_tail (job.output)
+		finally:
+			job.output.close()
+		return UnpackResult (job.path, status, returncode, now - job.started,
+			output)
+
+	def run (self, paths, dest_for=None):
+		"""
+		Unpack a series of archives.
+
+		:Parameters:
+			paths
+				An iterable of archive paths. This is consumed lazily, as jobs
+				become free.
+			dest_for
+				An optional callable, returning the directory to unpack an
+				archive in. Otherwise the tool is run in the current directory.
+
+		:Returns:
+			An iterator of `UnpackResult`, in the order that archives finish.
+
+		If the iterator is closed early (or the caller is interrupted), any
+		jobs still running are killed.
+		"""
+		pending = iter (paths)
+		running = deque()
+		exhausted = False
+		try:
+			while True:
+				while (not exhausted) and (len (running) < self.jobs):
+					try:
+						p = pending.next()
+					except StopIteration:
+						exhausted = True
+						break
+					job = self._launch (p, dest_for and dest_for (p))
+					if isinstance (job, UnpackResult):
+						yield job
+					else:
+						running.append (job)
+				if not running:
+					return
+				now = time.time()
+				still_running = deque()
+				finished = []
+				for job in running:
+					res = self._check (job, now)
+					if res is None:
+						still_running.append (job)
+					else:
+						finished.append (res)
+				running = still_running
+				for res in finished:
+					yield res
+				if not finished:
+					time.sleep (POLL_INTERVAL)
+		finally:
+			for job in running:
+				_kill_group (job.proc, signal.SIGKILL)
+				job.proc.wait()
+				job.output.close()
+
+
+def summarise_results (results):
+	"""
+	Count the outcomes of a run.
+
+	:Returns:
+		A dict of the number of archives with each status, plus the 'total'
+		and the summed 'duration' of all jobs.
+
+	"""
+	summary = dict ([(s, 0) for s in
+		(STATUS_OK, STATUS_FAILED, STATUS_TIMEOUT, STATUS_ERROR)])
+	summary['total'] = 0
+	summary['duration'] = 0.0
+	for res in results:
+		summary[res.status] += 1
+		summary['total'] += 1
+		summary['duration'] += res.duration
+	return summary
+
+
+### END #######################################################################
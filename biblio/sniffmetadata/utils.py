@@ -1,62 +1,121 @@
-
-
-def rename_file (p, md):
-	# tmpl = <1st author surname> (<year>) <short title> (ISBN<isbn>)
-	UNKNOWN = 'UNKNOWN'
-	
-	# grab the first author or creator
-	auths = md.authors() or md.creators()
-	if auths:
-		# extract their surname
-		first_auth = auths[0]
-		name = first_auth.attribs.get('file-as', '').split(',')[0] \
-			or first_auth.value.split(' ')[-1] \
-			or UNKNOWN
-		
-	# get year
-	pubdate = None
-	dateval = md.publication_date() or md.get('date')
-	if dateval:
-		earliest_date = sorted (dateval, cmp=lambda x, y: cmp (x.value, y.value))[0]
-		m = YEAR_RE.match (earliest_date.value)
-		if m:
-			pubdate = m.group(0)
-	if not pubdate:
-		pubdate = UNKNOWN
-		
-	# get title
-	short_title = None
-	title = md.get('title')
-	if title:
-		short_title = title.value.split(':')[0]
-	else:
-		short_title = UNKNOWN
-	
-	# get isbn
-	isbn = None
-	ids = md.isbn()
-	if ids:
-		isbn = CLEAN_ISBN_RE.sub ('', ids[0].value).upper()
-	else:
-		isbn = UNKNOWN
-		for x in md.identifiers():
-			id_val = CLEAN_ISBN_RE.sub ('', x.value).upper()
-			if len(id_val) in [10, 13]:
-				isbn = id_val
-				break
-	
-	# build name
-	new_file_name = u"%(name)s (%(pubdate)s) %(short_title)s (isbn%(isbn)s).epub" % {
-		'name': name,
-		'pubdate': pubdate,
-		'short_title': short_title,
-		'isbn': isbn,
-	}
-	print new_file_name
-	os.rename (p, new_file_name)
-	
-
-def pretty_print(element):
-	txt = et.tostring(element)
-	return parseString(txt).toprettyxml()
-
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Assorted helpers for processing and acting on ebook metadata.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import re
+
+from biblio.sniffmetadata.dates import earliest_date
+from biblio.sniffmetadata.instrument import get_profiler
+from biblio.sniffmetadata.isbn import is_valid_isbn
+
+
+### CONSTANTS & DEFINES
+
+CLEAN_ISBN_RE = re.compile (r'[\- ]+')
+
+
+### IMPLEMENTATION ###
+
+UNKNOWN = 'UNKNOWN'
+
+
+def first_author_surname (md):
+	"""
+	Return the surname of the first author or creator, or `None`.
+	"""
+	auths = md.authors() or md.creators()
+	if auths:
+		# extract their surname
+		first_auth = auths[0]
+		return first_auth.attribs.get('file-as', '').split(',')[0] \
+			or first_auth.value.split(' ')[-1] \
+			or None
+	return None
+
+
+def publication_year (md):
+	"""
+	Return the year of the earliest publication (or other) date, or `None`.
+	"""
+	dateval = md.publication_date() or md.get('date')
+	if dateval:
+		earliest = earliest_date ([x.value for x in dateval])
+		if earliest is not None:
+			return '%04d' % earliest.year
+	return None
+
+
+def short_title (md):
+	"""
+	Return the first title, shorn of any subtitle, or `None`.
+	"""
+	title = md.get('title')
+	if title:
+		return title[0].value.split(':')[0]
+	return None
+
+
+def first_isbn (md):
+	"""
+	Return the first ISBN (or valid ISBN amongst the identifiers), or `None`.
+	"""
+	ids = md.isbn()
+	if ids:
+		return CLEAN_ISBN_RE.sub ('', ids[0].value).upper()
+	for x in md.identifiers():
+		if is_valid_isbn (x.value):
+			return CLEAN_ISBN_RE.sub ('', x.value).upper()
+	return None
+
+
+def build_file_name (md, ext='epub', unknown=UNKNOWN):
+	"""
+	Return a new name for an ebook, based on its metadata.
+
+	The name is in the form::
+
+		<1st author surname> (<year>) <short title> (isbn<isbn>).<ext>
+
+	with `unknown` used for any missing fields.
+	"""
+	return u"%(name)s (%(pubdate)s) %(short_title)s (isbn%(isbn)s).%(ext)s" % {
+		'name': first_author_surname (md) or unknown,
+		'pubdate': publication_year (md) or unknown,
+		'short_title': short_title (md) or unknown,
+		'isbn': first_isbn (md) or unknown,
+		'ext': ext,
+	}
+
+
+def rename_file (p, md, new_file_name=None):
+	"""
+	Rename a single ebook within its directory, based on its metadata.
+
+	For many books, the planner in `biblio.sniffmetadata.rename` is safer.
+	"""
+	if new_file_name is None:
+		ext = os.path.splitext (p)[1][1:] or 'epub'
+		new_file_name = build_file_name (md, ext)
+	new_path = os.path.join (os.path.dirname (p), new_file_name)
+	print new_path
+	with get_profiler().phase ('rename'):
+		os.rename (p, new_path)
+	
+
+def pretty_print(element):
+	from xml.dom.minidom import parseString
+	from xml.etree import ElementTree as et
+	txt = et.tostring(element)
+	return parseString(txt).toprettyxml()
+
+
+### END #######################################################################
+
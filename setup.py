@@ -18,7 +18,7 @@ setup(
 	author_email='pma@agapow.net',
 	url='http://www.agapow.net/software/biblio-sniffmetadata',
 	license='GPL',
-	packages=find_packages(exclude=['ez_setup']),
+	packages=find_packages(exclude=['ez_setup', 'tests']),
 	namespace_packages=['biblio'],
 	include_package_data=True,
 	zip_safe=False,
@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for biblio.sniffmetadata.
+
+Run them with::
+
+	python -m unittest discover -s tests -t .
+
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### END #######################################################################
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for passing scan results back from workers through shared memory.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from biblio.sniffmetadata import channel
+from biblio.sniffmetadata.batch import ScanResult, scan_paths, scan_in_pool
+from biblio.sniffmetadata.benchmark import make_epub
+from biblio.sniffmetadata.metadata import MetadataDict
+
+
+### CONSTANTS & DEFINES
+
+RECORD = {
+	'title': [(u'A Title: With Subtitle', {})],
+	'creator': [('Some Author', {'role': 'aut', 'file-as': 'Author, Some'}),
+		(u'Anne Autr\xe9', {'role': u'edt', u'x-\xe9': 'odd'})],
+	'identifier': [('978-0-306-40615-7', {'scheme': 'ISBN'})],
+	'x-custom': [('\xff\xfe not UTF-8', {})],
+}
+
+
+### IMPLEMENTATION ###
+
+class TestPacking (unittest.TestCase):
+	def round_trip (self, res):
+		packed = channel.pack_result (res)
+		ring = channel.ResultRing (1024)
+		start, end = ring.write (packed)
+		return channel.read_results (ring, start, end, [res.path])[0]
+
+	def test_record (self):
+		res = self.round_trip (ScanResult ('a.epub', RECORD, None))
+		self.assertEqual (res.path, 'a.epub')
+		self.assertEqual (res.error, None)
+		self.assertEqual (res.record, RECORD)
+		self.assertEqual (res.metadata(), MetadataDict.from_compact (RECORD))
+
+	def test_types_are_kept (self):
+		res = self.round_trip (ScanResult ('a.epub', RECORD, None))
+		for k, vals in res.record.iteritems():
+			for (v, att), (orig_v, orig_att) in zip (vals, RECORD[k]):
+				self.assertEqual (type (v), type (orig_v))
+
+	def test_error_and_none (self):
+		res = self.round_trip (ScanResult ('a.epub', None, 'IOError: gone'))
+		self.assertEqual ((res.record, res.error), (None, 'IOError: gone'))
+		res = self.round_trip (ScanResult ('a.epub', None, None))
+		self.assertEqual ((res.record, res.error, res.metadata()),
+			(None, None, None))
+
+
+class TestResultRing (unittest.TestCase):
+	def test_wraparound (self):
+		ring = channel.ResultRing (10)
+		self.assertEqual (ring.write ('abcdef'), (0, 6))
+		self.assertEqual (ring.read (0, 6), 'abcdef')
+		# crosses the end of the buffer
+		self.assertEqual (ring.write ('ghijklmn'), (6, 14))
+		self.assertEqual (ring.read (6, 14), 'ghijklmn')
+
+	def test_full (self):
+		ring = channel.ResultRing (10)
+		self.assertEqual (ring.write ('abcdef'), (0, 6))
+		# nothing is written until space is freed
+		self.assertEqual (ring.write ('ghijk'), None)
+		self.assertEqual (ring.read (0, 6), 'abcdef')
+		self.assertEqual (ring.write ('ghijk'), (6, 11))
+
+	def test_results_that_do_not_fit (self):
+		ring = channel.ResultRing (16)
+		res = [ScanResult ('a.epub', RECORD, None)]
+		self.assertEqual (channel.write_results (ring, res), None)
+
+
+class TestSharedScan (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.paths = []
+		for i in range (12):
+			p = os.path.join (self.dir, 'book%02d.epub' % i)
+			make_epub (p, title='Title %d' % i, creators=(i % 3) + 1)
+			self.paths.append (p)
+		self.paths.append (os.path.join (self.dir, 'missing.epub'))
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def results (self, rs):
+		return [(r.path, r.record, r.error) for r in rs]
+
+	def test_same_as_pickled (self):
+		expected = self.results (scan_paths (self.paths))
+		shared = list (scan_in_pool (self.paths, 2, chunksize=3, shared=True))
+		self.assertEqual (self.results (shared), expected)
+		self.assertTrue (isinstance (shared[0], channel.PackedScanResult))
+		self.assertEqual (self.results (scan_in_pool (self.paths, 2,
+			chunksize=3)), expected)
+
+	def test_pickled_when_ring_is_full (self):
+		expected = self.results (scan_paths (self.paths))
+		ring_bytes = channel.DEFAULT_RING_BYTES
+		channel.DEFAULT_RING_BYTES = 64
+		try:
+			shared = list (scan_in_pool (self.paths, 2, chunksize=3,
+				shared=True))
+		finally:
+			channel.DEFAULT_RING_BYTES = ring_bytes
+		self.assertEqual (self.results (shared), expected)
+		self.assertFalse ([r for r in shared if
+			isinstance (r, channel.PackedScanResult)])
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
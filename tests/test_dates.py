@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for parsing and comparing dates.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import unittest
+
+from biblio.sniffmetadata import dates
+from biblio.sniffmetadata.dates import ParsedDate
+
+
+### IMPLEMENTATION ###
+
+class TestParsePdfDate (unittest.TestCase):
+	def test_full (self):
+		self.assertEqual (dates.parse_pdf_date ("D:20010203040506+01'30'"),
+			ParsedDate (2001, 2, 3, 4, 5, 6, 90))
+
+	def test_utc_and_negative_zones (self):
+		self.assertEqual (dates.parse_pdf_date ("D:20010203040506Z").tz, 0)
+		self.assertEqual (dates.parse_pdf_date ("D:20010203040506-05'00'").tz,
+			-300)
+
+	def test_partial (self):
+		self.assertEqual (dates.parse_pdf_date ("D:2001"),
+			ParsedDate (2001, None, None, None, None, None, None))
+		self.assertEqual (dates.parse_pdf_date ("200102"),
+			ParsedDate (2001, 2, None, None, None, None, None))
+
+	def test_out_of_range_ends_the_date (self):
+		self.assertEqual (dates.parse_pdf_date ("D:20010000"),
+			ParsedDate (2001, None, None, None, None, None, None))
+
+	def test_zone_without_time_is_dropped (self):
+		self.assertEqual (dates.parse_pdf_date ("D:20010203+01'00'").tz, None)
+
+	def test_junk (self):
+		self.assertEqual (dates.parse_pdf_date ("D:"), None)
+		self.assertEqual (dates.parse_pdf_date ("yesterday"), None)
+
+
+class TestParseIsoDate (unittest.TestCase):
+	def test_full (self):
+		self.assertEqual (dates.parse_iso_date ("2001-02-03T04:05:06.789-02:30"),
+			ParsedDate (2001, 2, 3, 4, 5, 6, -150))
+
+	def test_partial (self):
+		self.assertEqual (dates.parse_iso_date ("2001"),
+			ParsedDate (2001, None, None, None, None, None, None))
+		self.assertEqual (dates.parse_iso_date ("2001-02"),
+			ParsedDate (2001, 2, None, None, None, None, None))
+		self.assertEqual (dates.parse_iso_date ("2001-02-03T04:05Z"),
+			ParsedDate (2001, 2, 3, 4, 5, None, 0))
+
+	def test_bad_month (self):
+		self.assertEqual (dates.parse_iso_date ("2001-13-01"),
+			ParsedDate (2001, None, None, None, None, None, None))
+
+	def test_isoformat (self):
+		for s in ["2001", "2001-02", "2001-02-03", "2001-02-03T04:05:06Z",
+				"2001-02-03T04:05:06+01:30"]:
+			self.assertEqual (dates.parse_date (s).isoformat(), s)
+
+
+class TestSortKeys (unittest.TestCase):
+	def test_key (self):
+		self.assertEqual (dates.date_sort_key ("2001-02-03"), 20010203000000)
+		self.assertEqual (dates.date_sort_key ("D:20010203040506"),
+			20010203040506)
+
+	def test_keys_are_in_ut (self):
+		self.assertEqual (dates.date_sort_key ("2001-02-03T04:05:06+01:00"),
+			dates.date_sort_key ("D:20010203030506Z"))
+		self.assertEqual (dates.date_sort_key ("2001-01-01T00:30+01:00"),
+			20001231233000)
+
+	def test_year_out_of_range (self):
+		# a time zone on a year the calendar cannot handle
+		self.assertEqual (dates.date_sort_key ("D:00000101000000+01'00'"),
+			101000000)
+
+	def test_unparseable (self):
+		self.assertEqual (dates.date_sort_key ("unknown"), None)
+		self.assertEqual (dates.date_sort_key (None), None)
+		self.assertEqual (dates.date_sort_keys (["2001", "x"]),
+			[20010000000000, None])
+
+	def test_earliest (self):
+		self.assertEqual (dates.earliest_date (["2003", "junk",
+			"D:20010203", "2002-01-01"]).isoformat(), "2001-02-03")
+		self.assertEqual (dates.earliest_date (["junk"]), None)
+		self.assertEqual (dates.earliest_date ([]), None)
+
+	def test_cache_is_bounded (self):
+		for i in range (dates.MAX_CACHE_SIZE + 10):
+			dates.parse_date ("D:%04d" % (i % 10000))
+		self.assertTrue (len (dates._cache) <= dates.MAX_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for finding copies of books by their contents.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from biblio.sniffmetadata import dedupe
+from biblio.sniffmetadata.benchmark import make_epub
+
+
+### IMPLEMENTATION ###
+
+def _repack (src, dest):
+	# the same members, zipped differently
+	src_zip = zipfile.ZipFile (src)
+	dest_zip = zipfile.ZipFile (dest, 'w', zipfile.ZIP_STORED)
+	for info in src_zip.infolist():
+		dest_zip.writestr (info.filename, src_zip.read (info.filename))
+	dest_zip.close()
+	src_zip.close()
+
+
+class TestFindDuplicates (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def path (self, name):
+		return os.path.join (self.dir, name)
+
+	def write (self, name, data):
+		hndl = open (self.path (name), 'wb')
+		hndl.write (data)
+		hndl.close()
+		return self.path (name)
+
+	def test_identical_within_same_content (self):
+		make_epub (self.path ('a.epub'))
+		shutil.copy (self.path ('a.epub'), self.path ('b.epub'))
+		_repack (self.path ('a.epub'), self.path ('c.epub'))
+		make_epub (self.path ('other.epub'), title='Another')
+		found = dedupe.find_duplicate_files ([self.path (x) for x in
+			['a.epub', 'b.epub', 'c.epub', 'other.epub']])
+		self.assertEqual (sorted ([(d.kind, d.paths) for d in found]), [
+			(dedupe.IDENTICAL, [self.path ('a.epub'), self.path ('b.epub')]),
+			(dedupe.SAME_CONTENT, [self.path (x) for x in ['a.epub', 'b.epub',
+				'c.epub']]),
+		])
+
+	def test_all_identical (self):
+		make_epub (self.path ('a.epub'))
+		shutil.copy (self.path ('a.epub'), self.path ('b.epub'))
+		found = dedupe.find_duplicate_files ([self.path ('a.epub'),
+			self.path ('b.epub')])
+		self.assertEqual ([d.kind for d in found], [dedupe.IDENTICAL])
+
+	def test_epubs_found_by_contents (self):
+		# misnamed epubs are still compared by their contents
+		make_epub (self.path ('a.bin'))
+		_repack (self.path ('a.bin'), self.path ('b.dat'))
+		found = dedupe.find_duplicate_files ([self.path ('a.bin'),
+			self.path ('b.dat')])
+		self.assertEqual ([d.kind for d in found], [dedupe.SAME_CONTENT])
+
+	def test_plain_files (self):
+		a = self.write ('a.epub', 'not really an epub')
+		b = self.write ('b.pdf', 'not really an epub')
+		c = self.write ('c.txt', 'something else entirely')
+		found = dedupe.find_duplicate_files ([a, b, c, self.path ('gone')])
+		self.assertEqual ([(d.kind, d.paths) for d in found],
+			[(dedupe.IDENTICAL, [a, b])])
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
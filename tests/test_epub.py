@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for reading the metadata of epubs.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from biblio.sniffmetadata.benchmark import make_epub
+from biblio.sniffmetadata.readers.epubmetadatareader import EpubMetaReader
+
+
+### IMPLEMENTATION ###
+
+class TestProbeStats (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join (self.dir, 'a.epub')
+		make_epub (self.path, payload_bytes=100000)
+		zip_file = zipfile.ZipFile (self.path)
+		self.infos = dict ([(i.filename, i) for i in zip_file.infolist()])
+		zip_file.close()
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def test_only_metadata_is_read (self):
+		rdr = EpubMetaReader (self.path)
+		try:
+			md = rdr.read_metadata()
+			stats = dict (rdr.probe_stats)
+		finally:
+			rdr.close()
+		self.assertTrue (md is not None)
+		read = [self.infos['META-INF/container.xml'],
+			self.infos['OEBPS/content.opf']]
+		self.assertEqual (stats['members'], len (self.infos))
+		self.assertEqual (stats['members_read'], 2)
+		self.assertEqual (stats['bytes_compressed'],
+			sum ([i.compress_size for i in read]))
+		# the contents file is streamed, so may not be read to the end
+		self.assertTrue (0 < stats['bytes_uncompressed'] <=
+			sum ([i.file_size for i in read]))
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
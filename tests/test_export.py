@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for exporting book records.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from biblio.sniffmetadata import export
+from biblio.sniffmetadata.metadata import MetadataDict
+
+
+### CONSTANTS & DEFINES
+
+RECORD = {
+	'title': [(u'A Title', {})],
+	'creator': [(u'Anne Autr\xe9', {'role': 'aut'})],
+	'identifier': [('978-0-306-40615-7', {'scheme': 'ISBN'})],
+}
+
+PATHS = ['/books/plain.epub', u'/books/caf\xe9.epub'.encode ('utf8'),
+	'/books/caf\xe9.epub']
+
+
+### IMPLEMENTATION ###
+
+class TestPathToUnicode (unittest.TestCase):
+	def test_paths (self):
+		self.assertEqual (export.path_to_unicode ('/a/b.epub'), u'/a/b.epub')
+		self.assertEqual (export.path_to_unicode (u'/a/\xe9.epub'),
+			u'/a/\xe9.epub')
+		self.assertEqual (export.path_to_unicode ('/a/\xc3\xa9.epub'),
+			u'/a/\xe9.epub')
+
+	def test_not_utf8 (self):
+		path = export.path_to_unicode ('/a/\xff\xfe.epub')
+		self.assertTrue (isinstance (path, unicode))
+		self.assertTrue (path.startswith (u'/a/'))
+		self.assertTrue (path.endswith (u'.epub'))
+
+
+class TestWriters (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.md = MetadataDict.from_compact (RECORD)
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def export (self, fmt):
+		out_path = os.path.join (self.dir, 'out.' + fmt)
+		hndl = open (out_path, 'wb')
+		wrtr = export.make_writer (fmt, hndl)
+		for p in PATHS:
+			wrtr.add (p, self.md)
+		wrtr.close()
+		hndl.close()
+		return out_path
+
+	def test_jsonl (self):
+		recs = [json.loads (l) for l in open (self.export ('jsonl'))]
+		self.assertEqual ([r['path'] for r in recs][:2],
+			[u'/books/plain.epub', u'/books/caf\xe9.epub'])
+		self.assertEqual (len (recs), len (PATHS))
+		self.assertEqual (recs[0]['author'], u'Anne Autr\xe9')
+
+	def test_columnar (self):
+		cols = export.read_columnar (self.export ('columnar'))
+		self.assertEqual (cols['path'][:2],
+			[u'/books/plain.epub', u'/books/caf\xe9.epub'])
+		self.assertEqual (len (cols['path']), len (PATHS))
+		self.assertEqual (cols['title'], [u'A Title'] * len (PATHS))
+
+	def test_csv (self):
+		lines = open (self.export ('csv')).read().splitlines()
+		self.assertEqual (len (lines), len (PATHS) + 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
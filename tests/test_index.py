@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for keeping and searching an index of a library.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from biblio.sniffmetadata import index
+from biblio.sniffmetadata.benchmark import make_epub
+
+
+### IMPLEMENTATION ###
+
+class TestLikeEscape (unittest.TestCase):
+	def test_escape (self):
+		self.assertEqual (index.like_escape ('plain'), 'plain')
+		self.assertEqual (index.like_escape ('100%_a\\b'), '100\\%\\_a\\\\b')
+
+
+class TestLibraryIndex (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.idx = index.LibraryIndex (':memory:')
+
+	def tearDown (self):
+		self.idx.close()
+		shutil.rmtree (self.dir)
+
+	def book (self, rel_path, **kwargs):
+		p = os.path.join (self.dir, rel_path)
+		if not os.path.isdir (os.path.dirname (p)):
+			os.makedirs (os.path.dirname (p))
+		make_epub (p, **kwargs)
+		return p
+
+	def test_update_only_looks_under_roots (self):
+		# wildcards in a root must not match its siblings
+		a = self.book ('a_b/one.epub')
+		b = self.book ('axb/two.epub', title='Two')
+		c = self.book ('a%/three.epub', title='Three')
+		self.idx.update ([self.dir])
+		self.assertEqual (len (self.idx), 3)
+		os.remove (b)
+		os.remove (c)
+		changes = self.idx.update ([os.path.join (self.dir, 'a_b'),
+			os.path.join (self.dir, 'a%')])
+		self.assertEqual (changes.deleted, [c])
+		self.assertTrue (self.idx.get (b) is not None)
+		self.assertTrue (self.idx.get (a) is not None)
+
+	def test_update_is_incremental (self):
+		self.book ('one.epub')
+		changes = self.idx.update ([self.dir])
+		self.assertEqual (len (changes.added), 1)
+		changes = self.idx.update ([self.dir])
+		self.assertEqual (changes.added + changes.modified + changes.deleted, [])
+
+	def test_find_by_author_wildcards (self):
+		self.book ('one.epub')
+		self.assertEqual (len (self.idx.find_by_author ('author')), 0)
+		self.idx.update ([self.dir])
+		self.assertEqual (len (self.idx.find_by_author ('AUTHOR')), 1)
+		self.assertEqual (self.idx.find_by_author ('%'), [])
+		self.assertEqual (self.idx.find_by_author ('_'), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for normalizing, validating and comparing ISBNs.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import random
+import unittest
+
+from biblio.sniffmetadata import isbn
+from biblio.sniffmetadata.metadata import MetadataDict
+
+
+### CONSTANTS & DEFINES
+
+# identifiers & their canonical ISBN-13s
+EXAMPLES = [
+	('978-0-306-40615-7', '9780306406157'),
+	('urn:isbn:9780306406157', '9780306406157'),
+	('ISBN-13: 978 0 306 40615 7', '9780306406157'),
+	(u'978‐0‐306‐40615‐7', '9780306406157'),
+	('0-306-40615-2', '9780306406157'),
+	('isbn:0306406152', '9780306406157'),
+	('0-8044-2957-X', '9780804429573'),
+	('080442957x', '9780804429573'),
+	# wrong check digits
+	('978-0-306-40615-8', None),
+	('0-306-40615-3', None),
+	# 'X' only ends an ISBN-10
+	('08044X9573', None),
+	('978080442957X', None),
+	# wrong lengths & junk
+	('97803064061', None),
+	('', None),
+	('urn:uuid:12345678-1234-1234-1234-123456789abc', None),
+	(u'٩780306406157', None),
+	(u'978030640615\xe9', None),
+]
+
+
+### IMPLEMENTATION ###
+
+class TestSingleIsbns (unittest.TestCase):
+	def test_clean (self):
+		self.assertEqual (isbn.clean_isbn ('urn:ISBN:0-8044-2957-x'),
+			'080442957X')
+		self.assertEqual (isbn.clean_isbn (' ISBN 978 0 306 40615 7'),
+			'9780306406157')
+
+	def test_check_digits (self):
+		self.assertEqual (isbn.isbn10_check_digit ('030640615'), '2')
+		self.assertEqual (isbn.isbn10_check_digit ('080442957'), 'X')
+		self.assertEqual (isbn.isbn13_check_digit ('978030640615'), '7')
+		self.assertEqual (isbn.isbn13_check_digit (u'978080442957'), '3')
+
+	def test_to_isbn13 (self):
+		for val, expected in EXAMPLES:
+			self.assertEqual (isbn.to_isbn13 (val), expected, val)
+			self.assertEqual (isbn.is_valid_isbn (val), expected is not None)
+
+	def test_isbn10_to_13 (self):
+		self.assertEqual (isbn.isbn10_to_13 ('0-306-40615-2'), '9780306406157')
+		self.assertEqual (isbn.isbn10_to_13 ('9780306406157'), None)
+		self.assertEqual (isbn.isbn10_to_13 ('0-306-40615-3'), None)
+
+
+class TestBatches (unittest.TestCase):
+	def test_python (self):
+		vals = [v for v, c in EXAMPLES]
+		self.assertEqual (isbn.canonical_isbns (vals, use_arrays=False),
+			[c for v, c in EXAMPLES])
+
+	@unittest.skipIf (isbn.numpy is None, "numpy is not installed")
+	def test_arrays (self):
+		vals = [v for v, c in EXAMPLES]
+		self.assertEqual (isbn.canonical_isbns (vals, use_arrays=True),
+			[c for v, c in EXAMPLES])
+
+	@unittest.skipIf (isbn.numpy is None, "numpy is not installed")
+	def test_arrays_agree_with_python (self):
+		rand = random.Random (1)
+		vals = []
+		for i in range (2000):
+			n = rand.choice ([9, 10, 12, 13])
+			v = ''.join ([rand.choice ('0123456789') for j in range (n)])
+			if rand.random() < 0.2:
+				v = v[:-1] + rand.choice ('Xx-')
+			if n in (9, 12):
+				# add a check digit, of the right kind or not
+				v += rand.choice ([isbn.isbn10_check_digit,
+					isbn.isbn13_check_digit])(v)
+			vals.append (v)
+		self.assertEqual (isbn.canonical_isbns (vals, use_arrays=True),
+			isbn.canonical_isbns (vals, use_arrays=False))
+
+	def test_find_duplicates (self):
+		books = [
+			('a.epub', MetadataDict.from_compact ({'identifier': [
+				('978-0-306-40615-7', {}), ('0306406152', {})]})),
+			('b.epub', MetadataDict.from_compact ({'identifier': [
+				('urn:isbn:0-306-40615-2', {})]})),
+			('c.epub', MetadataDict.from_compact ({'identifier': [
+				('9780804429573', {}), ('not an isbn', {})]})),
+		]
+		self.assertEqual (isbn.find_duplicates (books),
+			[('9780306406157', ['a.epub', 'b.epub'])])
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
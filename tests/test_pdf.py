@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for reading the metadata of PDFs.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from biblio.sniffmetadata.benchmark import make_pdf
+from biblio.sniffmetadata.dates import ParsedDate
+from biblio.sniffmetadata.instrument import Profiler, set_profiler
+from biblio.sniffmetadata.readers.pdfinfo import LazyPdfInfo, PdfInfoError, \
+	PdfName, PdfRef, parse_object
+from biblio.sniffmetadata.readers.pdfmetadatareader import PdfMetaReader
+
+
+### CONSTANTS & DEFINES
+
+HEADER = '%PDF-1.5\n%\xe2\xe3\xcf\xd3\n'
+
+
+### IMPLEMENTATION ###
+
+def _objstm_pdf (title):
+	# a PDF whose document information is compressed in an object stream
+	info = '<< /Title (%s) >>' % title
+	objstm = '3 0 ' + info
+	objs = [
+		'<< /Type /Catalog /Pages 2 0 R >>',
+		'<< /Type /Pages /Kids [] /Count 0 >>',
+		None,
+		'<< /Type /ObjStm /N 1 /First 4 /Length %d >>\nstream\n%s\nendstream' % \
+			(len (objstm), objstm),
+	]
+	out = [HEADER]
+	size = len (HEADER)
+	rows = ['\x00\x00\x00\x00\x00\xff\xff']
+	for i, o in enumerate (objs):
+		if o is None:
+			rows.append ('\x02\x00\x00\x00\x04\x00\x00')
+			continue
+		rows.append ('\x01' + ('%08x' % size).decode ('hex') + '\x00\x00')
+		chunk = '%d 0 obj\n%s\nendobj\n' % (i + 1, o)
+		out.append (chunk)
+		size += len (chunk)
+	rows.append ('\x01' + ('%08x' % size).decode ('hex') + '\x00\x00')
+	data = zlib.compress (''.join (rows))
+	out.append ('5 0 obj\n<< /Type /XRef /Size 6 /W [1 4 2] /Root 1 0 R '
+		'/Info 3 0 R /Filter /FlateDecode /Length %d >>\nstream\n%s\n'
+		'endstream\nendobj\nstartxref\n%d\n%%%%EOF\n' % (len (data), data, size))
+	return ''.join (out)
+
+
+def _replace_object (contents, num, obj, info_num=3):
+	# add an incremental update that replaces (or adds) an object
+	prev = int (re.findall (r'startxref\s+(\d+)', contents)[-1])
+	offset = len (contents)
+	update = '%d 0 obj\n%s\nendobj\n' % (num, obj)
+	xref = offset + len (update)
+	return contents + update + 'xref\n%d 1\n%010d 00000 n \ntrailer\n' \
+		'<< /Size 8 /Root 1 0 R /Info %d 0 R /Prev %d >>\nstartxref\n%d\n' \
+		'%%%%EOF\n' % (num, offset, info_num, prev, xref)
+
+
+def _append_update (contents, title):
+	# add an incremental update that replaces the document information
+	return _replace_object (contents, 6, '<< /Title (%s) >>' % title, 6)
+
+
+def _append_xref_stm (contents, stm_dict):
+	# add an update whose xref table points at a (hybrid) xref stream
+	prev = int (re.findall (r'startxref\s+(\d+)', contents)[-1])
+	offset = len (contents)
+	update = '7 0 obj\n%s\nstream\n\nendstream\nendobj\n' % stm_dict
+	xref = offset + len (update)
+	return contents + update + 'xref\n0 1\n0000000000 65535 f \ntrailer\n' \
+		'<< /Size 8 /Root 1 0 R /Info 3 0 R /Prev %d /XRefStm %d >>\n' \
+		'startxref\n%d\n%%%%EOF\n' % (prev, offset, xref)
+
+
+def _corrupt_xref_entry (contents, idx):
+	# garble an entry of a classic xref table
+	entry = re.findall (r'\d{10} 00000 n', contents)[idx]
+	return contents.replace (entry, 'xxxxxxxxxx 00000 n')
+
+
+class PdfTestCase (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def pdf (self, name='a.pdf', **kwargs):
+		p = os.path.join (self.dir, name)
+		make_pdf (p, **kwargs)
+		return p
+
+	def contents (self, **kwargs):
+		return open (self.pdf (**kwargs), 'rb').read()
+
+
+class TestParseObject (unittest.TestCase):
+	def parse (self, s):
+		return parse_object (s, 0)[0]
+
+	def test_simple (self):
+		self.assertEqual (self.parse ('42'), 42)
+		self.assertEqual (self.parse ('-1.5'), -1.5)
+		self.assertEqual (self.parse ('true'), True)
+		self.assertEqual (self.parse ('null'), None)
+		self.assertEqual (self.parse ('12 0 R'), PdfRef (12, 0))
+		name = self.parse ('/A#20Name')
+		self.assertEqual (name, '/A Name')
+		self.assertTrue (isinstance (name, PdfName))
+
+	def test_strings (self):
+		self.assertEqual (self.parse (r'(a \(b\) (c) \101\n)'),
+			'a (b) (c) A\n')
+		self.assertEqual (self.parse ('(split \\\nline)'), 'split line')
+		self.assertEqual (self.parse ('<48 65 6c6C 6>'), 'Hel\x6c\x60')
+
+	def test_containers (self):
+		self.assertEqual (self.parse ('<< /A [1 2 0 R (x)] /B << /C /D >> >>'),
+			{'/A': [1, PdfRef (2, 0), 'x'], '/B': {'/C': '/D'}})
+
+	def test_comments (self):
+		self.assertEqual (self.parse ('% a comment\n [ 1 % another\n 2 ]'),
+			[1, 2])
+
+	def test_malformed (self):
+		for s in ['', '<< /A 1', '[1 2', '(unterminated', '<4142', 'junk']:
+			self.assertRaises (PdfInfoError, parse_object, s, 0)
+
+
+class TestLazyPdfInfo (PdfTestCase):
+	def info (self, contents):
+		pdf = LazyPdfInfo (contents)
+		return pdf.documentInfo, pdf.xmpMetadata
+
+	def test_mapped_file (self):
+		hndl = open (self.pdf (title='Mapped'), 'rb')
+		try:
+			pdf = LazyPdfInfo (hndl)
+			self.assertEqual (pdf.documentInfo['/Title'], u'Mapped')
+			pdf.close()
+		finally:
+			hndl.close()
+
+	def test_xref_table (self):
+		docinfo, xmp = self.info (self.contents (title='Classic'))
+		self.assertEqual (docinfo, {'/Title': u'Classic',
+			'/Author': u'Some Author', '/CreationDate': u'D:20010203040506Z'})
+		self.assertEqual (xmp, None)
+
+	def test_xref_stream (self):
+		docinfo, xmp = self.info (self.contents (title='Stream',
+			xref_stream=True, payload_bytes=1000))
+		self.assertEqual (docinfo['/Title'], u'Stream')
+
+	def test_object_stream (self):
+		docinfo, xmp = self.info (_objstm_pdf ('Compressed'))
+		self.assertEqual (docinfo, {'/Title': u'Compressed'})
+
+	def test_incremental_update (self):
+		for xref_stream in (False, True):
+			contents = self.contents (xref_stream=xref_stream)
+			docinfo, xmp = self.info (_append_update (contents, 'Updated'))
+			self.assertEqual (docinfo, {'/Title': u'Updated'})
+
+	def test_wrong_offsets (self):
+		# the xref entry for the document information points nowhere
+		contents = self.contents (title='Moved')
+		entries = re.findall (r'\d{10} 00000 n', contents)
+		contents = contents.replace (entries[2], '%010d 00000 n' % 1)
+		self.assertEqual (self.info (contents)[0]['/Title'], u'Moved')
+
+	def test_text_strings (self):
+		# UTF-16 with a byte order mark, or PDFDocEncoding
+		contents = self.contents (title=r'\376\377\000T\000\351',
+			author=r'Caf\351')
+		docinfo = self.info (contents)[0]
+		self.assertEqual (docinfo['/Title'], u'T\xe9')
+		self.assertEqual (docinfo['/Author'], u'Caf\xe9')
+
+	def test_xmp (self):
+		for xref_stream in (False, True):
+			docinfo, xmp = self.info (self.contents (title='With XMP',
+				xmp=True, xref_stream=xref_stream))
+			self.assertTrue ('<dc:title>' in xmp)
+			self.assertTrue ('With XMP' in xmp)
+
+	def test_unhandled (self):
+		contents = self.contents()
+		self.assertRaises (PdfInfoError, self.info,
+			contents.replace ('/Info 3 0 R', '/Info 3 0 R /Encrypt 9 0 R'))
+		self.assertRaises (PdfInfoError, self.info,
+			contents.replace ('startxref', 'startref'))
+		self.assertRaises (PdfInfoError, self.info, 'not a PDF at all')
+
+	def test_malformed (self):
+		self.assertRaises (PdfInfoError, self.info,
+			_corrupt_xref_entry (self.contents(), 2))
+		self.assertRaises (PdfInfoError, self.info,
+			_append_xref_stm (self.contents(),
+			'<< /Type /XRef /Size 8 /Length 0 >>'))
+		self.assertRaises (PdfInfoError, self.info,
+			self.contents (xref_stream=True).replace ('/W [1 4 2]', '/W [1 4]  '))
+		self.assertRaises (PdfInfoError, self.info,
+			_objstm_pdf ('Compressed').replace ('3 0 << /Title', '3 x << /Title'))
+
+	def test_malformed_xmp (self):
+		# the packet is skipped, not the document
+		data = zlib.compress ('x')
+		contents = _replace_object (self.contents (xmp=True), 5,
+			'<< /Filter /Fl /DecodeParms << /Predictor 12 /Columns (x) >> '
+			'/Length %d >>\nstream\n%s\nendstream' % (len (data), data))
+		docinfo, xmp = self.info (contents)
+		self.assertEqual (docinfo['/Title'], u'A Title: With Subtitle')
+		self.assertEqual (xmp, None)
+
+
+class TestPdfMetaReader (PdfTestCase):
+	def metadata (self, path):
+		rdr = PdfMetaReader (path)
+		try:
+			return rdr.read_metadata_as_dublincore()
+		finally:
+			rdr.close()
+
+	def test_docinfo (self):
+		md = self.metadata (self.pdf (title='Classic'))
+		self.assertEqual ([x.value for x in md['title']], [u'Classic'])
+		self.assertEqual ([x.value for x in md['creator']], [u'Some Author'])
+		self.assertEqual ([(x.value, x.attribs) for x in md['date']],
+			[('2001-02-03T04:05:06Z', {'event': 'creation'})])
+
+	def test_xmp (self):
+		md = self.metadata (self.pdf (title='With XMP', xmp=True))
+		self.assertEqual ([x.value for x in md['title']], [u'With XMP'])
+		self.assertEqual ([x.value for x in md.isbn()], ['978-0-306-40615-7'])
+
+	def fallbacks (self, contents):
+		# read a PDF, returning its title & how often pyPdf was used
+		path = os.path.join (self.dir, 'fallback.pdf')
+		hndl = open (path, 'wb')
+		hndl.write (contents)
+		hndl.close()
+		prof = Profiler()
+		old_prof = set_profiler (prof)
+		try:
+			try:
+				title = self.metadata (path)['title'][0].value
+			except Exception, err:
+				title = err
+		finally:
+			set_profiler (old_prof)
+		return title, prof.to_dict()['counters'].get ('pdf.fallbacks', 0)
+
+	def test_fallback_on_xref_stream_without_widths (self):
+		# pyPdf ignores the hybrid xref stream & reads the table
+		contents = _append_xref_stm (self.contents (title='Hybrid'),
+			'<< /Type /XRef /Size 8 /Length 0 >>')
+		self.assertEqual (self.fallbacks (contents), (u'Hybrid', 1))
+
+	def test_fallback_on_corrupt_xref_table (self):
+		# pyPdf can make no more of the table, but is tried
+		title, count = self.fallbacks (_corrupt_xref_entry (self.contents(), 2))
+		self.assertEqual (count, 1)
+		self.assertFalse (isinstance (title, PdfInfoError))
+
+
+class TestDocinfo (PdfTestCase):
+	def test_values_that_are_not_strings (self):
+		rdr = PdfMetaReader (self.pdf())
+		try:
+			docinfo = {'/Title': 'A Title', '/CreationDate': 'D:2001',
+				'/Trapped': 1, '/Keywords': None, '/Pages': [1, 2]}
+			self.assertEqual (rdr.munge_docinfo_to_dublincore (docinfo), {
+				'Title': 'A Title',
+				'CreationDate': ParsedDate (2001, None, None, None, None, None,
+					None),
+				'Trapped': 1,
+				'Keywords': None,
+				'Pages': [1, 2],
+			})
+			md = rdr.munge_metadata_to_dublincore ((docinfo, None))
+			self.assertEqual ([x.value for x in md['title']], ['A Title'])
+		finally:
+			rdr.close()
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
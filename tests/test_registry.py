@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for choosing a reader by sniffing the start of a file.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import unittest
+
+from biblio.sniffmetadata.readers.registry import default_registry, \
+	ZIP_MAGIC, EPUB_MIMETYPE
+
+
+### CONSTANTS & DEFINES
+
+EPUB_HEAD = ZIP_MAGIC + '\0' * 22 + '\x08\0\0\0' + 'mimetype' + EPUB_MIMETYPE
+
+
+### IMPLEMENTATION ###
+
+class TestReaderForHead (unittest.TestCase):
+	def reader_name (self, head, ext):
+		rdr = default_registry.reader_for_head (head, ext)
+		return rdr and rdr.__name__
+
+	def test_by_contents (self):
+		self.assertEqual (self.reader_name (EPUB_HEAD, 'epub'),
+			'EpubMetaReader')
+		self.assertEqual (self.reader_name ('%PDF-1.4\n', 'pdf'),
+			'PdfMetaReader')
+
+	def test_misnamed (self):
+		self.assertEqual (self.reader_name ('%PDF-1.4\n', 'epub'),
+			'PdfMetaReader')
+		self.assertEqual (self.reader_name (EPUB_HEAD, 'pdf'),
+			'EpubMetaReader')
+
+	def test_contents_contradict_extension (self):
+		self.assertEqual (self.reader_name ('Just some text', 'epub'), None)
+		self.assertEqual (self.reader_name ('Just some text', 'pdf'), None)
+
+	def test_nothing_to_sniff (self):
+		self.assertEqual (self.reader_name ('', 'epub'), 'EpubMetaReader')
+		self.assertEqual (self.reader_name ('', 'txt'), None)
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for planning renames and the journal used to resume or undo them.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from biblio.sniffmetadata import rename
+
+
+### IMPLEMENTATION ###
+
+class RenameTestCase (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.journal_path = os.path.join (self.dir, 'journal')
+		self.books = []
+		for name in ['a.epub', 'b.epub', 'c.epub']:
+			p = os.path.join (self.dir, name)
+			hndl = open (p, 'wb')
+			hndl.write (name)
+			hndl.close()
+			self.books.append (p)
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def listing (self):
+		return sorted ([x for x in os.listdir (self.dir) if x != 'journal'])
+
+	def start (self, new_names, copy=False):
+		ops = rename.plan_renames (zip (self.books, new_names), copy=copy)
+		journal = rename.RenameJournal (self.journal_path)
+		journal.start (ops)
+		return ops, journal
+
+
+class TestPlanRenames (RenameTestCase):
+	def test_clashes_are_numbered (self):
+		ops = rename.plan_renames (zip (self.books, ['X.epub', 'X.epub',
+			'a.epub']))
+		self.assertEqual ([os.path.basename (op.dest) for op in ops],
+			['X.epub', 'X (2).epub', 'a (2).epub'])
+
+	def test_unchanged_names_are_left_out (self):
+		ops = rename.plan_renames ([(self.books[0], 'a.epub')])
+		self.assertEqual (ops, [])
+
+	def test_planning_again_changes_nothing (self):
+		new_names = ['Name.epub', 'Name.epub', 'Other.epub']
+		ops = rename.plan_renames (zip (self.books, new_names))
+		for op in ops:
+			os.rename (op.src, op.dest)
+		self.assertEqual (self.listing(), ['Name (2).epub', 'Name.epub',
+			'Other.epub'])
+		books = [op.dest for op in ops]
+		for i in range (2):
+			self.assertEqual (rename.plan_renames (zip (books, new_names)), [])
+
+	def test_own_numbered_name_is_kept (self):
+		numbered = os.path.join (self.dir, 'Name (2).epub')
+		os.rename (self.books[1], numbered)
+		ops = rename.plan_renames ([(self.books[0], 'Name.epub'),
+			(numbered, 'Name.epub')])
+		self.assertEqual ([os.path.basename (op.dest) for op in ops],
+			['Name.epub'])
+
+	def test_unsafe_names (self):
+		self.assertEqual (rename.safe_name ('a/b\\c'), 'a_b_c')
+		self.assertEqual (rename.safe_name ('..'), '_')
+
+
+class TestJournal (RenameTestCase):
+	def test_apply_and_rollback (self):
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'])
+		results = rename.apply_plan (ops, journal)
+		journal.close()
+		self.assertEqual (results['rename'], 3)
+		self.assertEqual (self.listing(), ['X.epub', 'Y.epub', 'Z.epub'])
+		self.assertEqual (rename.read_journal (self.journal_path).status,
+			rename.STATUS_COMPLETE)
+		results = rename.rollback (self.journal_path)
+		self.assertEqual (results['undone'], 3)
+		self.assertEqual (self.listing(), ['a.epub', 'b.epub', 'c.epub'])
+		self.assertEqual (rename.read_journal (self.journal_path).status,
+			rename.STATUS_ROLLED_BACK)
+
+	def test_crash_then_rollback (self):
+		# one rename done but never marked, as if the run died mid-directory
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'])
+		rename._apply (ops[0])
+		journal.close()
+		results = rename.rollback (self.journal_path)
+		self.assertEqual (results, {'undone': 1, 'errors': []})
+		self.assertEqual (self.listing(), ['a.epub', 'b.epub', 'c.epub'])
+		self.assertEqual (rename.read_journal (self.journal_path).status,
+			rename.STATUS_ROLLED_BACK)
+
+	def test_crash_then_resume (self):
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'])
+		rename._apply (ops[0])
+		journal.close()
+		results = rename.resume (self.journal_path)
+		self.assertEqual (results['already done'], 1)
+		self.assertEqual (results['rename'], 2)
+		self.assertEqual (self.listing(), ['X.epub', 'Y.epub', 'Z.epub'])
+		self.assertEqual (rename.read_journal (self.journal_path).status,
+			rename.STATUS_COMPLETE)
+
+	def test_truncated_journal (self):
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'])
+		journal.close()
+		hndl = open (self.journal_path, 'ab')
+		hndl.write ('{"done": [0')
+		hndl.close()
+		state = rename.read_journal (self.journal_path)
+		self.assertEqual (len (state.ops), 3)
+		self.assertEqual (state.done, set())
+		self.assertEqual (state.status, rename.STATUS_PENDING)
+
+	def test_unfinished_journal_is_kept (self):
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'])
+		journal.close()
+		self.assertRaises (rename.RenameError, self.start, ['P.epub',
+			'Q.epub', 'R.epub'])
+
+	def test_resume_after_rollback (self):
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'])
+		journal.close()
+		rename.rollback (self.journal_path)
+		self.assertRaises (rename.RenameError, rename.resume,
+			self.journal_path)
+
+	def test_missing_journal (self):
+		self.assertRaises (rename.RenameError, rename.rollback,
+			self.journal_path)
+
+	def test_copy_and_rollback (self):
+		ops, journal = self.start (['X.epub', 'Y.epub', 'Z.epub'], copy=True)
+		results = rename.apply_plan (ops, journal)
+		journal.close()
+		self.assertEqual (len (self.listing()), 6)
+		self.assertEqual (open (os.path.join (self.dir, 'X.epub')).read(),
+			'a.epub')
+		self.assertFalse (results['errors'])
+		rename.rollback (self.journal_path)
+		self.assertEqual (self.listing(), ['a.epub', 'b.epub', 'c.epub'])
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for the server that reads metadata on request.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from biblio.sniffmetadata import server
+from biblio.sniffmetadata.batch import ScanResult
+from biblio.sniffmetadata.benchmark import make_epub
+
+
+### IMPLEMENTATION ###
+
+class TestSocketPath (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join (self.dir, 'sniff.sock')
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def test_other_files_are_left_alone (self):
+		notes = os.path.join (self.dir, 'notes.txt')
+		open (notes, 'w').write ('important')
+		os.symlink (notes, self.path)
+		for p in [notes, self.path]:
+			self.assertRaises (socket.error, server.make_server, socket_path=p,
+				quiet=True)
+		self.assertEqual (open (notes).read(), 'important')
+		self.assertTrue (os.path.islink (self.path))
+
+	def test_old_socket_is_replaced (self):
+		sock = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.bind (self.path)
+		sock.close()
+		srv = server.make_server (socket_path=self.path, quiet=True)
+		server.close_server (srv)
+		self.assertFalse (os.path.exists (self.path))
+
+
+class TestRequests (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join (self.dir, 'sniff.sock')
+		self.server = server.make_server (socket_path=self.path, quiet=True)
+		self.thread = threading.Thread (target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def tearDown (self):
+		self.server.shutdown()
+		server.close_server (self.server)
+		shutil.rmtree (self.dir)
+
+	def request (self, headers, body=''):
+		# send a raw request, returning the status & decoded reply
+		sock = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout (10)
+		sock.connect (self.path)
+		sock.sendall ('POST /sniff HTTP/1.0\r\n%s\r\n%s' % (''.join (['%s: %s\r\n'
+			% x for x in headers]), body))
+		reply = ''
+		while True:
+			data = sock.recv (4096)
+			if not data:
+				break
+			reply += data
+		sock.close()
+		head, body = reply.split ('\r\n\r\n', 1)
+		return int (head.split()[1]), json.loads (body)
+
+	def test_sniff (self):
+		book = os.path.join (self.dir, 'a.epub')
+		make_epub (book, title='Served')
+		body = json.dumps ({'paths': [book]})
+		code, reply = self.request ([('Content-Type', 'application/json'),
+			('Content-Length', len (body))], body)
+		self.assertEqual (code, 200)
+		res = reply['results'][0]
+		self.assertEqual (res['path'], book)
+		self.assertEqual (res['metadata']['title'][0]['value'], 'Served')
+
+	def test_bad_lengths (self):
+		self.assertEqual (self.request ([])[0], 411)
+		for length in ['-1', 'lots', '1.5']:
+			code, reply = self.request ([('Content-Length', length)])
+			self.assertEqual (code, 400)
+			self.assertTrue ('error' in reply)
+
+
+class TestResultToJson (unittest.TestCase):
+	def test_paths_not_utf8 (self):
+		res = server.result_to_json (ScanResult ('/a/\xff.epub', None, None))
+		self.assertTrue (json.dumps (res))
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Tests for running an unpacking tool over many archives.
+"""
+
+__author__ = "Paul-Michael Agapow (pma@agapow.net)"
+
+
+### IMPORTS
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from biblio.sniffmetadata import unpack
+
+
+### CONSTANTS & DEFINES
+
+# starts a child that ignores TERM & records its pid, then waits
+STUBBORN_SCRIPT = """
+sh -c 'trap "" TERM; echo $$ > "%s"; exec sleep 300' &
+sleep 300
+"""
+
+
+### IMPLEMENTATION ###
+
+def _is_running (pid):
+	try:
+		os.kill (pid, 0)
+	except OSError, err:
+		return err.errno != errno.ESRCH
+	# a zombie, not yet reaped by init, has also finished
+	try:
+		stat = open ('/proc/%d/stat' % pid).read()
+	except IOError:
+		return True
+	return stat.split (')')[-1].split()[0] != 'Z'
+
+
+class TestUnpackScheduler (unittest.TestCase):
+	def setUp (self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown (self):
+		shutil.rmtree (self.dir)
+
+	def run_with (self, script, timeout):
+		make_args = lambda path, **kwargs: ['sh', '-c', script]
+		sched = unpack.UnpackScheduler (jobs=1, timeout=timeout,
+			make_args=make_args)
+		return list (sched.run (['book.sit']))
+
+	def test_ok (self):
+		results = self.run_with ('echo done', 10)
+		self.assertEqual (results[0].status, unpack.STATUS_OK)
+		self.assertEqual (results[0].output.strip(), 'done')
+
+	def test_failed (self):
+		results = self.run_with ('exit 3', 10)
+		self.assertEqual (results[0].status, unpack.STATUS_FAILED)
+		self.assertEqual (results[0].returncode, 3)
+
+	def test_timeout_kills_children_ignoring_term (self):
+		pid_path = os.path.join (self.dir, 'pid')
+		results = self.run_with (STUBBORN_SCRIPT % pid_path, 0.5)
+		self.assertEqual (results[0].status, unpack.STATUS_TIMEOUT)
+		pid = int (open (pid_path).read())
+		for i in range (50):
+			if not _is_running (pid):
+				break
+			time.sleep (0.05)
+		self.assertFalse (_is_running (pid))
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+
+### END #######################################################################